@@ -0,0 +1,124 @@
+"""
+Measures the write throughput of the sql worker during a burst of match
+ends, once committing after every command and once with group commit.
+Every client reports the end of matches like the game server does, it
+records the result of the match, waiting for each response. The sql worker runs on a fresh database in a temporary
+directory, no database server is needed:
+
+python -m Akuga.AkugaDatabaseServer.CommitBenchmark $clients $matches
+"""
+import os
+import sys
+import time
+import sqlite3
+import tempfile
+from queue import Queue
+from threading import (Thread, Event)
+from Akuga.AkugaDatabaseServer.main import sql_worker
+from Akuga.AkugaDatabaseServer.UserStats import record_match_result
+from Akuga.AkugaDatabaseServer.UserCharacteristics import register_user
+from Akuga.AkugaDatabaseServer.GlobalDefinitions import SQL_MAX_BATCH_SIZE
+
+
+# The commands sent to the database server at the end of a match
+COMMANDS_PER_MATCH = 1
+
+
+class ResponseWaiter:
+    """
+    Takes the place of the communicator of a client and lets the client
+    wait for the response to its command
+    """
+    def __init__(self):
+        self.received = Event()
+        self.response = None
+
+    def send_packet(self, tokens):
+        self.response = tokens
+        self.received.set()
+
+    def wait(self):
+        self.received.wait()
+        self.received.clear()
+        return self.response
+
+
+def report_match_ends(cmd_queue, number, matches, latencies):
+    """
+    Report the end of matches between the users of a client, the
+    latency of every command is appended to latencies
+    """
+    waiter = ResponseWaiter()
+    victor = 'victor' + str(number)
+    looser = 'looser' + str(number)
+    for i in range(matches):
+        start = time.perf_counter()
+        record_match_result(waiter, 'bench', cmd_queue, 'lms', victor,
+            [looser], 50)
+        if waiter.wait()[0] != 'SUCCESS':
+            raise RuntimeError(str(waiter.response))
+        latencies.append(time.perf_counter() - start)
+
+
+def run_burst(clients, matches, max_batch_size):
+    """
+    Run the burst against a fresh database and return the elapsed
+    seconds, the latencies of all commands, the amount of recorded wins and
+    the credits rewarded
+    """
+    directory = tempfile.mkdtemp()
+    database_path = os.path.join(directory, 'akuga.db')
+    cmd_queue = Queue(512)
+    worker = Thread(target=sql_worker,
+        args=(cmd_queue, database_path, max_batch_size))
+    worker.start()
+    waiter = ResponseWaiter()
+    for number in range(clients):
+        for name in ('victor' + str(number), 'looser' + str(number)):
+            register_user(waiter, 'bench', cmd_queue, name, '', 0, '{}')
+            waiter.wait()
+
+    latencies = []
+    threads = [Thread(target=report_match_ends,
+        args=(cmd_queue, number, matches, latencies))
+        for number in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    cmd_queue.put((None, None, None))
+    worker.join()
+
+    database = sqlite3.connect(database_path)
+    wins = database.execute('select sum(wins) from userstats').fetchone()[0]
+    credits = database.execute(
+        'select sum(credits) from user_accounts').fetchone()[0]
+    database.close()
+    for name in os.listdir(directory):
+        os.remove(os.path.join(directory, name))
+    os.rmdir(directory)
+    return elapsed, sorted(latencies), wins, credits
+
+
+if __name__ == '__main__':
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    matches = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    commands = clients * matches * COMMANDS_PER_MATCH
+    results = {}
+    for name, max_batch_size in (('commit per command', 1),
+            ('group commit', SQL_MAX_BATCH_SIZE)):
+        elapsed, latencies, wins, credits = run_burst(clients, matches,
+            max_batch_size)
+        results[name] = elapsed
+        print('%s: %d commands in %.2f s, %.0f match ends per second, '
+            'latency p50 %.1f ms p99 %.1f ms' % (name, commands, elapsed,
+            clients * matches / elapsed,
+            1000 * latencies[len(latencies) // 2],
+            1000 * latencies[int(len(latencies) * 0.99)]))
+        if wins != clients * matches or credits != 50 * clients * matches:
+            print('  expected %d wins, recorded %s wins and %s credits' % (
+                clients * matches, wins, credits))
+    print('group commit speedup: %.1fx' % (results['commit per command']
+        / results['group commit']))
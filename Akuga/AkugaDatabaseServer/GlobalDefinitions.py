@@ -1,3 +1,13 @@
 SERVER_ADDRESS = ('127.0.0.1', 10098)
 MAX_ACTIVE_CONNECTIONS = 1024
 DATABASE_PATH = "akuga.db"
+# The max amount of commands the sql worker executes in one transaction
+SQL_MAX_BATCH_SIZE = 256
+# Seconds the sql worker waits for further commands before it commits,
+# 0 commits everything queued without waiting
+SQL_MAX_BATCH_DELAY = 0
+# The amount of read only connections answering queries concurrently
+SQL_READER_CONNECTIONS = 4
+# Seconds between two checks if the jumons table has changed and the
+# jumon catalog has to be reloaded
+JUMON_CATALOG_REFRESH_INTERVAL = 1
@@ -1,45 +1,156 @@
+import time
 import logging
+from threading import Lock
 
 # Get the logger
 logger = logging.getLogger('AkugaDatabaseServer.Jumons')
 
 
-def get_all_jumon_names(communicator, client_address, cmd_queue):
+class JumonCatalog:
     """
-    Query the database for the names of all jumons
+    An in memory copy of the jumons table. The table is barely ever
+    changed, so the catalog commands are answered from this copy by the
+    thread handling the client and never reach the sql worker.
+    Every change of the jumons table increments the catalog version in
+    the database (see the migrations), the catalog is reloaded if its
+    version differs from the one in the database.
+    The results are stored in the form they are send to the clients,
+    a reload replaces all of them at once
     """
-    command = ("select name from jumons", ())
-    logger.info("Enqueue 'get_all_jumon_names' from: " + str(client_address))
-    cmd_queue.put((communicator, client_address, command))
+    def __init__(self):
+        self.version = None
+        self.jumon_names = ('SUCCESS', )
+        self.basic_jumon_names = ('SUCCESS', )
+        self.vanilla_jumon_stats = ('SUCCESS', )
+        self.jumons_by_name = {}
+        self.lock = Lock()
 
+    def load(self, database):
+        """
+        Load the whole jumons table and the catalog version, both are
+        read in one transaction so they belong together
+        """
+        database.execute('begin')
+        try:
+            version = get_database_catalog_version(database)
+            jumons = database.execute('select * from jumons').fetchall()
+        finally:
+            database.rollback()
+        # The columns are: name, color, attack, defense, movement,
+        # special, price, basic, flavor
+        jumon_names = ('SUCCESS', ) + tuple((jumon[0], ) for jumon in jumons)
+        basic_jumon_names = ('SUCCESS', ) + tuple((jumon[0], )
+            for jumon in jumons if jumon[7] == 1)
+        vanilla_jumon_stats = ('SUCCESS', ) + tuple(jumon[:5]
+            for jumon in jumons if jumon[5] == 0)
+        jumons_by_name = {}
+        for jumon in jumons:
+            jumons_by_name.setdefault(jumon[0], []).append(jumon)
+        with self.lock:
+            self.version = version
+            self.jumon_names = jumon_names
+            self.basic_jumon_names = basic_jumon_names
+            self.vanilla_jumon_stats = vanilla_jumon_stats
+            self.jumons_by_name = jumons_by_name
+        logger.info('Loaded ' + str(len(jumons)) + ' jumons, catalog version '
+            + str(version))
 
-def get_all_basic_jumon_names(communicator, client_address, cmd_queue):
+    def refresh(self, database):
+        """
+        Reload the catalog if the jumons table has changed since it was
+        loaded. Returns if the catalog was reloaded
+        """
+        if get_database_catalog_version(database) == self.version:
+            return False
+        self.load(database)
+        return True
+
+    def get_version(self):
+        with self.lock:
+            return self.version
+
+    def get_jumon_names(self):
+        with self.lock:
+            return self.jumon_names
+
+    def get_basic_jumon_names(self):
+        with self.lock:
+            return self.basic_jumon_names
+
+    def get_vanilla_jumon_stats(self):
+        with self.lock:
+            return self.vanilla_jumon_stats
+
+    def get_jumon_by_name(self, jumon_name):
+        with self.lock:
+            return ('SUCCESS', ) + tuple(
+                self.jumons_by_name.get(jumon_name, ()))
+
+
+def get_database_catalog_version(database):
+    """
+    Return the catalog version stored in the database
+    """
+    return database.execute(
+        'select version from jumon_catalog_version').fetchone()[0]
+
+
+def refresh_catalog_periodically(catalog, database, interval):
+    """
+    Check every interval seconds if the jumons table has changed and
+    reload the catalog if so. This way changes made directly to the
+    database file reach the catalog as well
     """
-    Query the database for the name of all basic jumons
+    while True:
+        time.sleep(interval)
+        try:
+            if catalog.refresh(database):
+                logger.info('Reloaded the jumon catalog')
+        except Exception:
+            logger.exception('Cant refresh the jumon catalog')
+
+
+def get_all_jumon_names(communicator, client_address, catalog):
+    """
+    Send the names of all jumons
+    """
+    logger.info("Answer 'get_all_jumon_names' from: " + str(client_address))
+    communicator.send_packet(catalog.get_jumon_names())
+
+
+def get_all_basic_jumon_names(communicator, client_address, catalog):
+    """
+    Send the name of all basic jumons
     aka all jumons a user starts with
     """
-    command = ("select name from jumons where basic=1", ())
-    logger.info("Enqueue 'get_all_basic_jumon_names' from: "
+    logger.info("Answer 'get_all_basic_jumon_names' from: "
         + str(client_address))
-    cmd_queue.put((communicator, client_address, command))
+    communicator.send_packet(catalog.get_basic_jumon_names())
 
 
-def get_all_vanilla_jumon_stats(communicator, client_address, cmd_queue):
+def get_all_vanilla_jumon_stats(communicator, client_address, catalog):
     """
-    Query the database for all battle related values of all vanilla jumons
-    aka all jumons without a special effect
+    Send all battle related values of all vanilla jumons
+    aka all jumons without a special effect in the form:
+    name, color, attack, defense, movement
     """
-    command = ("select name, color, attack, defense, movement from jumons where special=0", ())
-    logger.info("Enqueue 'get_all_vanilla_jumon_stats' from: "
+    logger.info("Answer 'get_all_vanilla_jumon_stats' from: "
         + str(client_address))
-    cmd_queue.put((communicator, client_address, command))
+    communicator.send_packet(catalog.get_vanilla_jumon_stats())
 
 
-def get_jumon_by_name(communicator, client_address, cmd_queue, jumon_name):
+def get_jumon_by_name(communicator, client_address, catalog, jumon_name):
     """
-    Query the database for a jumon by its name
+    Send the whole datastructure of a jumon
     """
-    command = ("select * from jumons where name=?", (jumon_name, ))
-    logger.info("Enqueue 'get_jumon_by_name' from: "
+    logger.info("Answer 'get_jumon_by_name' from: "
         + str(client_address))
-    cmd_queue.put((communicator, client_address, command))
+    communicator.send_packet(catalog.get_jumon_by_name(jumon_name))
+
+
+def get_jumon_catalog_version(communicator, client_address, catalog):
+    """
+    Send the version of the jumon catalog, it changes whenever the
+    jumons table changes
+    """
+    communicator.send_packet(['SUCCESS', [catalog.get_version()]])
@@ -0,0 +1,81 @@
+"""
+Measures the latency of the lookups the database server does most, once
+with the schema without keys (version 1) and once migrated to the
+current schema version. The lookups are the user by name lookup of a
+login and the check for an existing daily userstats entry done before
+every ADD_WIN and ADD_LOOSE. The databases are filled with users in a
+temporary directory:
+
+python -m Akuga.AkugaDatabaseServer.LookupBenchmark $users $users ...
+"""
+import os
+import sys
+import time
+import random
+import sqlite3
+import tempfile
+from Akuga.AkugaDatabaseServer.Migrations import (
+    SCHEMA_VERSION,
+    migrate_database)
+
+
+# The amount of days every user has userstats for
+DAYS_PER_USER = 3
+# Seconds each lookup is repeated for
+LOOKUP_SECONDS = 1
+LOOKUPS = [
+    ('user by name', 'select * from user_accounts where name=?',
+        lambda name: (name, )),
+    ('daily userstats entry', '''select 1 from userstats where name=? and
+        mode=? and date=?''', lambda name: (name, 'lms', '2024-01-02'))]
+
+
+def fill_database(database, users):
+    """
+    Insert users and their userstats of some days
+    """
+    database.executemany('insert into user_accounts values (?,?,?,?,?,?,?)',
+        (('user' + str(i), 'hash', 0, '{}', '{}', '{}', '{}')
+            for i in range(users)))
+    database.executemany('insert into userstats values (?,?,?,?,?)',
+        (('user' + str(i), 'lms', '2024-01-0' + str(day + 1), 1, 1)
+            for i in range(users) for day in range(DAYS_PER_USER)))
+    database.commit()
+
+
+def measure_lookup(database, users, query, parameters):
+    """
+    Return the mean seconds of the lookup of random users
+    """
+    lookups = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < LOOKUP_SECONDS or lookups < 3:
+        name = 'user' + str(random.randrange(users))
+        database.execute(query, parameters(name)).fetchall()
+        lookups += 1
+    return (time.perf_counter() - start) / lookups
+
+
+if __name__ == '__main__':
+    sizes = [int(size) for size in sys.argv[1:]] or\
+        [10000, 100000, 1000000]
+    for users in sizes:
+        directory = tempfile.mkdtemp()
+        database_path = os.path.join(directory, 'akuga.db')
+        database = sqlite3.connect(database_path)
+        migrate_database(database, 1)
+        fill_database(database, users)
+        for version in (1, SCHEMA_VERSION):
+            start = time.perf_counter()
+            migrate_database(database, version)
+            migration_seconds = time.perf_counter() - start
+            for name, query, parameters in LOOKUPS:
+                print('%8d users, schema version %d, %-22s %10.1f us' % (
+                    users, version, name + ':',
+                    1e6 * measure_lookup(database, users, query,
+                        parameters)))
+        print('%8d users, migration to version %d took %.2f s' % (users,
+            SCHEMA_VERSION, migration_seconds))
+        database.close()
+        os.remove(database_path)
+        os.rmdir(directory)
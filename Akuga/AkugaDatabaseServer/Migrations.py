@@ -0,0 +1,197 @@
+"""
+The versioned schema of the akuga database. The version of a database
+is stored in its user_version, every migration brings the database from
+the previous version to its own version. All migrations a database is
+missing are applied in one transaction. Existing databases are migrated
+in place when the sql worker opens them.
+A database file can be migrated by hand as well:
+
+python -m Akuga.AkugaDatabaseServer.Migrations $database_path
+"""
+import sys
+import sqlite3
+import logging
+from Akuga.AkugaDatabaseServer.GlobalDefinitions import DATABASE_PATH
+
+
+# Get the logger
+logger = logging.getLogger('AkugaDatabaseServer.Migrations')
+
+
+def create_tables(cursor):
+    """
+    The schema before there were migrations, the tables have neither
+    keys nor indexes
+    """
+    cursor.execute('''create table if not exists userstats
+        (name text, mode text, date text, wins real, looses real)''')
+    cursor.execute('''create table if not exists user_accounts
+        (name text, pass_hash text, credits real, collection text,
+        set1 text, set2 text, set3 text)''')
+    cursor.execute('''create table if not exists jumons
+        (name text, color text, attack real, defense real, movement real,
+        special real, price real, basic real, flavor text)''')
+
+
+def add_user_keys(cursor):
+    """
+    Make the name of a user unique and the name, mode and date the
+    primary key of the userstats, so looking them up doesnt scan the
+    whole table. Duplicated userstats are merged. Duplicated users hold
+    credits and collections of their own, so the migration fails and
+    lists their names, they have to be resolved by hand. Users without a
+    name dont collide in the unique index and are kept
+    """
+    duplicates = [row[0] for row in cursor.execute('''select name
+        from user_accounts where name is not null
+        group by name having count(*) > 1''')]
+    if duplicates:
+        raise sqlite3.IntegrityError('Duplicated users, keep only one '
+            + 'account of each: ' + ', '.join(map(str, duplicates)))
+    cursor.execute('''create unique index user_accounts_name
+        on user_accounts(name)''')
+    cursor.execute('''create table userstats_by_key
+        (name text, mode text, date text, wins real, looses real,
+        primary key (name, mode, date))''')
+    cursor.execute('''insert into userstats_by_key
+        select name, mode, date, sum(wins), sum(looses) from userstats
+        group by name, mode, date''')
+    cursor.execute('drop table userstats')
+    cursor.execute('alter table userstats_by_key rename to userstats')
+
+
+def normalize_collections(cursor):
+    """
+    Move the collections and the jumon sets of the users out of the json
+    objects in user_accounts into their own tables with one row per
+    jumon of a user, so collections can be queried per jumon and a
+    purchase only touches a single row. Values which arent valid json
+    objects of amounts are dropped.
+    user_accounts is rebuilt without the json columns, alter table drop
+    column needs sqlite 3.35
+    """
+    cursor.execute('''create table user_collections
+        (name text, jumon text, count integer,
+        primary key (name, jumon))''')
+    cursor.execute('''create index user_collections_jumon
+        on user_collections(jumon)''')
+    cursor.execute('''create table user_sets
+        (name text, set_index integer, jumon text, count integer,
+        primary key (name, set_index, jumon))''')
+    cursor.execute('''insert into user_collections
+        select a.name, j.key, j.value
+        from user_accounts a, json_each(a.collection) j
+        where json_valid(a.collection)
+        and json_type(a.collection) = 'object'
+        and j.type = 'integer' and j.value > 0''')
+    for set_index, column in enumerate(('set1', 'set2', 'set3')):
+        cursor.execute('''insert into user_sets
+            select a.name, ?, j.key, j.value
+            from user_accounts a, json_each(a.{0}) j
+            where json_valid(a.{0}) and json_type(a.{0}) = 'object'
+            and j.type = 'integer' and j.value > 0'''.format(column),
+            (set_index, ))
+    cursor.execute('''create table user_accounts_normalized
+        (name text, pass_hash text, credits real)''')
+    cursor.execute('''insert into user_accounts_normalized
+        select name, pass_hash, credits from user_accounts''')
+    cursor.execute('drop table user_accounts')
+    cursor.execute('''alter table user_accounts_normalized
+        rename to user_accounts''')
+    cursor.execute('''create unique index user_accounts_name
+        on user_accounts(name)''')
+
+
+def add_jumon_catalog_version(cursor):
+    """
+    Count the changes of the jumons table, so the in memory catalog of
+    the database server notices when it has to be reloaded. Triggers
+    increment the version, this way changes made to the database file
+    by hand are counted as well
+    """
+    cursor.execute('''create table jumon_catalog_version
+        (version integer)''')
+    cursor.execute('insert into jumon_catalog_version values (0)')
+    for event in ('insert', 'update', 'delete'):
+        cursor.execute('''create trigger jumons_{0}_version
+            after {0} on jumons begin
+            update jumon_catalog_version set version=version+1;
+            end'''.format(event))
+
+
+def add_stats_rollups(cursor):
+    """
+    Sum the userstats up per week, month and season (a quarter of a
+    year), the date of an entry is the first day of its period. The
+    rollups are filled with the existing userstats, from then on they
+    are updated together with the userstats
+    """
+    periods = [
+        ('userstats_weekly', "date(date, 'weekday 0', '-6 days')"),
+        ('userstats_monthly', "strftime('%Y-%m-01', date)"),
+        ('userstats_seasons', '''printf('%s-%02d-01', strftime('%Y', date),
+            (cast(strftime('%m', date) as integer) - 1) / 3 * 3 + 1)''')]
+    for table, period_start in periods:
+        cursor.execute('''create table {0}
+            (name text, mode text, date text, wins real, looses real,
+            primary key (name, mode, date))'''.format(table))
+        cursor.execute('''insert into {0}
+            select name, mode, {1}, sum(wins), sum(looses) from userstats
+            where date(date) is not null
+            group by name, mode, {1}'''.format(table, period_start))
+
+
+# All migrations in the form: version, description, migration function
+MIGRATIONS = [
+    (1, 'create the tables', create_tables),
+    (2, 'add keys to user_accounts and userstats', add_user_keys),
+    (3, 'move collections and jumon sets into their own tables',
+        normalize_collections),
+    (4, 'count the changes of the jumons table', add_jumon_catalog_version),
+    (5, 'sum the userstats up per week, month and season',
+        add_stats_rollups)]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(database):
+    """
+    Return the schema version of the database, 0 for a new database
+    """
+    return database.execute('pragma user_version').fetchone()[0]
+
+
+def migrate_database(database, target_version=SCHEMA_VERSION):
+    """
+    Apply all migrations the database is missing up to the target
+    version in one transaction. If a migration fails all of them are
+    rolled back and the error is raised, the database stays at the
+    version it had before
+    """
+    cursor = database.cursor()
+    start_version = get_schema_version(database)
+    database.commit()
+    cursor.execute('begin')
+    try:
+        for version, description, migration in MIGRATIONS:
+            if version <= start_version or version > target_version:
+                continue
+            logger.info('Migrate the database to version ' + str(version)
+                + ': ' + description)
+            migration(cursor)
+            # The user_version is part of the transaction
+            cursor.execute('pragma user_version = ' + str(version))
+        database.commit()
+    except sqlite3.Error:
+        database.rollback()
+        logger.exception('Migration from version ' + str(start_version)
+            + ' failed')
+        raise
+    return get_schema_version(database)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    database = sqlite3.connect(sys.argv[1] if len(sys.argv) > 1 else
+        DATABASE_PATH)
+    print('schema version ' + str(migrate_database(database)))
+    database.close()
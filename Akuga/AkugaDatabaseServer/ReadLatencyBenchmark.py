@@ -0,0 +1,114 @@
+"""
+Measures the latency of logins (CHECK_CREDENTIALS) during a storm of
+match end writes, once with all commands handeld by the sql worker and
+once with the queries answered by the sql readers. The sql worker and
+the readers run on a fresh database in a temporary directory, no
+database server is needed:
+
+python -m Akuga.AkugaDatabaseServer.ReadLatencyBenchmark $clients $matches
+"""
+import os
+import sys
+import time
+import tempfile
+from queue import Queue
+from threading import (Thread, Event)
+from Akuga.AkugaDatabaseServer.main import (
+    CommandRouter,
+    sql_worker,
+    sql_reader)
+from Akuga.AkugaDatabaseServer.CommitBenchmark import (
+    COMMANDS_PER_MATCH,
+    ResponseWaiter,
+    report_match_ends)
+from Akuga.AkugaDatabaseServer.UserCharacteristics import (
+    register_user,
+    check_user_credentials)
+from Akuga.AkugaDatabaseServer.GlobalDefinitions import SQL_READER_CONNECTIONS
+
+
+# Seconds between two logins
+LOGIN_INTERVAL = 0.001
+
+
+def login_repeatedly(router, storm_running, latencies):
+    """
+    Check the credentials of a user until the storm is over
+    """
+    waiter = ResponseWaiter()
+    while storm_running.is_set():
+        start = time.perf_counter()
+        check_user_credentials(waiter, 'bench', router, 'victor0', 'hash')
+        if waiter.wait()[0] != 'SUCCESS':
+            raise RuntimeError(str(waiter.response))
+        latencies.append(time.perf_counter() - start)
+        time.sleep(LOGIN_INTERVAL)
+
+
+def run_storm(clients, matches, readers):
+    """
+    Run the write storm with a login client and return the latencies of
+    the logins and the seconds the storm took
+    """
+    directory = tempfile.mkdtemp()
+    database_path = os.path.join(directory, 'akuga.db')
+    cmd_queue = Queue(512)
+    read_queue = Queue(512) if readers else None
+    router = CommandRouter(cmd_queue, read_queue)
+    database_ready = Event()
+    threads = [Thread(target=sql_worker, args=(cmd_queue, database_path),
+        kwargs={'ready': database_ready})]
+    threads[0].start()
+    database_ready.wait()
+    for i in range(readers):
+        threads.append(Thread(target=sql_reader,
+            args=(read_queue, database_path)))
+        threads[-1].start()
+    waiter = ResponseWaiter()
+    for number in range(clients):
+        for name in ('victor' + str(number), 'looser' + str(number)):
+            register_user(waiter, 'bench', router, name, 'hash', 0, '{}')
+            waiter.wait()
+
+    latencies = []
+    storm_running = Event()
+    storm_running.set()
+    login_thread = Thread(target=login_repeatedly,
+        args=(router, storm_running, latencies))
+    storm = [Thread(target=report_match_ends,
+        args=(cmd_queue, number, matches, []))
+        for number in range(clients)]
+    start = time.perf_counter()
+    login_thread.start()
+    for thread in storm:
+        thread.start()
+    for thread in storm:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    storm_running.clear()
+    login_thread.join()
+
+    cmd_queue.put((None, None, None))
+    for i in range(readers):
+        read_queue.put((None, None, None))
+    for thread in threads:
+        thread.join()
+    for name in os.listdir(directory):
+        os.remove(os.path.join(directory, name))
+    os.rmdir(directory)
+    return sorted(latencies), elapsed
+
+
+if __name__ == '__main__':
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    matches = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    for name, readers in (('sql worker only', 0),
+            (str(SQL_READER_CONNECTIONS) + ' sql readers',
+            SQL_READER_CONNECTIONS)):
+        latencies, elapsed = run_storm(clients, matches, readers)
+        print('%s: storm of %d commands took %.2f s, %d logins, latency '
+            'p50 %.2f ms p99 %.2f ms max %.2f ms' % (name,
+            clients * matches * COMMANDS_PER_MATCH, elapsed, len(latencies),
+            1000 * latencies[len(latencies) // 2],
+            1000 * latencies[int(len(latencies) * 0.99)],
+            1000 * latencies[-1]))
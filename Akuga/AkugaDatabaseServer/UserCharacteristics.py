@@ -4,11 +4,28 @@ import logging
 logger = logging.getLogger('AkugaDatabaseServer.UserCharacteristics')
 
 
+# Selects the rows of a collection or set of a user from a json object
+# in the form {$jumon_name: $amount, ...}, other values are skipped
+JUMON_ROWS_FROM_JSON = '''select :name, key, value from json_each(:jumons)
+    where json_type(:jumons) = 'object' and type = 'integer' and value > 0
+    and exists(select 1 from user_accounts where name=:name)'''
+
+
 def get_user_by_name(communicator, client_address, cmd_queue, username):
     """
-    Query for the whole user datastructure
-    """
-    command = ("select * from user_accounts where name=?", (username, ))
+    Query for the whole user datastructure. Every row of the result is
+    one of:
+    'account', None, $name, $pass_hash, $credits
+    'collection', None, $jumon_name, $amount, None
+    'set', $set_index, $jumon_name, $amount, None
+    The result is empty if the user doesnt exist
+    """
+    command = ('''select 'account', null, name, pass_hash, credits
+        from user_accounts where name=:name
+        union all select 'collection', null, jumon, count, null
+        from user_collections where name=:name
+        union all select 'set', set_index, jumon, count, null
+        from user_sets where name=:name''', {'name': username})
     cmd_queue.put((communicator, client_address, command))
 
 
@@ -25,17 +42,16 @@ def register_user(communicator, client_address, cmd_queue,
         username, pass_hash, credits, collection):
     """
     Registers a user with a given name and pers pass hash in the database
-    """
-    command = ("insert into user_accounts(name, pass_hash, credits, collection, set1, set2, set3)\
-        select :name, :pass_hash, :credits, :collection, :set1, :set2, :set3\
-        where not exists(select 1 from user_accounts where name= :name)", {
-        'name': username,
-        'pass_hash': pass_hash,
-        'credits': credits,
-        'collection': collection,
-        'set1': "{}",
-        'set2': "{}",
-        'set3': "{}"})
+    collection is a json object in the form {$jumon_name: $amount, ...}
+    If the name is already taken an error is returned
+    """
+    parameters = {'name': username, 'pass_hash': pass_hash,
+        'credits': credits, 'jumons': collection}
+    command = [
+        ('''insert into user_accounts (name, pass_hash, credits)
+            values (:name, :pass_hash, :credits)''', parameters),
+        ('insert into user_collections (name, jumon, count) '
+            + JUMON_ROWS_FROM_JSON, parameters)]
     logger.info('Enqueue command from: ' + str(client_address))
     cmd_queue.put((communicator, client_address, command))
 
@@ -53,9 +69,9 @@ def check_user_credentials(communicator, client_address,
 
 def get_jumon_collection(communicator, client_address, cmd_queue, username):
     """
-    Get the collection of a user
+    Get the collection of a user as rows in the form $jumon_name, $amount
     """
-    command = ("select collection from user_accounts where name=?",
+    command = ("select jumon, count from user_collections where name=?",
         (username, ))
     cmd_queue.put((communicator, client_address, command))
 
@@ -66,6 +82,8 @@ def update_user(communicator, client_address, cmd_queue,
     Update every field except the name and the pass_hash of a user.
     The name of a user cant be changed cause it it used as the id
     and the pass hash should not be send over the network unneccesarily
+    The collection and the sets are json objects in the form
+    {$jumon_name: $amount, ...}
     """
     try:
         credits_value = int(credits)
@@ -75,23 +93,22 @@ def update_user(communicator, client_address, cmd_queue,
             communicator.send_packet(["ERROR", "A parameter was malformed"])
             return -1
 
-    command = ('''update user_accounts set
-        credits=:credits, collection=:collection,
-        set1=:set1, set2=:set2, set3=:set3 where name=:name''',
-        {
-            'credits': credits_value,
-            'collection': collection,
-            'set1': set1,
-            'set2': set2,
-            'set3': set3,
-            'name': username
-        })
+    parameters = {'name': username, 'credits': credits_value,
+        'jumons': collection}
+    command = [
+        ('update user_accounts set credits=:credits where name=:name',
+            parameters),
+        ('delete from user_collections where name=:name', parameters),
+        ('insert into user_collections (name, jumon, count) '
+            + JUMON_ROWS_FROM_JSON, parameters)]
+    for set_index, jumon_set in enumerate((set1, set2, set3)):
+        command += replace_jumon_set_command(username, set_index, jumon_set)
     cmd_queue.put((communicator, client_address, command))
 
 
 def get_jumon_set(communicator, client_address, cmd_queue, username, index):
     """
-    Get a jumons set of a user.
+    Get a jumons set of a user as rows in the form $jumon_name, $amount
     $jumon_set e [0, 1, 2]
     """
     try:
@@ -106,8 +123,8 @@ def get_jumon_set(communicator, client_address, cmd_queue, username, index):
             communicator.send_packet(["ERROR", "Malformed Parameter"])
         logger.info("Recieved from: " + str(client_address))
         return -1
-    command = ("select " + ['set1', 'set2', 'set3'][set_index]
-        + " from user_accounts where name=?", (username, ))
+    command = ('''select jumon, count from user_sets
+        where name=? and set_index=?''', (username, set_index))
     cmd_queue.put((communicator, client_address, command))
 
 
@@ -115,8 +132,7 @@ def set_jumon_set(communicator, client_address, cmd_queue,
         username, index, jumon_set):
     """
     Set the jumon set $index to jumon_set
-    jumon_set is a string containing the names of all jumons delimited by
-    a comma
+    jumon_set is a json object in the form {$jumon_name: $amount, ...}
     """
     try:
         set_index = int(index)
@@ -130,11 +146,27 @@ def set_jumon_set(communicator, client_address, cmd_queue,
             communicator.send_packet(["ERROR", "Malformed Parameter"])
         logger.info("Recieved from: " + str(client_address))
         return -1
-    command = ("update user_accounts set " + ['set1', 'set2', 'set3'][set_index] + "=? where name=?",
-        (jumon_set, username))
+    command = replace_jumon_set_command(username, set_index, jumon_set)
     cmd_queue.put((communicator, client_address, command))
 
 
+def replace_jumon_set_command(username, set_index, jumon_set):
+    """
+    Return the statements replacing a jumon set of a user
+    """
+    parameters = {'name': username, 'set_index': set_index,
+        'jumons': jumon_set}
+    return [
+        ('delete from user_sets where name=:name and set_index=:set_index',
+            parameters),
+        ('''insert into user_sets (name, set_index, jumon, count)
+            select :name, :set_index, key, value from json_each(:jumons)
+            where json_type(:jumons) = 'object' and type = 'integer'
+            and value > 0
+            and exists(select 1 from user_accounts where name=:name)''',
+            parameters)]
+
+
 def reward_user(communicator, client_address, cmd_queue, username, credits):
     """
     Increment the credits of a user by the integer value of credits
@@ -147,6 +179,55 @@ def reward_user(communicator, client_address, cmd_queue, username, credits):
         logger.info("Received from: " + str(client_address))
         communicator.send_packet(["ERROR", "Insecure Parameter"])
         return -1
-    command = ('update user_accounts set credits=credits+? where name=?',
-        (credits_int, username))
+    command = reward_user_command(username, credits_int)
+    cmd_queue.put((communicator, client_address, command))
+
+
+def reward_user_command(username, credits):
+    """
+    Return the command incrementing the credits of a user by credits
+    """
+    return ('update user_accounts set credits=credits+? where name=?',
+        (credits, username))
+
+
+def purchase_jumon(communicator, client_address, cmd_queue, username,
+        jumon_name):
+    """
+    Buy a jumon for a user in one transaction: if the user can afford
+    the price of the jumon per credits are decremented by the price and
+    the jumon is added to per collection.
+    The result is a single row: the credits of the user after the
+    purchase, the price of the jumon (None if the jumon doesnt exist),
+    1 if the jumon was bought, 0 otherwise, and the amount of the jumon
+    in the collection of the user.
+    If the user doesnt exist the result is empty
+    """
+    parameters = {'name': username, 'jumon': jumon_name}
+    command = [
+        ('''update user_accounts set
+            credits=credits-(select price from jumons where name=:jumon)
+            where name=:name and
+            credits >= (select price from jumons where name=:jumon)''',
+            parameters),
+        # Only add the jumon if the credits were decremented
+        ('''insert into user_collections (name, jumon, count)
+            select :name, :jumon, 1 where changes() = 1
+            on conflict (name, jumon) do update set count=count+1''',
+            parameters),
+        # changes() counts the jumons the purchase has added
+        ('''select credits, (select price from jumons where name=:jumon),
+            changes(), (select count from user_collections
+                where name=:name and jumon=:jumon)
+            from user_accounts where name=:name''', parameters)]
+    logger.info('Enqueue command from: ' + str(client_address))
+    cmd_queue.put((communicator, client_address, command))
+
+
+def get_jumon_owners(communicator, client_address, cmd_queue, jumon_name):
+    """
+    Get all users owning a jumon as rows in the form $username, $amount
+    """
+    command = ("select name, count from user_collections where jumon=?",
+        (jumon_name, ))
     cmd_queue.put((communicator, client_address, command))
@@ -1,31 +1,67 @@
 import logging
-from datetime import datetime
+from datetime import (date, timedelta)
+from Akuga.AkugaDatabaseServer.UserCharacteristics import reward_user_command
 
 
 # Get the logger
 logger = logging.getLogger('AkugaDatabaseServer.UserStats')
 
 
-def today():
+def week_start(day):
     """
-    Get the current date in the format %Y-%m-%-d
+    Get the monday of the week of a day
     """
-    return datetime.today().strftime("%Y-%m-%d")
+    return day - timedelta(days=day.weekday())
 
 
-def init_dayly_entry(cmd_queue, username, game_mode):
+def month_start(day):
     """
-    Creates an empty userstats entry (0 wins, 0 looses)
-    for the user named username in the specified game mode.
+    Get the first day of the month of a day
+    """
+    return day.replace(day=1)
+
+
+def season_start(day):
+    """
+    Get the first day of the season of a day, a season is a quarter
+    of a year
+    """
+    return day.replace(month=(day.month - 1) // 3 * 3 + 1, day=1)
+
+
+# The wins and looses are summed up per day, week, month and season.
+# The date of an entry is the first day of its period.
+# All granularities in the form: name, table, function returning the
+# first day of the period of a day. The coarsest granularity comes first
+STATS_GRANULARITIES = [
+    ('season', 'userstats_seasons', season_start),
+    ('month', 'userstats_monthly', month_start),
+    ('week', 'userstats_weekly', week_start),
+    ('day', 'userstats', lambda day: day)]
+
+
+def add_results_command(game_mode, results):
+    """
+    Return a command adding the wins and looses of a list of results in
+    the form (username, wins, looses) to the userstats of today and to
+    the rollups of the current week, month and season. An entry is
+    created if it doesnt exist yet.
     The date is always today to avoid tampering entries from the past
     """
-    command = ('''insert into userstats (name, mode, date, wins, looses)
-        select :name, :mode, :date, 0, 0
-        where not exists(select 1 from userstats where name=:name
-        and mode=:mode and date=:date)''',
-        {'name': username, 'mode': game_mode, 'date': today()})
-    logger.info("Enqueued command from: local\n")
-    cmd_queue.put((None, "local", command))
+    day = date.today()
+    command = []
+    for granularity, table, period_start in STATS_GRANULARITIES:
+        start = period_start(day).isoformat()
+        parameters = []
+        for username, wins, looses in results:
+            parameters += [username, game_mode, start, wins, looses]
+        command.append(('insert into ' + table
+            + ' (name, mode, date, wins, looses) values '
+            + ', '.join(['(?, ?, ?, ?, ?)'] * len(results))
+            + ''' on conflict (name, mode, date) do update set
+            wins=wins+excluded.wins, looses=looses+excluded.looses''',
+            parameters))
+    return command
 
 
 def add_win(communicator, client_address, cmd_queue, username, game_mode):
@@ -33,13 +69,7 @@ def add_win(communicator, client_address, cmd_queue, username, game_mode):
     Adds a win for the user username in the game mode game_mode
     the date is always today to avoid tempering data in the past
     """
-    # Enqueues to create an empty stats field if none exists
-    # Cause the queue is a fifo structure this will be executed before
-    # the update command
-    init_dayly_entry(cmd_queue, username, game_mode)
-    # Create the update command
-    command = ('''update userstats set wins=wins+1 where name=? and mode=?\
-        and date=? ''', (username, game_mode, today()))
+    command = add_results_command(game_mode, [(username, 1, 0)])
     logger.info('Enqueue command from: ' + str(client_address))
     cmd_queue.put((communicator, client_address, command))
     return 0
@@ -50,31 +80,167 @@ def add_loose(communicator, client_address, cmd_queue, username, game_mode):
     Adds a loose for the user username in the game mode game_mode
     the date is always today to avoid tempering data in the past
     """
-    # Enqueues to create an empty stats field if none exists
-    # Cause the queue is a fifo structure this will be executed before
-    # the update command
-    init_dayly_entry(cmd_queue, username, game_mode)
-    # Create the update command
-    command = ('''update userstats set looses=looses+1 where name=? and mode=?\
-        and date=? ''', (username, game_mode, today()))
+    command = add_results_command(game_mode, [(username, 0, 1)])
     logger.info('Enqueue command from: ' + str(client_address))
     cmd_queue.put((communicator, client_address, command))
     return 0
 
 
+def add_match_results(communicator, client_address, cmd_queue, game_mode,
+        victor_name, looser_names):
+    """
+    Adds a win for the victor and a loose for all loosers of a match in
+    one command. If the victor is None only the looses are added
+    """
+    results = [(username, 0, 1) for username in looser_names]
+    if victor_name is not None:
+        results.insert(0, (victor_name, 1, 0))
+    if not results:
+        communicator.send_packet(['SUCCESS'])
+        return 0
+    command = add_results_command(game_mode, results)
+    logger.info('Enqueue command from: ' + str(client_address))
+    cmd_queue.put((communicator, client_address, command))
+    return 0
+
+
+def record_match_result(communicator, client_address, cmd_queue, game_mode,
+        victor_name, looser_names, credits):
+    """
+    Records the result of a match as one command: the victor gets a win
+    and is rewarded with credits, all loosers get a loose. The statements
+    are executed in one transaction, so a win is never recorded without
+    the reward. If the victor is None only the looses are added
+    """
+    try:
+        credits_int = int(credits)
+    except ValueError:
+        logger.info("Credits parameter was insecure!")
+        logger.info("Received from: " + str(client_address))
+        communicator.send_packet(["ERROR", "Insecure Parameter"])
+        return -1
+    results = [(username, 0, 1) for username in looser_names]
+    statements = []
+    if victor_name is not None:
+        results.insert(0, (victor_name, 1, 0))
+        statements.append(reward_user_command(victor_name, credits_int))
+    if results:
+        statements = add_results_command(game_mode, results) + statements
+    if not statements:
+        communicator.send_packet(['SUCCESS'])
+        return 0
+    logger.info('Enqueue command from: ' + str(client_address))
+    cmd_queue.put((communicator, client_address, statements))
+    return 0
+
+
+def next_period_start(period_start, start):
+    """
+    Get the first day of the period following the one starting at start
+    """
+    day = start + timedelta(days=1)
+    while period_start(day) == start:
+        day += timedelta(days=1)
+    return day
+
+
+def split_stats_range(from_date, to_date):
+    """
+    Split the range between and including the from and the to date into
+    the periods of the coarsest granularities covering it. A period is
+    only used if it doesnt cross the start of a coarser period within the
+    range, so the ragged ends are made of days and weeks and the middle
+    of months and seasons. Consecutive periods of the same granularity
+    are merged. Returns a list of ranges in the form: granularity, table,
+    first date, last date, where the dates are the first days of the
+    periods
+    """
+    after_date = to_date + timedelta(days=1)
+    ranges = []
+    day = from_date
+    while day < after_date:
+        # The start of the next coarser period is the latest end a finer
+        # period at this day can have
+        limit = after_date
+        for granularity, table, period_start in STATS_GRANULARITIES:
+            end = next_period_start(period_start, period_start(day))
+            if period_start(day) == day and end <= limit:
+                break
+            if end <= after_date:
+                limit = min(limit, end)
+        if ranges and ranges[-1][1] == table:
+            ranges[-1][3] = day
+        else:
+            ranges.append([granularity, table, day, day])
+        day = end
+    return ranges
+
+
 def get_stats(communicator, client_address, cmd_queue, username, game_mode,
         from_year, from_month, from_day, to_year, to_month, to_day):
     """
     Queries all the user stats of a user in a certain game mode between and
-    including the from and the to date
-    """
-    # Create the date strings
-    from_date = from_year + '-' + from_month + '-' + from_day
-    to_date = to_year + '-' + to_month + '-' + to_day
-    # Create the query command
-    command = ('''select date,wins,looses from userstats where name=? and
-        mode=? and date >= ? and date <= ?''',
-        (username, game_mode, from_date, to_date))
+    including the from and the to date in the form:
+    granularity, date, wins, looses.
+    The range is split into the coarsest periods covering it, e.g. a range
+    from the 3rd of january to the 28th of december results in some days
+    and weeks at both ends and the months and seasons in between. The
+    granularity of a row is one of day, week, month and season, its date
+    is the first day of its period, the rows are ordered by date
+    """
+    try:
+        from_date = date(int(from_year), int(from_month), int(from_day))
+        to_date = date(int(to_year), int(to_month), int(to_day))
+    except (ValueError, TypeError):
+        logger.info("Received invalid date from: " + str(client_address))
+        communicator.send_packet(["ERROR", "Invalid date"])
+        return -1
+    # Create the query command, reading every table for its ranges
+    statements = []
+    parameters = []
+    for granularity, table, first, last in\
+            split_stats_range(from_date, to_date):
+        statements.append("select '" + granularity + "', date, wins, looses"
+            + ' from ' + table
+            + ' where name=? and mode=? and date >= ? and date <= ?')
+        parameters += [username, game_mode, first.isoformat(),
+            last.isoformat()]
+    if not statements:
+        # The from date is after the to date
+        statements.append("select 'day', date, wins, looses from userstats"
+            + ' where name=? and mode=? and date >= ? and date <= ?')
+        parameters += [username, game_mode, from_date.isoformat(),
+            to_date.isoformat()]
+    command = ('\nunion all '.join(statements) + '\norder by date',
+        parameters)
+    logger.info('Enqueue command from: ' + str(client_address))
+    cmd_queue.put((communicator, client_address, command))
+    return 0
+
+
+def get_stats_summary(communicator, client_address, cmd_queue, username,
+        game_mode):
+    """
+    Queries the wins and looses of a user in a certain game mode in the
+    current week, month and season and in total. The result are always
+    four rows in the form: granularity, date, wins, looses
+    The date is the first day of the period, None for the total
+    """
+    day = date.today()
+    parameters = {'name': username, 'mode': game_mode}
+    statements = []
+    for granularity, table, period_start in STATS_GRANULARITIES[:3]:
+        parameters[granularity] = period_start(day).isoformat()
+        statements.append("select '" + granularity + "', :" + granularity
+            + ''', coalesce(sum(wins), 0), coalesce(sum(looses), 0)
+            from ''' + table + ''' where name=:name and mode=:mode
+            and date=:''' + granularity)
+    # The seasons are the coarsest rollup, summing them up is the cheapest
+    # way to the total
+    statements.append('''select 'total', null, coalesce(sum(wins), 0),
+        coalesce(sum(looses), 0) from userstats_seasons
+        where name=:name and mode=:mode''')
+    command = ('\nunion all '.join(statements), parameters)
     logger.info('Enqueue command from: ' + str(client_address))
     cmd_queue.put((communicator, client_address, command))
     return 0
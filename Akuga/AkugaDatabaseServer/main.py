@@ -1,17 +1,26 @@
 import socket
 import sqlite3
 import logging
+from time import time
 from Akuga.AkugaDatabaseServer.GlobalDefinitions import (
     SERVER_ADDRESS,
     MAX_ACTIVE_CONNECTIONS,
-    DATABASE_PATH)
+    DATABASE_PATH,
+    SQL_MAX_BATCH_SIZE,
+    SQL_MAX_BATCH_DELAY,
+    SQL_READER_CONNECTIONS,
+    JUMON_CATALOG_REFRESH_INTERVAL)
 from Akuga.AkugaDatabaseServer.Network import (
     StreamSocketCommunicator,
+    RequestCommunicator,
     SocketClosed)
 from Akuga.AkugaDatabaseServer.UserStats import (
     add_win,
     add_loose,
-    get_stats)
+    add_match_results,
+    record_match_result,
+    get_stats,
+    get_stats_summary)
 from Akuga.AkugaDatabaseServer.UserCharacteristics import (
     check_username,
     register_user,
@@ -21,29 +30,53 @@ from Akuga.AkugaDatabaseServer.UserCharacteristics import (
     get_jumon_set,
     set_jumon_set,
     update_user,
-    reward_user)
+    reward_user,
+    purchase_jumon,
+    get_jumon_owners)
+from Akuga.AkugaDatabaseServer.Migrations import migrate_database
 from Akuga.AkugaDatabaseServer.Jumons import (
+    JumonCatalog,
+    refresh_catalog_periodically,
+    get_jumon_catalog_version,
     get_all_jumon_names,
     get_all_basic_jumon_names,
     get_all_vanilla_jumon_stats,
     get_jumon_by_name)
-from queue import Queue
-from threading import Thread
+from queue import (Queue, Empty)
+from threading import (Thread, Event)
 from json import dumps
 
 
-def handle_client(communicator, client_address, cmd_queue):
+# Get the logger
+logger = logging.getLogger('AkugaDatabaseServer')
+
+
+def handle_client(connection_communicator, client_address, cmd_queue,
+        catalog):
     while True:
         try:
-            tokens = communicator.recv_packet()
+            tokens = connection_communicator.recv_packet()
         except socket.error:
             logger.info("Socket Error: " + str(client_address))
-            communicator.close()
+            connection_communicator.close()
             break
         except SocketClosed:
             logger.info("Socket Closed: " + str(client_address))
-            communicator.close()
+            connection_communicator.close()
             break
+        communicator = connection_communicator
+        if tokens[0] == "REQUEST" and len(tokens) >= 2:
+            """
+            A request of a multiplexed connection, the command is
+            tagged with a request id. Answer it using the same id, this
+            way the responses can be send out of order
+            """
+            communicator = RequestCommunicator(connection_communicator,
+                tokens[1])
+            tokens = tokens[2:]
+            if not tokens:
+                communicator.send_packet(['ERROR', 'Missing command'])
+                continue
         if tokens[0] == "ADD_WIN" and len(tokens) >= 3:
             """
             If the command token is ADD_WIN and enough tokens are received
@@ -52,7 +85,7 @@ def handle_client(communicator, client_address, cmd_queue):
             username = tokens[1]
             game_mode = tokens[2]
             add_win(communicator, client_address, cmd_queue, username, game_mode)
-        if tokens[0] == "ADD_LOOSE" and len(tokens) >= 3:
+        elif tokens[0] == "ADD_LOOSE" and len(tokens) >= 3:
             """
             If the command token is ADD_LOOSE and enough tokens are received
             add a loose to the stats of a user in a certain game mode
@@ -60,18 +93,40 @@ def handle_client(communicator, client_address, cmd_queue):
             username = tokens[1]
             game_mode = tokens[2]
             add_loose(communicator, client_address, cmd_queue, username, game_mode)
-        if tokens[0] == "REWARD_USER" and len(tokens) >= 3:
+        elif tokens[0] == "ADD_MATCH_RESULTS" and len(tokens) >= 4 and\
+                type(tokens[3]) is list:
+            """
+            Add a win to the stats of the victor and a loose to the stats
+            of all loosers of a match in a certain game mode at once
+            ADD_MATCH_RESULTS $game_mode $victor_name [$looser_name, ...]
+            """
+            add_match_results(communicator, client_address, cmd_queue,
+                tokens[1], tokens[2], tokens[3])
+        elif tokens[0] == "RECORD_MATCH_RESULT" and len(tokens) >= 5 and\
+                type(tokens[3]) is list:
+            """
+            Record the result of a match in one transaction, the victor
+            gets a win and is rewarded with credits, all loosers get a
+            loose
+            RECORD_MATCH_RESULT $game_mode $victor_name [$looser_name, ...]
+                $credits
+            """
+            record_match_result(communicator, client_address, cmd_queue,
+                tokens[1], tokens[2], tokens[3], tokens[4])
+        elif tokens[0] == "REWARD_USER" and len(tokens) >= 3:
             """
             Increment the credits by the integer value of tokens[2]
             """
             username = tokens[1]
             credits = tokens[2]
             reward_user(communicator, client_address, cmd_queue, username, credits)
-        if tokens[0] == "GET_STATS" and len(tokens) >= 5:
+        elif tokens[0] == "GET_STATS" and len(tokens) >= 9:
             """
             If the command token is get_stats and enough tokens are received
             request the stats of a user in a certain game mode from a start
             to an end date
+            GET_STATS $username $game_mode $from_year $from_month $from_day
+                $to_year $to_month $to_day
             """
             username = tokens[1]
             game_mode = tokens[2]
@@ -84,18 +139,26 @@ def handle_client(communicator, client_address, cmd_queue):
             get_stats(communicator, client_address, cmd_queue, username, game_mode,
                      from_year, from_month, from_day,
                      to_year, to_month, to_day)
-        if tokens[0] == "GET_USER_BY_NAME" and len(tokens) >= 1:
+        elif tokens[0] == "GET_STATS_SUMMARY" and len(tokens) >= 3:
+            """
+            Request the wins and looses of a user in a certain game mode
+            in the current week, month and season and in total
+            GET_STATS_SUMMARY $username $game_mode
+            """
+            get_stats_summary(communicator, client_address, cmd_queue,
+                tokens[1], tokens[2])
+        elif tokens[0] == "GET_USER_BY_NAME" and len(tokens) >= 2:
             """
             Query for the whole user datastructure
             """
             get_user_by_name(communicator, client_address, cmd_queue, tokens[1])
-        if tokens[0] == "CHECK_USERNAME" and len(tokens) >= 1:
+        elif tokens[0] == "CHECK_USERNAME" and len(tokens) >= 2:
             """
             If the command token is check_username and enough tokens
             are received check if the username in token[1] is free or not
             """
             check_username(communicator, client_address, cmd_queue, tokens[1])
-        if tokens[0] == "REGISTER_USER" and len(tokens) >= 5:
+        elif tokens[0] == "REGISTER_USER" and len(tokens) >= 5:
             """
             If the command token is register_user and enough tokens are
             received insert a new entry into the user_accounts table
@@ -111,135 +174,287 @@ def handle_client(communicator, client_address, cmd_queue):
 
             register_user(communicator, client_address, cmd_queue,
                 tokens[1], tokens[2], credits, dumps(tokens[4]))
-        if tokens[0] == "CHECK_CREDENTIALS" and len(tokens) >= 3:
+        elif tokens[0] == "CHECK_CREDENTIALS" and len(tokens) >= 3:
             """
             If the command token is check_credentials and enough tokens
             are received, check the credentials
             """
             check_user_credentials(communicator, client_address, cmd_queue,
                 tokens[1], tokens[2])
-        if tokens[0] == "GET_JUMON_COLLECTION" and len(tokens) > 2:
+        elif tokens[0] == "GET_JUMON_COLLECTION" and len(tokens) > 2:
             """
             Get all jumons a user owns
             """
             get_jumon_collection(communicator, client_address,
                 cmd_queue, tokens[1])
-        if tokens[0] == "GET_JUMON_SET" and len(tokens) >= 3:
+        elif tokens[0] == "GET_JUMON_SET" and len(tokens) >= 3:
             """
             Get all jumon of the specified set of a user
             """
             get_jumon_set(communicator, client_address, cmd_queue,
                 tokens[1], tokens[2])
-        if tokens[0] == "SET_JUMON_SET" and len(tokens) >= 4:
+        elif tokens[0] == "SET_JUMON_SET" and len(tokens) >= 4:
             """
             Set all jumon of the specified set of a user
             """
             set_jumon_set(communicator, client_address, cmd_queue,
                 tokens[1], tokens[2], dumps(tokens[3]))
-        if tokens[0] == "UPDATE_USER" and len(tokens) >= 7:
+        elif tokens[0] == "UPDATE_USER" and len(tokens) >= 7:
             """
             Update all fields except the name and the pass_hash of a user
             """
             update_user(communicator, client_address, cmd_queue,
                 tokens[1], tokens[2], dumps(tokens[3]), dumps(tokens[4]),
                 dumps(tokens[5]), dumps(tokens[6]))
-        if tokens[0] == "GET_JUMON_NAMES" and len(tokens) >= 1:
+        elif tokens[0] == "PURCHASE_JUMON" and len(tokens) >= 3:
+            """
+            Buy a jumon for a user if per can afford it
+            PURCHASE_JUMON $username $jumon_name
+            """
+            purchase_jumon(communicator, client_address, cmd_queue,
+                tokens[1], tokens[2])
+        elif tokens[0] == "GET_JUMON_OWNERS" and len(tokens) >= 2:
+            """
+            Get all users owning a jumon and the amount they own
+            GET_JUMON_OWNERS $jumon_name
+            """
+            get_jumon_owners(communicator, client_address, cmd_queue,
+                tokens[1])
+        # The jumon catalog commands are answered from the in memory
+        # catalog by this thread
+        elif tokens[0] == "GET_JUMON_NAMES" and len(tokens) >= 1:
             """
             Get the names of of all jumons
             """
-            get_all_jumon_names(communicator, client_address, cmd_queue)
-        if tokens[0] == "GET_BASIC_JUMON_NAMES" and len(tokens) >= 1:
+            get_all_jumon_names(communicator, client_address, catalog)
+        elif tokens[0] == "GET_BASIC_JUMON_NAMES" and len(tokens) >= 1:
             """
             Get the name of all basic jumons
             """
-            get_all_basic_jumon_names(communicator, client_address, cmd_queue)
-        if tokens[0] == "GET_ALL_VANILLA_JUMON_STATS" and len(tokens) >= 1:
+            get_all_basic_jumon_names(communicator, client_address, catalog)
+        elif tokens[0] == "GET_ALL_VANILLA_JUMON_STATS" and len(tokens) >= 1:
             """
             Get the name of all vanilla jumons
             """
-            get_all_vanilla_jumon_stats(communicator, client_address, cmd_queue)
-        if tokens[0] == "GET_JUMON_BY_NAME" and len(tokens) >= 2:
+            get_all_vanilla_jumon_stats(communicator, client_address, catalog)
+        elif tokens[0] == "GET_JUMON_BY_NAME" and len(tokens) >= 2:
             """
             Get the whole datastructure of a jumon and send it to
             the client
             """
-            get_jumon_by_name(communicator, client_address, cmd_queue,
+            get_jumon_by_name(communicator, client_address, catalog,
                 tokens[1])
+        elif tokens[0] == "GET_JUMON_CATALOG_VERSION" and len(tokens) >= 1:
+            """
+            Get the version of the jumon catalog, it changes whenever
+            the jumons table changes
+            """
+            get_jumon_catalog_version(communicator, client_address, catalog)
+        elif communicator is not connection_communicator:
+            """
+            Answer every request which isnt handled, the client waits
+            for a response to each of its requests
+            """
+            logger.info("Received unknown or malformed request from: "
+                + str(client_address))
+            communicator.send_packet(['ERROR', 'Unknown command'])
+
+
+def is_query(command):
+    """
+    Returns if a command only reads from the database. A command is
+    either a single statement in the form (sql, parameters) or a list
+    of statements which is never routed to the sql readers
+    """
+    return type(command) is tuple and\
+        command[0].lstrip()[:6].lower() == 'select'
 
 
-def sql_worker(cmd_queue):
+class CommandRouter:
+    """
+    Takes the place of the cmd queue of the command handlers.
+    Queries are enqueued in the read queue and handeld by the sql readers,
+    all other commands are enqueued in the cmd queue of the sql worker.
+    Without a read queue all commands go to the sql worker
+    """
+    def __init__(self, cmd_queue, read_queue=None):
+        self.cmd_queue = cmd_queue
+        self.read_queue = read_queue
+
+    def put(self, item):
+        command = item[2]
+        if self.read_queue is not None and command is not None and\
+                is_query(command):
+            self.read_queue.put(item)
+        else:
+            self.cmd_queue.put(item)
+
+    def join(self):
+        """
+        Wait until all enqueued commands are processed
+        """
+        self.cmd_queue.join()
+        if self.read_queue is not None:
+            self.read_queue.join()
+
+
+def send_result(communicator, client_address, result):
+    """
+    Send the result of a command to the client, results of local
+    commands are dropped
+    """
+    if communicator is not None:
+        logger.info("Send result to: " + str(client_address))
+        try:
+            communicator.send_packet(result)
+        except socket.error:
+            logger.info("Cant send result to: " + str(client_address))
+
+
+def execute_command(cursor, client_address, command):
+    """
+    Execute a command and return the result which is send to the client
+    """
+    if type(command) is list:
+        return execute_statements(cursor, client_address, command)
+    try:
+        cursor.execute(command[0], command[1])
+        result = cursor.fetchall()
+        # Use the SUCCESS command token to signal the success
+        result.insert(0, 'SUCCESS')
+    except sqlite3.Error as e:
+        logger.info("SQL Error from: " + str(client_address))
+        # Set the sql error msg as the result so its send to the user
+        # using the ERROR command token to signal the error
+        result = ["ERROR", e.args[0]]
+    return result
+
+
+def execute_statements(cursor, client_address, statements):
+    """
+    Execute a list of statements as one command, either all of them
+    are applied or none. The result of the last statement is send to the
+    client. The statements run inside a savepoint of the transaction of
+    the current batch, so they are committed together with the batch
+    """
+    if not cursor.connection.in_transaction:
+        cursor.execute('begin')
+    cursor.execute('savepoint command')
+    try:
+        for sql, parameters in statements:
+            cursor.execute(sql, parameters)
+        result = cursor.fetchall()
+        result.insert(0, 'SUCCESS')
+    except sqlite3.Error as e:
+        logger.info("SQL Error from: " + str(client_address))
+        cursor.execute('rollback to command')
+        result = ["ERROR", e.args[0]]
+    cursor.execute('release command')
+    return result
+
+
+def collect_batch(cmd_queue, max_batch_size, max_batch_delay):
+    """
+    Wait for a command and take all commands enqueued meanwhile, up to
+    max_batch_size commands. Further commands are awaited for up to
+    max_batch_delay seconds. A None command ends the batch
+    """
+    batch = [cmd_queue.get()]
+    deadline = time() + max_batch_delay
+    while len(batch) < max_batch_size and batch[-1][2] is not None:
+        try:
+            batch.append(cmd_queue.get(timeout=max(0, deadline - time())))
+        except Empty:
+            break
+    return batch
+
+
+def sql_worker(cmd_queue, database_path=DATABASE_PATH,
+        max_batch_size=SQL_MAX_BATCH_SIZE,
+        max_batch_delay=SQL_MAX_BATCH_DELAY, ready=None):
     """
     Reads commands from cmd_queue and execute them using cursor
     Terminate if a command is None.
     Send the results directly to the clients, the connection socket
-    is part of the event enqueued in the cmd_queue
+    is part of the event enqueued in the cmd_queue.
+    The commands are executed in batches (group commit), all commands
+    queued while the last batch was committed run in one transaction.
+    This way a burst of commands, e.g. at the end of many matches, only
+    costs one commit. The results are sent after the commit, so a client
+    never sees a change which isnt durable yet.
+    The database is switched to the WAL journal mode, so the sql readers
+    can read while the sql worker writes. The ready event is set when
+    the database is prepared and the sql readers can be started, the
+    sql worker terminates without setting it if the database cant be
+    migrated
     """
     # Open the database (stop having it be close)
-    database = sqlite3.connect(DATABASE_PATH)
+    database = sqlite3.connect(database_path)
     cursor = database.cursor()
+    cursor.execute('pragma journal_mode=wal').fetchall()
 
-    # Create a userstats table if non exists
-    init_database(database, cursor)
+    # Create the tables or migrate them to the current schema version
+    try:
+        migrate_database(database)
+    except sqlite3.Error:
+        logger.info("Cant migrate the database. SQL Worker shutting down\n")
+        database.close()
+        return
+    if ready is not None:
+        ready.set()
 
-    while True:
-        communicator, client_address, command = cmd_queue.get()
-        if command is None:
-            logger.info("Received None command. SQL Worker shutting down\n")
-            break
-        result = ""
+    running = True
+    while running:
+        batch = collect_batch(cmd_queue, max_batch_size, max_batch_delay)
+        responses = []
+        for communicator, client_address, command in batch:
+            if command is None:
+                logger.info("Received None command. SQL Worker shutting down\n")
+                running = False
+                break
+            responses.append((communicator, client_address,
+                execute_command(cursor, client_address, command)))
+        # Commit to the database to make the changes of the whole batch
+        # visible. If the commit fails none of the changes are made
         try:
-            cursor.execute(command[0], command[1])
-            result = cursor.fetchall()
-            result.insert(0, 'SUCCESS')
+            database.commit()
         except sqlite3.Error as e:
-            logger.info("SQL Error from: " + str(client_address))
-            # Set the sql error msg as the result so its send to the user
-            result = e.args[0]
-            # If the command wasnt a locale command send the result
-            # to the client using the ERROR command token
-            # to signal the error
-            if communicator is not None:
-                logger.info("Send result to: " + str(client_address))
-                communicator.send_packet(["ERROR", result])
-        # If the command wasnt a locale command send the result
-        # to the client using the SUCCESS command token
-        # to signal the success
-        if communicator is not None:
-            logger.info("Send result to: " + str(client_address))
-            communicator.send_packet(result)
-        cmd_queue.task_done()
-        # Commit to the database to make the changes visible
-        database.commit()
+            logger.info("Cant commit a batch of " + str(len(responses))
+                + " commands")
+            database.rollback()
+            responses = [(communicator, client_address, ["ERROR", e.args[0]])
+                for communicator, client_address, result in responses]
+        for communicator, client_address, result in responses:
+            send_result(communicator, client_address, result)
+            cmd_queue.task_done()
     database.commit()
     database.close()
 
 
-def init_database(database, cursor):
+def sql_reader(read_queue, database_path=DATABASE_PATH):
     """
-    Just create a userstats table if there is none
+    Reads queries from the read_queue and execute them using a read only
+    connection. Terminate if a command is None.
+    In the WAL journal mode the queries dont wait for the sql worker,
+    they see the database as of the last commit
     """
-    try:
-        logger.info("Create a userstats table\n")
-        cursor.execute("create table userstats\
-            (name text, mode text, date text, wins real, looses real)")
-        database.commit()
-    except sqlite3.Error:
-        logger.info("Failed to create the table userstats\n")
-        logger.info("Does it already exists?\n")
-    try:
-        logger.info("Create a user_accounts table\n")
-        cursor.execute("create table user_accounts (name text, pass_hash text,\
-            credits real, collection text, set1 text, set2 text, set3 text)")
-        database.commit()
-    except sqlite3.Error:
-        logger.info("Failed to create the table user_accounts\n")
-        logger.info("Does it already exists?\n")
+    database = sqlite3.connect('file:' + database_path + '?mode=ro',
+        uri=True)
+    cursor = database.cursor()
+    while True:
+        communicator, client_address, command = read_queue.get()
+        if command is None:
+            logger.info("Received None command. SQL Reader shutting down\n")
+            break
+        send_result(communicator, client_address,
+            execute_command(cursor, client_address, command))
+        read_queue.task_done()
+    database.close()
 
 
 if __name__ == "__main__":
     # Create a logger
     logging.basicConfig(filename='AkugaDatabaseServer.log', level=logging.INFO)
-    logger = logging.getLogger('AkugaDatabaseServer')
 
     # Build the server socket
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -248,17 +463,44 @@ if __name__ == "__main__":
     logger.info("Server socket listening at " + str(SERVER_ADDRESS))
     logger.info("Server socket listening for " + str(MAX_ACTIVE_CONNECTIONS))
 
-    # Create the cmd queue with a max of 512 entries
+    # Create the cmd queue and the queue of the queries with a max of
+    # 512 entries. The command handlers enqueue the commands using
+    # the command router
     cmd_queue = Queue(512)
+    read_queue = Queue(512)
+    command_router = CommandRouter(cmd_queue, read_queue)
 
     # Spawn the sql worker process. It will work on the queue
     # containing the sql commands and the socket they where send
     # on. The results are directly send to the clients
     logger.info("Start the sql_worker thread as a daemon")
-    sql_worker_thread = Thread(target=sql_worker, args=(cmd_queue, ))
+    database_ready = Event()
+    sql_worker_thread = Thread(target=sql_worker, args=(cmd_queue, ),
+        kwargs={'ready': database_ready})
     sql_worker_thread.daemon = True
     sql_worker_thread.start()
+    while not database_ready.wait(0.1):
+        if not sql_worker_thread.is_alive():
+            server_socket.close()
+            raise SystemExit("The database cant be migrated")
     logger.info("Started sql_worker thread as a daemon")
+    # Spawn the sql readers answering the queries concurrently
+    for i in range(SQL_READER_CONNECTIONS):
+        sql_reader_thread = Thread(target=sql_reader, args=(read_queue, ))
+        sql_reader_thread.daemon = True
+        sql_reader_thread.start()
+    logger.info("Started " + str(SQL_READER_CONNECTIONS) + " sql readers")
+    # Load the jumon catalog and keep it up to date with its own read
+    # only connection
+    catalog_database = sqlite3.connect('file:' + DATABASE_PATH + '?mode=ro',
+        uri=True, check_same_thread=False)
+    jumon_catalog = JumonCatalog()
+    jumon_catalog.load(catalog_database)
+    catalog_thread = Thread(target=refresh_catalog_periodically,
+        args=(jumon_catalog, catalog_database,
+            JUMON_CATALOG_REFRESH_INTERVAL))
+    catalog_thread.daemon = True
+    catalog_thread.start()
     logger.info("Enter server loop")
     while True:
         # Accept new connections
@@ -271,13 +513,14 @@ if __name__ == "__main__":
         communicator = StreamSocketCommunicator(connection, 1024)
         # And handle them using the handle_client function
         handle_client_thread = Thread(target=handle_client,
-            args=(communicator, client_address, cmd_queue))
+            args=(communicator, client_address, command_router,
+                jumon_catalog))
         handle_client_thread.daemon = True
         handle_client_thread.start()
     logger.info("Leave the server loop")
     # Handle all remaining requests
     logger.info("Wait for the command queue to be processed completly")
-    cmd_queue.join()
+    command_router.join()
     logger.info("Command queue was processed completly")
 
     # Close the server socket to free the address
@@ -1,11 +1,132 @@
+"""
+The arena stores all values of its tiles in numpy arrays, this way the
+values of the whole board are changed and evaluated at once:
+boni: The attack and defense bonus of every color on every tile in the
+form [color, x, y, attack/defense]
+interference: The sum of the interferences of every tile for every layer,
+persistent and nonpersistent, in the form [layer, color, x, y,
+attack/defense]. The running totals of the interferences are kept per
+tile, the array is only updated for the dirty tiles whose totals have
+changed when the interferences of the whole board are requested
+occupancy: The id of the unit occupying a tile in the form [x, y],
+FREE_TILE if the tile is free
+wasted: If a tile is wasted in the form [x, y]
+The ArenaTiles are views into these arrays, they are created the first
+time a tile is accessed.
+The arrays hold 64 bit integers which wrap around silently, so every
+bonus and every running total is checked against MAX_BONUS before it is
+stored
+"""
+from numbers import Integral
+from collections.abc import MutableMapping
+import numpy as np
 from Akuga.AkugaGameModi.Position import Position
 from Akuga.AkugaGameModi.Meeple import Jumon
+from Akuga.AkugaGameModi.GlobalDefinitions import JUMON_COLORS
+
+
+# The layers of the interference array
+PERSISTENT = 0
+NONPERSISTENT = 1
+# The id of a free tile in the occupancy array
+FREE_TILE = -1
+# The bonus and the running totals of both layers of a tile are summed up,
+# so none of them may exceed a third of the largest 64 bit integer
+MAX_BONUS = np.iinfo(np.int64).max // 3
+
+
+def check_bonus(value):
+    """
+    Return the value as a python int if it is an integer, raise an
+    OverflowError if it is out of the range the arena can sum up
+    """
+    if isinstance(value, Integral):
+        value = int(value)
+    if not -MAX_BONUS <= value <= MAX_BONUS:
+        raise OverflowError('Bonus out of range: ' + str(value))
+    return value
+
+
+class TileInterferences(MutableMapping):
+    """
+    The interferences of one layer of an arena tile, a dict storing boni
+    like the original boni dict under the name of the interference.
+    Every change is added to the running totals of the tile and marks the
+    tile as dirty, setting an interference to the value it already has
+    changes nothing
+    """
+    def __init__(self, arena, layer, x, y):
+        self.arena = arena
+        self.key = (x, y)
+        self.layer_interf = arena.tile_interf[layer]
+        self.layer_totals = arena.tile_totals[layer]
+
+    def interferences(self):
+        return self.layer_interf.get(self.key, {})
+
+    def add_to_sum(self, *changes):
+        """
+        Add the boni of interferences to the running totals of the tile,
+        a change is an interference and its sign. Raises an OverflowError
+        before anything is changed if a total leaves the range of
+        MAX_BONUS
+        """
+        arena = self.arena
+        totals = self.layer_totals.get(self.key)
+        if totals is None:
+            totals = [0] * (2 * len(arena.colors))
+        new_totals = {}
+        for interf, sign in changes:
+            for color, boni in interf.items():
+                index = 2 * arena.color_index[color]
+                attack, defense = boni[0], boni[1]
+                if type(attack) is not int or type(defense) is not int:
+                    attack, defense = check_bonus(attack), check_bonus(defense)
+                new_totals[index] = new_totals.get(index, totals[index])\
+                    + sign * attack
+                new_totals[index + 1] = new_totals.get(index + 1,
+                    totals[index + 1]) + sign * defense
+        for total in new_totals.values():
+            if not -MAX_BONUS <= total <= MAX_BONUS:
+                raise OverflowError('Bonus out of range: ' + str(total))
+        for index, total in new_totals.items():
+            totals[index] = total
+        self.layer_totals[self.key] = totals
+        arena.dirty_tiles.add(self.key)
+
+    def __getitem__(self, name):
+        return self.interferences()[name]
+
+    def __setitem__(self, name, interf):
+        interferences = self.layer_interf.get(self.key)
+        if interferences is None:
+            interferences = {}
+            self.layer_interf[self.key] = interferences
+        elif interferences.get(name) == interf:
+            return
+        if name in interferences:
+            self.add_to_sum((interferences[name], -1), (interf, 1))
+        else:
+            self.add_to_sum((interf, 1))
+        interferences[name] = interf
+
+    def __delitem__(self, name):
+        interferences = self.interferences()
+        self.add_to_sum((interferences[name], -1))
+        del interferences[name]
+
+    def __iter__(self):
+        return iter(self.interferences())
+
+    def __len__(self):
+        return len(self.interferences())
 
 
 class ArenaTile:
     """
-    This represents one tile of an arena.
-    It stores attack and defense values for the basic colors of jumons
+    This represents one tile of an arena, a view into the arrays of the
+    arena at the position of the tile.
+    It provides attack and defense values for the basic colors of jumons
     as a dictionary of the form {$color: ($attack, $defense)}
     as well as persistent and nonpersistent interferences.
     Both are a dict of dicts storing boni like the original boni dict
@@ -13,62 +134,59 @@ class ArenaTile:
     An ArenaTile can have two different special functions for the one tile
     and the two tile battle phase.
     """
-    def __init__(self, boni):
-        self.boni = boni
-        self.persistent_interf = {}
-        self.nonpersistent_interf = {}
-        self._occupied_by = None
-        self.wasted = False
+    def __init__(self, arena, x, y):
+        self.arena = arena
+        self.x = x
+        self.y = y
+        self.key = (x, y)
+        self.persistent_interf = TileInterferences(arena, PERSISTENT, x, y)
+        self.nonpersistent_interf = TileInterferences(arena, NONPERSISTENT,
+            x, y)
+
+    @property
+    def boni(self):
+        return {color: tuple(int(bonus) for bonus in
+                self.arena.boni[index, self.x, self.y])
+            for color, index in self.arena.color_index.items()}
+
+    @boni.setter
+    def boni(self, boni):
+        for color, bonus in boni.items():
+            self.arena.boni[self.arena.color_index[color], self.x, self.y] =\
+                [check_bonus(value) for value in bonus]
 
     def occupied_by(self):
         """
         Returns the unit aka jumon, equipment ocuppying this tile
         """
-        return self._occupied_by
+        return self.arena.units.get(self.key)
+
+    def get_total_bonus(self, jumon, value):
+        """
+        Sum up the bonus and all interferences of the color of the jumon,
+        value is 0 for the attack and 1 for the defense
+        """
+        arena = self.arena
+        color = arena.color_index[jumon.color]
+        total = arena.boni.item(color, self.x, self.y, value)
+        index = 2 * color + value
+        for layer_totals in arena.tile_totals:
+            totals = layer_totals.get(self.key)
+            if totals is not None:
+                total += totals[index]
+        return total
 
     def get_total_attack_bonus(self, jumon):
         """
         Sum up the attack bonus and all attack interference
         """
-        color = jumon.color
-        total_attack = self.boni[color][0]
-        # Go through all interferences and add the
-        # attack value of the interference for the color
-        # of the jumon. If there is no attack_value for
-        # this color do nothing (equally to add 0)
-        for interf in self.nonpersistent_interf.values():
-            try:
-                total_attack += interf[color][0]
-            except(KeyError):
-                pass
-        for interf in self.persistent_interf.values():
-            try:
-                total_attack += interf[color][0]
-            except(KeyError):
-                pass
-        return total_attack
+        return self.get_total_bonus(jumon, 0)
 
     def get_total_defense_bonus(self, jumon):
         """
         Sum up the defense bonus and all defense interference
         """
-        color = jumon.color
-        total_defense = self.boni[color][1]
-        # Go through all interferences and add the
-        # defense value of the interference for the color
-        # of the jumon. If there is no defense value for
-        # this color do nothing (equally to add 0)
-        for interf in self.nonpersistent_interf.values():
-            try:
-                total_defense += interf[color][1]
-            except(KeyError):
-                pass
-        for interf in self.persistent_interf.values():
-            try:
-                total_defense += interf[color][1]
-            except(KeyError):
-                pass
-        return total_defense
+        return self.get_total_bonus(jumon, 1)
 
     def reset_nonpersistent_interf(self):
         """
@@ -81,7 +199,10 @@ class ArenaTile:
         An interference is a dictionary on its own with an attack and defense
         value stored with a color as the key
         """
-        self.nonpersistent_interf = {}
+        self.arena.tile_interf[NONPERSISTENT].pop(self.key, None)
+        if self.arena.tile_totals[NONPERSISTENT].pop(self.key, None)\
+                is not None:
+            self.arena.dirty_tiles.add(self.key)
 
     def one_tile_special_ability(self, attacking_jumon, defending_jumon,
             current_state, next_state_and_variables):
@@ -107,56 +228,140 @@ class ArenaTile:
         """
         Set the wasted predicat of this tile
         """
-        self.wasted = wasted
+        self.arena.wasted[self.x, self.y] = wasted
 
     def is_wasted(self):
         """
         Return the wasted predicat of this tile
         """
-        return self.wasted
+        return bool(self.arena.wasted[self.x, self.y])
 
 
 class Arena:
     """
     This represents the arena, which is made of BOARD_WIDTH * BOARD_HEIGHT
-    many ArenaTiles stored in a two dimensional array of the form [x][y]
+    many ArenaTiles addressed by their position.
+    A tile with a special ability is a subclass of ArenaTile set with
+    set_tile_at
     """
-    def __init__(self, tiles, board_width, board_height):
+    def __init__(self, board_width, board_height, boni=None,
+            colors=JUMON_COLORS):
         """
-        tiles is a 2d list of ArenaTiles
+        boni is an array of the form [color, x, y, attack/defense]
+        in the order of colors, all boni are 0 if it is None
         """
-        self.tiles = tiles
         self.board_width = board_width
         self.board_height = board_height
+        self.colors = list(colors)
+        self.color_index = {color: index
+            for index, color in enumerate(self.colors)}
+        shape = (len(self.colors), board_width, board_height, 2)
+        if boni is None:
+            boni = np.zeros(shape, dtype=np.int64)
+        self.boni = np.array(boni, dtype=np.int64).reshape(shape)
+        if (self.boni < -MAX_BONUS).any() or (self.boni > MAX_BONUS).any():
+            raise OverflowError('Boni out of range')
+        self.interference = np.zeros((2, ) + shape, dtype=np.int64)
+        # The named interferences of every layer and their running totals
+        # in the form [color * 2 + attack/defense] stored under the (x, y)
+        # of the tile, only tiles with interferences are stored
+        self.tile_interf = ({}, {})
+        self.tile_totals = ({}, {})
+        # The tiles whose totals are not yet in the interference array
+        self.dirty_tiles = set()
+        # The jumons placed on the arena which got a nonpersistent
+        # interference since they were reset the last time, the tiles
+        # carrying one are the keys of the nonpersistent tile totals
+        self.nonpersistent_jumons = set()
+        self.occupancy = np.full((board_width, board_height), FREE_TILE,
+            dtype=np.int64)
+        self.units = {}
+        self.wasted = np.zeros((board_width, board_height), dtype=bool)
+        # The views of all tiles accessed so far stored under their (x, y)
+        self.tiles = {}
 
     def get_tile_at(self, position):
         """
         Returns the arena tile at the given position
         """
-        return self.tiles[position.x][position.y]
+        key = (position.x, position.y)
+        tile = self.tiles.get(key)
+        if tile is None:
+            tile = ArenaTile(self, position.x, position.y)
+            self.tiles[key] = tile
+        return tile
+
+    def set_tile_at(self, tile_class, position):
+        """
+        Replace the tile at the given position with an instance of
+        tile_class, a subclass of ArenaTile
+        """
+        tile = tile_class(self, position.x, position.y)
+        self.tiles[(position.x, position.y)] = tile
+        return tile
 
     def get_unit_at(self, position):
         """
         Get the Unit aka Jumon, Equipment or Trap at position
         Positions outside the arena are always considered free
         """
-        try:
-            return self.tiles[position.x][position.y].occupied_by()
-        except IndexError:
-            return None
+        return self.units.get((position.x, position.y))
 
     def place_unit_at(self, unit, position):
         """
         Places unit at position
         Set unit to None to remove a unit from an arena tile
         """
+        key = (position.x, position.y)
         if unit is not None:
             """
             If a unit is placed set its position as well
             """
             unit.set_position(position)
-        # Set the unit to the position
-        self.tiles[position.x][position.y]._occupied_by = unit
+            self.units[key] = unit
+            self.occupancy[key] = unit.id
+            if isinstance(unit, Jumon):
+                unit.nonpersistent_interf.track(unit,
+                    self.nonpersistent_jumons)
+        else:
+            self.units.pop(key, None)
+            self.occupancy[key] = FREE_TILE
+
+    def get_interference(self):
+        """
+        Returns the interference array after writing the totals of all
+        dirty tiles into it, all of them are written at once
+        """
+        if self.dirty_tiles:
+            keys = list(self.dirty_tiles)
+            self.dirty_tiles = set()
+            free = [0] * (2 * len(self.colors))
+            totals = np.array([[layer_totals.get(key, free) for key in keys]
+                for layer_totals in self.tile_totals], dtype=np.int64)
+            # The totals are in the form [layer, tile, color, attack/defense]
+            # while the tiles are indexed in the third dimension
+            totals = totals.reshape(2, len(keys), len(self.colors), 2)
+            xs, ys = zip(*keys)
+            self.interference[:, :, list(xs), list(ys)] =\
+                totals.transpose(0, 2, 1, 3)
+        return self.interference
+
+    def get_total_boni(self):
+        """
+        Returns the attack and defense bonus including all interferences
+        of every color on every tile in the form
+        [color, x, y, attack/defense]
+        """
+        return self.boni + self.get_interference().sum(axis=0)
+
+    def reset_nonpersistent_interf(self):
+        """
+        Reset the nonpersistent interferences of all arena tiles, only
+        the tiles with nonpersistent interferences are touched
+        """
+        self.dirty_tiles.update(self.tile_totals[NONPERSISTENT])
+        self.tile_interf[NONPERSISTENT].clear()
+        self.tile_totals[NONPERSISTENT].clear()
 
     def print_out(self):
         for y in range(0, self.board_height):
@@ -0,0 +1,78 @@
+"""
+Measures the creation of arenas and the evaluation of the total boni of
+the whole board on boards of 3x3, 16x16, 64x64 and 256x256 tiles. Every
+tile gets the given amount of persistent and nonpersistent interferences.
+The totals are summed up once tile by tile using the ArenaTile views and
+once for the whole board at once:
+
+python -m Akuga.AkugaGameModi.ArenaBenchmark $interferences_per_tile $rounds
+"""
+import sys
+import time
+import random
+from Akuga.AkugaGameModi.Meeple import Jumon
+from Akuga.AkugaGameModi.Position import Position
+from Akuga.AkugaGameModi.GlobalDefinitions import JUMON_COLORS
+from Akuga.AkugaGameModi.LastManStanding.ArenaCreator import create_arena
+
+
+BOARD_SIZES = [3, 16, 64, 256]
+
+
+def add_interferences(arena, amount):
+    """
+    Add amount persistent and nonpersistent interferences to every tile
+    """
+    for x in range(arena.board_width):
+        for y in range(arena.board_height):
+            tile = arena.get_tile_at(Position(x, y))
+            for i in range(amount):
+                color = random.choice(JUMON_COLORS)
+                tile.persistent_interf['p' + str(i)] = {
+                    color: (random.randint(-50, 50), random.randint(-50, 50))}
+                tile.nonpersistent_interf['n' + str(i)] = {
+                    color: (random.randint(-50, 50), random.randint(-50, 50))}
+
+
+def tile_totals(arena, jumons):
+    """
+    Sum up the total boni of every color on every tile one by one
+    """
+    totals = []
+    for x in range(arena.board_width):
+        for y in range(arena.board_height):
+            tile = arena.get_tile_at(Position(x, y))
+            for jumon in jumons:
+                totals.append((tile.get_total_attack_bonus(jumon),
+                    tile.get_total_defense_bonus(jumon)))
+    return totals
+
+
+def measure(rounds, function):
+    """
+    Return the mean seconds of rounds calls of the function
+    """
+    start = time.perf_counter()
+    for i in range(rounds):
+        function()
+    return (time.perf_counter() - start) / rounds
+
+
+if __name__ == '__main__':
+    interferences = int(sys.argv[1]) if len(sys.argv) > 1 else 2
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    random.seed(0)
+    jumons = [Jumon('Probe', i, color, 0, 0, 0)
+        for i, color in enumerate(JUMON_COLORS)]
+    print('%-9s %14s %14s %14s' % ('board', 'create ms', 'per tile ms',
+        'board ms'))
+    for size in BOARD_SIZES:
+        creation = measure(rounds, lambda: create_arena(size, size, 0, 250))
+        arena = create_arena(size, size, 0, 250)
+        add_interferences(arena, interferences)
+        # The slow path is measured once on the largest boards
+        per_tile = measure(max(1, rounds // size),
+            lambda: tile_totals(arena, jumons))
+        board = measure(rounds, arena.get_total_boni)
+        print('%-9s %14.3f %14.3f %14.3f' % ('%dx%d' % (size, size),
+            1e3 * creation, 1e3 * per_tile, 1e3 * board))
@@ -0,0 +1,135 @@
+"""
+A benchmark of the serialisation cost per turn. A turn is made of a few
+inter turn events and the full game state of a board with the given size.
+It is propagated to 2, 4 and 8 recipients once by serialising the packets
+per recipient, like propagate_message did before, and once using
+broadcast_packet which serialises every packet only once.
+The turn is propagated over socketpairs and to connections discarding
+everything to measure the serialisation alone:
+
+python -m Akuga.AkugaGameModi.BroadcastBenchmark $board_size $turns
+"""
+import sys
+import time
+import socket
+from threading import Thread
+from Akuga.Network import StreamSocketCommunicator
+from Akuga.AkugaGameModi.NetworkProtocoll import broadcast_packet
+
+
+class DiscardingConnection:
+    """
+    A connection which discards everything, so only the serialisation
+    is measured
+    """
+    def sendall(self, data):
+        pass
+
+    def close(self):
+        pass
+
+
+class DiscardingRecipient:
+    """
+    A user whose connection discards everything
+    """
+    def __init__(self):
+        self.communicator = StreamSocketCommunicator(
+            DiscardingConnection(), 4096)
+
+    def close(self):
+        pass
+
+
+class Recipient:
+    """
+    A user connected with a socketpair whose other end is drained by a
+    thread, so the writes never block
+    """
+    def __init__(self):
+        connection, self.peer = socket.socketpair()
+        self.communicator = StreamSocketCommunicator(connection, 4096)
+        self.reader_thread = Thread(target=self.drain)
+        self.reader_thread.start()
+
+    def drain(self):
+        while self.peer.recv(65536):
+            pass
+
+    def close(self):
+        self.communicator.close()
+        self.reader_thread.join()
+        self.peer.close()
+
+
+def turn_packets(board_size):
+    """
+    Return the packets propagated during one turn on a board with
+    board_size times board_size tiles, half of it occupied by jumons
+    """
+    jumons = board_size * board_size // 2
+    packets = [
+        ['MOVEMENT_ITEVENT', 'Player1', 0, (0, 0), (0, 1)],
+        ['ATTACKBONUS_ITEVENT', 'Player1', 0, 250],
+        ['DEFENSEBONUS_ITEVENT', 'Player2', 1, 120],
+        ['ONETILEFIGHT', 'Player1', 0, 'Player2', 1, 'Player1'],
+        ['BURYING_JUMON_ITEVENT', 1],
+        ['PICK_POOL_DATA'] + [(i, '') for i in range(jumons, 2 * jumons)],
+        ['PLAYER_DATA_JUMONS_TO_SUMMON', 'Player1'],
+        ['PLAYER_DATA_SUMMONED_JUMONS', 'Player1']
+        + [(i, '') for i in range(0, jumons, 2)],
+        ['PLAYER_DATA_JUMONS_TO_SUMMON', 'Player2'],
+        ['PLAYER_DATA_SUMMONED_JUMONS', 'Player2']
+        + [(i, '') for i in range(1, jumons, 2)],
+        ['ARENA_DATA', (board_size, board_size)]
+        + [i if i < jumons else '' for i in range(board_size ** 2)]]
+    for i in range(jumons):
+        packets.append(['JUMON_NONPERSISTENT_INTERFERENCE', i,
+            {'Tile': (100, 0, 0)}])
+        packets.append(['JUMON_PERSISTENT_INTERFERENCE', i, {}])
+    packets.append(['CURRENT_PLAYER', 'Player2'])
+    return packets
+
+
+def send_per_recipient(users, tokens):
+    """
+    Serialise the packet once per recipient
+    """
+    for user in users:
+        try:
+            user.communicator.send_packet(tokens)
+        except IOError:
+            pass
+
+
+def measure(send_function, users, packets, turns):
+    """
+    Propagate turns turns and return the elapsed seconds
+    """
+    start = time.perf_counter()
+    for i in range(turns):
+        for tokens in packets:
+            send_function(users, tokens)
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    board_size = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    turns = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    packets = turn_packets(board_size)
+    print('board: ' + str(board_size) + 'x' + str(board_size) + ', '
+        + str(len(packets)) + ' packets per turn')
+    print('%-14s %-10s %18s %18s %8s' % ('connections', 'recipients',
+        'per recipient us', 'broadcast us', 'speedup'))
+    for label, recipient_class in [('discarding', DiscardingRecipient),
+            ('socketpair', Recipient)]:
+        for amount in [2, 4, 8]:
+            users = [recipient_class() for i in range(amount)]
+            per_recipient = measure(send_per_recipient, users, packets,
+                turns)
+            broadcast = measure(broadcast_packet, users, packets, turns)
+            print('%-14s %-10d %18.1f %18.1f %8.2f' % (label, amount,
+                1e6 * per_recipient / turns, 1e6 * broadcast / turns,
+                per_recipient / broadcast))
+            for user in users:
+                user.close()
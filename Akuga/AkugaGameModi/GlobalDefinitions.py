@@ -1,2 +1,13 @@
 USER_DBS_ADDRESS = ('127.0.0.1', 10098)
 CREDITS_PER_WIN = 50
+# The amount of propagated game states a game state delta can be based on
+GAMESTATE_HISTORY = 8
+# The max amount of unsent packets and bytes to a user during a match,
+# a slower client is disconnected
+OUTBOUND_QUEUE_PACKETS = 1024
+OUTBOUND_QUEUE_BYTES = 4194304
+# Seconds to wait for the last packets of a match to be sent before the
+# connection is handed back to the game server
+OUTBOUND_QUEUE_DRAIN_TIMEOUT = 5
+# The colors of the jumons, the arena stores a bonus for each of them
+JUMON_COLORS = ['red', 'blue', 'green', 'black']
@@ -2,7 +2,7 @@ import random
 import time
 import Akuga.AkugaGameModi.Meeple
 from Akuga.AkugaGameModi.LastManStanding import GlobalDefinitions
-from Akuga.AkugaGameModi.PathFinder import find_path
+from Akuga.AkugaGameModi.PathFinder import find_reachable_tiles
 from Akuga.AkugaGameModi.Position import Position
 from Akuga.AkugaGameModi.Player import NeutralPlayer
 from Akuga.AkugaGameModi.StateMachieneState import StateMachieneState as State
@@ -49,6 +49,24 @@ def propagating_handle_jumon_death(jumon, players):
     propagate_message(burying_itevent)
 
 
+def get_move_targets(arena, jumon):
+    """
+    Return every tile the jumon can move to as a dict storing the
+    distance under the (x, y) tuple of the tile. A tile is a target if
+    it is in reach of the total movement of the jumon and not owned by
+    the owner of the jumon. A jumon outside the arena cant move at all
+    """
+    if jumon.position is None:
+        return {}
+    targets = find_reachable_tiles(jumon.position, arena,
+        jumon.get_total_movement())
+    player = jumon.owned_by
+    if player is None:
+        return targets
+    return {target: distance for target, distance in targets.items()
+        if not player.owns_tile(arena, Position(target[0], target[1]))}
+
+
 class TurnBeginState(State):
     """
     This represents the moment a turn begins, in this state
@@ -61,18 +79,19 @@ class TurnBeginState(State):
         """
         Refresh the interferences and jump to the wait_for_user_state
         To allow passive special abilities the nonpersistent interference
-        of all jumons and all arena tiles has to be cleared. Then
-        the special ability script of all jumons (even the neutral ones)
-        can be invoked without allowing a state change.
-        """
-        # Reset the nonpersistent interference of all arena tiles
-        for row in self.fsm.arena.tiles:
-            for arena_tile in row:
-                arena_tile.reset_nonpersistent_interf()
-        # Reset the nonpersistent  interference of all jumons
-        for player in self.fsm.player_chain.get_players():
-            for jumon in player.summoned_jumons:
-                jumon.reset_nonpersistent_interf()
+        of all jumons and all arena tiles has to be cleared. The arena
+        keeps track of the tiles and the jumons carrying one, so only
+        those are touched. Then the special ability script of all jumons
+        (even the neutral ones) can be invoked without allowing a state
+        change.
+        """
+        # Reset the nonpersistent interference of the arena tiles and
+        # the jumons carrying one, all others dont have to be touched
+        self.fsm.arena.reset_nonpersistent_interf()
+        interfered_jumons = self.fsm.arena.nonpersistent_jumons
+        for jumon in interfered_jumons:
+            jumon.reset_nonpersistent_interf()
+        interfered_jumons.clear()
 
         # Go through all players, even the neutral player
         for player in self.fsm.player_chain.get_players():
@@ -350,7 +369,7 @@ class SummonCheckState(State):
             summon_itevent = Event(MESSAGE,
                 players=self.fsm.player_chain.get_players(),
                 tokens=['SUMMON_ITEVENT', self.fsm.player_chain.get_current_player().name,
-                jumon.id, jumon.position])
+                jumon.id, str(jumon.position)])
             propagate_message(summon_itevent)
 
             if self.fsm.arena.get_tile_at(summon_position).is_wasted():
@@ -384,7 +403,7 @@ class SummonCheckState(State):
             summon_itevent = Event(MESSAGE,
                 players=self.fsm.player_chain.get_players(),
                 tokens=['SUMMON_ITEVENT', self.fsm.player_chain.get_current_player().name,
-                jumon.id, jumon.position])
+                jumon.id, str(jumon.position)])
             propagate_message(summon_itevent)
             # Get the artefact at this point
             artefact = self.fsm.arena.get_unit_at(summon_position)
@@ -536,8 +555,8 @@ class CheckMoveState(State):
 
     def run(self, event):
         """
-        Get the shortest path from the current position to the target
-        position. Do the move if its legal, or jump back to the idle
+        Check if the jumon can reach the target position.
+        Do the move if its legal, or jump back to the idle
         state if its not. Jump to the two tile battle state or the
         equip artefact state if the target position is occupied by an
         hostile jumon or an artefact
@@ -551,16 +570,14 @@ class CheckMoveState(State):
         print(str(current_position))
         print(str(target_position))
         """
-        Get the shortes distance between the current position and the
-        target position. Do the move only if the path is not none (aka a
-        path is found) and the pathlength is less then or equal to the
-        movements of the selected jumon. This way the jumons actually
-        move and can be blocked by other meeples.
+        Do the move only if the target position is one of the move
+        targets of the jumon, aka the tiles reachable with the movements
+        of the selected jumon. This way the jumons actually move and can
+        be blocked by other meeples. The move targets are the ones the
+        clients can query, so a move to a queried target is always legal
         """
-        move_path = find_path(current_position, target_position,
-            self.fsm.arena)
-        if move_path is None or len(move_path) == 0\
-                or len(move_path) - 1 > jumon.get_total_movement():
+        move_targets = get_move_targets(self.fsm.arena, jumon)
+        if (target_position.x, target_position.y) not in move_targets:
             """
             If the target move is invalid in length just jump back to the
             idle state.
@@ -593,7 +610,7 @@ class CheckMoveState(State):
                     players=self.fsm.player_chain.get_players(),
                     tokens=['MOVEMENT_ITEVENT',
                         self.fsm.player_chain.get_current_player().name,
-                        jumon.id, current_position, target_position])
+                        jumon.id, str(current_position), str(target_position)])
                 propagate_message(movement_itevent)
             return (self.fsm.turn_end_state, {})
         elif jumon.owned_by.\
@@ -666,7 +683,7 @@ class CheckDisplacementState(State):
             displacement_itevent = Event(MESSAGE,
                 players=self.fsm.player_chain.get_players(),
                 tokens=['DISPLACEMENT_ITEVENT', jumon.id,
-                    current_position, target_position])
+                    str(current_position), str(target_position)])
             propagate_message(displacement_itevent)
             self.fsm.arena.place_unit_at(None, current_position)
             propagating_handle_jumon_death(jumon, self.fsm.player_chain.get_players())
@@ -679,7 +696,7 @@ class CheckDisplacementState(State):
             displacement_itevent = Event(MESSAGE,
                 players=self.fsm.player_chain.get_players(),
                 tokens=['DISPLACEMENT_ITEVENT', jumon.id,
-                    current_position, target_position])
+                    str(current_position), str(target_position)])
             propagate_message(displacement_itevent)
             self.fsm.arena.place_unit_at(None, current_position)
             propagating_handle_jumon_death(jumon, self.fsm.player_chain.get_players())
@@ -695,7 +712,7 @@ class CheckDisplacementState(State):
             displacement_itevent = Event(MESSAGE,
                 players=self.fsm.player_chain.get_players(),
                 tokens=['DISPLACEMENT_ITEVENT', jumon.id,
-                    current_position, target_position])
+                    str(current_position), str(target_position)])
             propagate_message(displacement_itevent)
 
             if self.fsm.arena.get_tile_at(target_position).is_wasted():
@@ -734,7 +751,7 @@ class CheckDisplacementState(State):
             displacement_itevent = Event(MESSAGE,
                 players=self.fsm.player_chain.get_players(),
                 tokens=['DISPLACEMENT_ITEVENT', jumon.id,
-                    current_position, target_position])
+                    str(current_position), str(target_position)])
             propagate_message(displacement_itevent)
             # Jump to the equip artefact to jumon state
             return (self.fsm.equip_artefact_to_jumon_state, {
@@ -784,7 +801,7 @@ class CheckSpecialMoveState(State):
             specialmove_itevent = Event(MESSAGE,
                 players=self.fsm.player_chain.get_players(),
                 tokens=['SPECIAL_MOVE_ITEVENT', jumon.id,
-                    current_position, target_position])
+                    str(current_position), str(target_position)])
             propagate_message(specialmove_itevent)
             state_change = jumon.do_special_move(self.fsm, current_position,
                     target_position)
@@ -896,13 +913,13 @@ class OneTileBattleBoniEvaluationState(State):
             players=self.fsm.player_chain.get_players(),
             tokens=['ATTACKBONUS_ITEVENT',
                 attacking_jumon.id,
-                attacking_jumon.position,
+                str(attacking_jumon.position),
                 attacking_jumon_bonus])
         defensebonus_itevent = Event(MESSAGE,
             players=self.fsm.player_chain.get_players(),
             tokens=['DEFENSEBONUS_ITEVENT',
                 defending_jumon.id,
-                defending_jumon.position,
+                str(defending_jumon.position),
                 defending_jumon_bonus])
         propagate_message(attackbonus_itevent)
         propagate_message(defensebonus_itevent)
@@ -939,8 +956,8 @@ class OneTileBattleFightState(State):
             tokens=['ONETILEFIGHT',
                 attacking_jumon.id,
                 defending_jumon.id,
-                attacking_jumon.position,
-                defending_jumon.position])
+                str(attacking_jumon.position),
+                str(defending_jumon.position)])
         propagate_message(onetilefight_itevent)
         # If no one wins victor and looser are none
         victor, looser = jumon_fight(attacking_jumon, attacking_jumon_bonus,
@@ -1140,13 +1157,13 @@ class TwoTileBattleBoniEvaluationState(State):
             players=self.fsm.player_chain.get_players(),
             tokens=['ATTACKBONUS_ITEVENT',
                 attacking_jumon.id,
-                attacking_jumon.position,
+                str(attacking_jumon.position),
                 attacking_jumon_bonus])
         defensebonus_itevent = Event(MESSAGE,
             players=self.fsm.player_chain.get_players(),
             tokens=['DEFENSEBONUS_ITEVENT',
                 defending_jumon.id,
-                defending_jumon.position,
+                str(defending_jumon.position),
                 defending_jumon_bonus])
         propagate_message(attackbonus_itevent)
         propagate_message(defensebonus_itevent)
@@ -1195,8 +1212,8 @@ class TwoTileBattleFightState(State):
             tokens=['ONETILEFIGHT',
                 attacking_jumon.id,
                 defending_jumon.id,
-                attacking_jumon.position,
-                defending_jumon.position])
+                str(attacking_jumon.position),
+                str(defending_jumon.position)])
         propagate_message(onetilefight_itevent)
         # If no one wins victor and looser are none
         victor, looser = jumon_fight(attacking_jumon, attacking_jumon_bonus,
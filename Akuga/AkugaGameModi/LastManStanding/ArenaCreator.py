@@ -1,33 +1,17 @@
-from random import randint
-from Akuga.AkugaGameModi.Arena import (ArenaTile, Arena)
+from random import getrandbits
+import numpy as np
+from Akuga.AkugaGameModi.Arena import Arena
+from Akuga.AkugaGameModi.GlobalDefinitions import JUMON_COLORS
 
 
 def create_arena(width, height, min_bonus, max_bonus):
     """
-    Just creates an arena out of a 2d array of tiles
-    without any ArenaTile special ability
+    Just creates an arena with random boni between min_bonus and max_bonus
+    without any ArenaTile special ability.
+    The boni of all tiles are drawn at once, the generator is seeded from
+    the random module so seeding it reproduces the arena as well
     """
-    tiles = []
-    """
-    Go through x and then y, this way you address a tile with the more
-    convenient way [x][y] instead of [y][x]
-    """
-    for x in range(0, width):
-        row = []
-        for y in range(0, height):
-            color_boni = {}
-            color_boni["red"] = (
-                randint(min_bonus, max_bonus),
-                randint(min_bonus, max_bonus))
-            color_boni["blue"] = (
-                randint(min_bonus, max_bonus),
-                randint(min_bonus, max_bonus))
-            color_boni["green"] = (
-                randint(min_bonus, max_bonus),
-                randint(min_bonus, max_bonus))
-            color_boni["black"] = (
-                randint(min_bonus, max_bonus),
-                randint(min_bonus, max_bonus))
-            row.append(ArenaTile(color_boni))
-        tiles.append(row)
-    return Arena(tiles, width, height)
+    generator = np.random.default_rng(getrandbits(64))
+    boni = generator.integers(min_bonus, max_bonus, endpoint=True,
+        size=(len(JUMON_COLORS), width, height, 2))
+    return Arena(width, height, boni)
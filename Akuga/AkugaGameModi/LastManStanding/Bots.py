@@ -0,0 +1,285 @@
+"""
+Bots playing last man standing matches over a usual match connection.
+A bot tracks the game state like a match client, acknowledging every game
+state so it only receives deltas, and lets a policy order the actions it
+can try. Invalid actions are not answered by the match server, so if
+nothing happens for a moment the bot tries the next action. The bot waits
+twice as long after every unanswered action, so a busy match server is
+not flooded with retries.
+Bots are used to play headless matches, e.g. to stress test the match
+server.
+"""
+import socket
+import random
+from collections import OrderedDict
+from Akuga.AkugaGameModi.GlobalDefinitions import GAMESTATE_HISTORY
+from Akuga.AkugaGameModi.LastManStanding.GlobalDefinitions import (
+    BOT_RETRY_TIMEOUT,
+    BOT_MAX_RETRY_TIMEOUT)
+from Akuga.Network import SocketClosed
+from Akuga.AkugaGameModi.NetworkProtocoll import (
+    gamestate_snapshot,
+    apply_gamestate_delta)
+
+
+class RandomPolicy:
+    """
+    Tries the actions of every phase in a random order,
+    picking comes first, then summoning and moving
+    """
+    def order_actions(self, bot, picks, summons, moves):
+        """
+        Return the list of actions in the order they should be tried
+        """
+        for actions in (picks, summons, moves):
+            random.shuffle(actions)
+        return picks + summons + moves
+
+
+class GreedyPolicy:
+    """
+    Picks and summons the strongest jumons first and attacks whenever
+    possible, the strongest attacker first. Other moves are tried in a
+    random order.
+    The view the actions are ordered for has to provide the
+    jumon_strength and jumon_at functions
+    """
+    def order_actions(self, view, picks, summons, moves):
+        """
+        Return the list of actions in the order they should be tried
+        """
+        def strength(action):
+            return view.jumon_strength(action[1])
+        picks.sort(key=strength, reverse=True)
+        summons.sort(key=strength, reverse=True)
+        random.shuffle(moves)
+        attacks = [move for move in moves
+            if view.jumon_at(move[2]) is not None]
+        attacks.sort(key=strength, reverse=True)
+        moves = [move for move in moves if move not in attacks]
+        return picks + summons + attacks + moves
+
+
+class Bot:
+    """
+    Plays a match as the user name using the communicator connected to
+    the match server
+    """
+    def __init__(self, name, communicator, policy, record=False,
+            jumon_stats={}):
+        '''
+        name: The name of the user the bot plays for
+        communicator: The communicator connected to the match server
+        policy: Orders the actions the bot can try
+        record: If True all received packets are kept in received
+        jumon_stats: The attack and defense of the jumons stored under
+        their name, used by policies judging the strength of a jumon
+        '''
+        self.name = name
+        self.communicator = communicator
+        self.policy = policy
+        self.record = record
+        self.jumon_stats = jumon_stats
+        self.received = []
+        # The names of all jumons in the match stored under their id
+        self.jumon_names = {}
+        # The last game states stored under their seq, deltas are
+        # based on one of them
+        self.snapshots = OrderedDict()
+        self.snapshot = {}
+        # The packets of a full snapshot received until GAMESTATE_SEQ
+        self.snapshot_packets = []
+        # The actions left to try during the current turn
+        self.actions = []
+        # The tiles the own jumons can move to in the current game state
+        # stored under the id of the jumon, requested from the match
+        self.move_targets = {}
+        # Seconds to wait for the reaction to the last action
+        self.retry_timeout = BOT_RETRY_TIMEOUT
+        self.finished = False
+        # The name of the victor, None if the match is drawn
+        self.result = None
+
+    def play(self):
+        """
+        Play until the match ends and return the name of the victor
+        """
+        while not self.finished:
+            self.communicator.settimeout(self.retry_timeout)
+            try:
+                packet = self.communicator.recv_packet()
+            except socket.timeout:
+                # The last action was invalid or the turn is not over yet
+                self.retry_timeout = min(2 * self.retry_timeout,
+                    BOT_MAX_RETRY_TIMEOUT)
+                self.act()
+                continue
+            except (SocketClosed, OSError):
+                break
+            if self.record:
+                self.received.append(packet)
+            self.handle_packet(packet)
+        return self.result
+
+    def handle_packet(self, packet):
+        """
+        Track the game state and act if it is the bots turn
+        """
+        if packet[0] == 'ADD_JUMON_ITEVENT':
+            self.jumon_names[packet[2]] = packet[1]
+        elif packet[0] == 'GAMESTATE_SEQ':
+            self.add_snapshot(packet[1],
+                gamestate_snapshot(self.snapshot_packets))
+            self.snapshot_packets = []
+        elif packet[0] == 'GAMESTATE_DELTA':
+            _, seq, base_seq, changed, removed = packet
+            if base_seq not in self.snapshots:
+                self.send_packet(['REQUEST_GAMESTATE'])
+                return
+            self.add_snapshot(seq, apply_gamestate_delta(
+                self.snapshots[base_seq], changed, removed))
+        elif packet[0] == 'MOVE_TARGETS':
+            self.move_targets[packet[1]] = [tuple(target[:2])
+                for target in packet[2]]
+            self.actions = self.possible_actions()
+        elif packet[0] == 'MATCH_RESULT':
+            self.result = packet[1]
+        elif packet[0] == 'MATCH_END':
+            self.finished = True
+        elif packet[0] in ('PICK_POOL_DATA', 'PLAYER_DATA_JUMONS_TO_SUMMON',
+                'PLAYER_DATA_SUMMONED_JUMONS', 'ARENA_DATA',
+                'JUMON_NONPERSISTENT_INTERFERENCE',
+                'JUMON_PERSISTENT_INTERFERENCE', 'CURRENT_PLAYER'):
+            self.snapshot_packets.append(packet)
+
+    def add_snapshot(self, seq, snapshot):
+        """
+        Apply a new game state, acknowledge it and start the turn if it
+        is the bots turn. The move targets of the own jumons are requested
+        again, until they arrive only adjacent tiles are tried
+        """
+        self.snapshots[seq] = snapshot
+        while len(self.snapshots) > GAMESTATE_HISTORY:
+            self.snapshots.popitem(last=False)
+        self.snapshot = snapshot
+        self.retry_timeout = BOT_RETRY_TIMEOUT
+        self.send_packet(['GAMESTATE_ACK', seq])
+        self.move_targets = {}
+        if self.current_player() == self.name:
+            positions = self.jumon_positions()
+            for _id in self.jumon_ids('PLAYER_DATA_SUMMONED_JUMONS',
+                    self.name):
+                if _id in positions:
+                    self.send_packet(['MOVE_TARGETS', _id])
+        self.actions = self.possible_actions()
+        self.act()
+
+    def current_player(self):
+        """
+        Return the name of the current player
+        """
+        packet = self.snapshot.get(('CURRENT_PLAYER',))
+        return packet[1] if packet is not None else None
+
+    def jumon_ids(self, command, player_name=None):
+        """
+        Return the ids of the jumons in the pick pool or in one of the
+        player data lists of a player
+        """
+        key = (command,) if player_name is None else (command, player_name)
+        packet = self.snapshot.get(key)
+        if packet is None:
+            return []
+        start = 1 if player_name is None else 2
+        return [jumon[0] for jumon in packet[start:]]
+
+    def jumon_positions(self):
+        """
+        Return the positions of all jumons in the arena as a dict
+        id: (x, y)
+        """
+        positions = {}
+        for key, packet in self.snapshot.items():
+            if key[0] == 'TILE_DATA' and packet[3] != '':
+                positions[packet[3]] = (packet[1], packet[2])
+        return positions
+
+    def jumon_strength(self, _id):
+        """
+        Return the sum of attack and defense of a jumon, 0 if its stats
+        are unknown
+        """
+        stats = self.jumon_stats.get(self.jumon_names.get(_id))
+        if stats is None:
+            return 0
+        return stats[0] + stats[1]
+
+    def jumon_at(self, position):
+        """
+        Return the id of the jumon at a position in the format $x,$y,
+        None if the tile is free
+        """
+        x, y = (int(token) for token in position.split(','))
+        for _id, jumon_position in self.jumon_positions().items():
+            if jumon_position == (x, y):
+                return _id
+        return None
+
+    def possible_actions(self):
+        """
+        Return the actions the bot can try this turn ordered by the
+        policy, an empty list if it is not the bots turn
+        """
+        if self.current_player() != self.name:
+            return []
+        picks = [['PICK_JUMON', _id]
+            for _id in self.jumon_ids('PICK_POOL_DATA')]
+        summons = [['SUMMON_JUMON', _id] for _id in
+            self.jumon_ids('PLAYER_DATA_JUMONS_TO_SUMMON', self.name)]
+        own_jumons = self.jumon_ids('PLAYER_DATA_SUMMONED_JUMONS', self.name)
+        size = self.snapshot.get(('ARENA_SIZE',))
+        positions = self.jumon_positions()
+        own_positions = [positions[_id] for _id in own_jumons
+            if _id in positions]
+        moves = []
+        for _id in own_jumons:
+            if _id in self.move_targets:
+                moves += [['MOVE_JUMON', _id, str(x) + ',' + str(y)]
+                    for x, y in self.move_targets[_id]]
+                continue
+            if _id not in positions or size is None:
+                continue
+            x, y = positions[_id]
+            for dx, dy in ((1, 0), (-1, 0), (0, 1), (0, -1)):
+                target = (x + dx, y + dy)
+                if 0 <= target[0] < size[1] and 0 <= target[1] < size[2]\
+                        and target not in own_positions:
+                    moves.append(['MOVE_JUMON', _id,
+                        str(target[0]) + ',' + str(target[1])])
+        return self.policy.order_actions(self, picks, summons, moves)
+
+    def act(self):
+        """
+        Try the next action if it is the bots turn. If all actions were
+        tried without success start again, maybe the blocking jumon has
+        been moved in the meantime
+        """
+        if self.current_player() != self.name:
+            return
+        if not self.actions:
+            self.actions = self.possible_actions()
+            if not self.actions:
+                return
+        self.send_packet(self.actions.pop(0))
+
+    def send_packet(self, tokens):
+        """
+        Send a packet to the match server. The receive timeout applies to
+        sending as well, a packet which cant be sent in time is dropped.
+        A lost action is retried and a lost acknowledgement only leads
+        to a full snapshot
+        """
+        try:
+            self.communicator.send_packet(tokens)
+        except OSError:
+            pass
@@ -9,3 +9,11 @@ SECONDS_PER_TURN = 90
 MAX_TIMEOUTS = 2
 MAX_REMI_COUNTER = 4
 CREDITS_PER_WIN = 50
+# Seconds between checks if a disconnected user has reconnected
+RECONNECT_POLL_INTERVAL = 1
+# Seconds between the move attempts of the neutral player
+NEUTRAL_MOVE_INTERVAL = 0.1
+# Seconds a bot waits for the reaction to an action before it tries
+# an other one
+BOT_RETRY_TIMEOUT = 0.05
+BOT_MAX_RETRY_TIMEOUT = 2
@@ -0,0 +1,105 @@
+"""
+Measures the interference handling of a turn on a board of the given size
+with the given amount of jumons, every second jumon has a passive ability
+adding a nonpersistent interference to itself and to its tile. Every
+jumon and its tile carry the given amount of persistent interferences.
+A turn is made of the turn begin state, looking up the totals of all
+jumons and their tiles and building the game state packets:
+
+python -m Akuga.AkugaGameModi.LastManStanding.InterferenceBenchmark \
+    $board_size $jumons $persistent_interferences $turns
+"""
+import sys
+import time
+import random
+from Akuga.User import User
+from Akuga.AkugaGameModi.Meeple import Jumon
+from Akuga.AkugaGameModi.Player import Player
+from Akuga.AkugaGameModi.PlayerChain import PlayerChain
+from Akuga.AkugaGameModi.Position import Position
+from Akuga.AkugaGameModi.GlobalDefinitions import JUMON_COLORS
+from Akuga.AkugaGameModi.NetworkProtocoll import gamestate_packets
+from Akuga.AkugaGameModi.LastManStanding.ArenaCreator import create_arena
+from Akuga.AkugaGameModi.LastManStanding.AkugaStateMachiene import (
+    create_last_man_standing_fsm)
+
+
+class PassiveJumon(Jumon):
+    """
+    A jumon strengthening itself and its tile every turn
+    """
+    def special_ability(self, current_state, next_state_and_variables):
+        self.nonpersistent_interf[self.name] = (1, 1, 0)
+        tile = current_state.fsm.arena.get_tile_at(self.position)
+        tile.nonpersistent_interf[self.name] = {self.color: (5, 5)}
+        return super().special_ability(current_state,
+            next_state_and_variables)
+
+
+def build_benchmark_fsm(board_size, amount, persistent_interferences):
+    """
+    Build a last man standing fsm with two players sharing amount jumons
+    placed on random tiles of the arena
+    """
+    players = [Player(User('player' + str(i), '', 0, [], {}, {}, {},
+        None, None)) for i in range(2)]
+    arena = create_arena(board_size, board_size, 0, 250)
+    positions = random.sample([Position(x, y) for x in range(board_size)
+        for y in range(board_size)], amount)
+    for _id, position in enumerate(positions):
+        jumon_class = PassiveJumon if _id % 2 == 0 else Jumon
+        jumon = jumon_class('Jumon' + str(_id), _id,
+            random.choice(JUMON_COLORS), 1000, 1000, 2)
+        player = players[_id % 2]
+        jumon.set_owner(player)
+        player.summoned_jumons.append(jumon)
+        arena.place_unit_at(jumon, position)
+        tile = arena.get_tile_at(position)
+        for i in range(persistent_interferences):
+            jumon.persistent_interf['Relic' + str(i)] = (1, 1, 0)
+            tile.persistent_interf['Relic' + str(i)] = {jumon.color: (1, 1)}
+    fsm = create_last_man_standing_fsm()
+    fsm.add_data('arena', arena)
+    fsm.add_data('player_chain', PlayerChain(players[0], players[1]))
+    fsm.add_data('jumon_pick_pool', [])
+    return fsm
+
+
+def look_up_totals(fsm):
+    """
+    Look up the total values of all jumons and the boni of their tiles
+    """
+    total = 0
+    for player in fsm.player_chain.get_players():
+        for jumon in player.summoned_jumons:
+            tile = fsm.arena.get_tile_at(jumon.position)
+            total += jumon.get_total_attack() + jumon.get_total_defense()\
+                + jumon.get_total_movement()\
+                + tile.get_total_attack_bonus(jumon)\
+                + tile.get_total_defense_bonus(jumon)
+    return total
+
+
+if __name__ == '__main__':
+    board_size = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    amount = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    persistent_interferences = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+    turns = int(sys.argv[4]) if len(sys.argv) > 4 else 100
+    random.seed(0)
+    fsm = build_benchmark_fsm(board_size, amount, persistent_interferences)
+    phases = [
+        ('turn begin', lambda: fsm.turn_begin_state.run(None)),
+        ('totals', lambda: look_up_totals(fsm)),
+        ('game state packets', lambda: gamestate_packets(fsm))]
+    timings = {name: 0 for name, phase in phases}
+    for turn in range(turns):
+        for name, phase in phases:
+            start = time.perf_counter()
+            phase()
+            timings[name] += time.perf_counter() - start
+    print('%dx%d board, %d jumons, %d persistent interferences, %d turns' % (
+        board_size, board_size, amount, persistent_interferences, turns))
+    for phase, seconds in timings.items():
+        print('  %-20s %10.3f ms per turn' % (phase, 1e3 * seconds / turns))
+    print('  %-20s %10.3f ms per turn' % ('sum',
+        1e3 * sum(timings.values()) / turns))
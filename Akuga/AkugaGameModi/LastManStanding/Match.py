@@ -1,31 +1,42 @@
 import queue
 import logging
 import socket
-from time import sleep
+from time import time
 
 from Akuga.AkugaGameModi.Player import (Player, NeutralPlayer)
 from Akuga.AkugaGameModi.PlayerChain import PlayerChain
 from Akuga.AkugaGameModi.LastManStanding.ArenaCreator import create_arena
 import Akuga.AkugaGameModi.LastManStanding.AkugaStateMachiene as AkugaStateMachiene
+from Akuga.AkugaGameModi.LastManStanding.AkugaStates import get_move_targets
 import Akuga.AkugaGameModi.MeepleDict as MeepleDict
-from Akuga.AkugaGameModi.GlobalDefinitions import USER_DBS_ADDRESS
+from Akuga.AkugaGameModi.GlobalDefinitions import (
+    USER_DBS_ADDRESS,
+    OUTBOUND_QUEUE_PACKETS,
+    OUTBOUND_QUEUE_BYTES,
+    OUTBOUND_QUEUE_DRAIN_TIMEOUT)
 from Akuga.AkugaGameModi.LastManStanding.GlobalDefinitions import (
     BOARD_WIDTH,
     BOARD_HEIGHT,
     MIN_TILE_BONUS,
     MAX_TILE_BONUS,
     SECONDS_PER_TURN,
-    CREDITS_PER_WIN)
-from Akuga.AkugaGameModi.NetworkProtocoll import (
+    CREDITS_PER_WIN,
+    RECONNECT_POLL_INTERVAL,
+    NEUTRAL_MOVE_INTERVAL,
+    DEBUG)
+from Akuga.Network import (
     SocketClosed,
     StreamSocketCommunicator,
-    callback_recv_packet,
+    OutboundQueue)
+from Akuga.AkugaGameModi.NetworkProtocoll import (
+    PacketSelector,
     handle_match_connection,
-    send_gamestate_to_client,
+    GameStateSync,
     propagate_message)
 from Akuga.EventDefinitions import (
     Event,
     NOEVENT,
+    TIMEOUT_EVENT,
     PACKET_PARSER_ERROR_EVENT,
     TURN_ENDS,
     MATCH_IS_DRAWN,
@@ -35,10 +46,51 @@ from Akuga.JumonSet import (serialize_set_to_list, get_set_size)
 from Akuga.User import User
 
 
-running = True
 logger = logging.getLogger(__name__)
 
 
+class MatchContext:
+    """
+    Everything a single match needs while it runs: the loop flag, the jumon
+    catalog, the event queue and the fsm. Matches dont share any module
+    level state, so many of them can run concurrently in one process
+    """
+    def __init__(self, users, options, userdbs_communicator):
+        '''
+        users: list of user instances playing the match
+        options: A dictionary with options of the match
+        userdbs_communicator: The communicator to the user database
+        '''
+        self.users = users
+        self.options = options
+        self.userdbs_communicator = userdbs_communicator
+        # The main loop runs until this is set to False
+        self.running = True
+        # The name of the victor, None while running or if drawn
+        self.victor_name = None
+        # The events enqueued by the fsm and the packet handlers
+        self.queue = queue.Queue()
+        # The catalog of all jumons, shared with the other matches
+        self.jumon_catalog = None
+        # The state machiene representing the whole game state
+        self.game_state = None
+        # Waits for the packets of all users at once
+        self.selector = PacketSelector()
+
+    def load_jumon_catalog(self):
+        """
+        Take the jumon catalog shared by all matches, it is only fetched
+        from the user database if it isnt loaded yet.
+        Returns False if the database answered with an error
+        """
+        catalog = MeepleDict.get_jumon_catalog(self.userdbs_communicator)
+        if type(catalog) is not MeepleDict.JumonCatalog:
+            logger.info('Cant load the jumon catalog: ' + str(catalog))
+            return False
+        self.jumon_catalog = catalog
+        return True
+
+
 def check_set_for_lms(active_set):
     """
     Checks if a set is legal for the lms mode
@@ -56,7 +108,7 @@ def check_set_for_lms(active_set):
 
 
 def build_last_man_standing_game_state(player_chain, jumon_sets,
-        userdbs_communicator, _queue, options={}):
+        jumon_catalog, _queue, options={}):
     # Build the arena
     arena = create_arena(BOARD_WIDTH,
                         BOARD_HEIGHT,
@@ -66,8 +118,6 @@ def build_last_man_standing_game_state(player_chain, jumon_sets,
     # Every jumon in the match will have a unique id
     jumon_id = 0
     jumon_pick_pool = []
-    # Initialise the JUMON_NAME_CONSTRUCTOR_DICT
-    MeepleDict.initialise_jumon_name_constructor_dict(userdbs_communicator)
     # Go through all jumon sets
     for jumon_set in jumon_sets:
         # Convert the set to a list for easier processing
@@ -75,11 +125,10 @@ def build_last_man_standing_game_state(player_chain, jumon_sets,
         # Now generate the correct jumon instance for every name
         # in the list of jumon names representing the set of a player
         for jumon_name in jumon_set_as_name_list:
-            # The JUMON_NAME_CONSTRUCTOR_DICT is a dictionary storing
-            # the right constructor under the name of the jumon, only the
-            # id has to be passed
+            # The jumon catalog stores a template for every jumon,
+            # only the id has to be passed
             jumon_pick_pool.append(
-                MeepleDict.JUMON_NAME_CONSTRUCTOR_DICT[jumon_name](jumon_id))
+                jumon_catalog.create_jumon(jumon_name, jumon_id))
             # Simply increment the jumon id to make sure every jumon
             # has a unique id
             jumon_id += 1
@@ -100,6 +149,8 @@ def build_last_man_standing_game_state(player_chain, jumon_sets,
     game_state.add_data("jumons_in_play", jumons_in_play)
     game_state.add_data("jumon_pick_pool", jumon_pick_pool)
     game_state.add_data("post_turn_state_changes", [])
+    # Propagates the game state as deltas to the users who acknowledged it
+    game_state.add_data("gamestate_sync", GameStateSync())
     game_state.add_data("timeout_timer", 0)
     game_state.add_data("old_time", 0)
     game_state.add_data("current_time", 0)
@@ -107,50 +158,148 @@ def build_last_man_standing_game_state(player_chain, jumon_sets,
     return game_state
 
 
-def handle_fsm_response(event, game_state,
-        users, userdbs_communicator):
+def handle_user_packet(tokens, user, _queue, game_state):
+    """
+    Handles a packet received from a user during the match.
+    Game state acknowledgements and requests are handeld by the game state
+    sync and queries are answered directly, all other packets are
+    converted to events for the fsm
+    """
+    if game_state.gamestate_sync.handle_packet(tokens, user):
+        return
+    if handle_query_packet(tokens, user, game_state):
+        return
+    handle_match_connection(tokens, _queue, game_state.jumons_in_play)
+
+
+def handle_query_packet(tokens, user, game_state):
+    """
+    Answers the queries every user can send during the whole match,
+    they dont change the game state. Returns if the packet was a query
+    """
+    if tokens[0] == 'MOVE_TARGETS' and len(tokens) >= 2:
+        """
+        Send all tiles a jumon can move to and their distance
+        MOVE_TARGETS $id
+        The answer is in the form MOVE_TARGETS $id [[$x, $y, $distance], ...]
+        """
+        try:
+            jumon = game_state.jumons_in_play[int(tokens[1])]
+        except (KeyError, ValueError, TypeError):
+            logger.info("Packet Parser Error: Invalid Meeple\n")
+            return True
+        targets = get_move_targets(game_state.arena, jumon)
+        user.communicator.send_packet(['MOVE_TARGETS', jumon.id,
+            [[x, y, distance] for (x, y), distance in sorted(targets.items())]])
+        return True
+    return False
+
+
+def get_turn_time_left(game_state):
+    """
+    Return the seconds left until the current turn times out
+    """
+    return game_state.old_time + SECONDS_PER_TURN -\
+        game_state.timeout_timer - time()
+
+
+def get_wait_timeout(game_state, users):
+    """
+    Return the seconds to wait for a packet of the current player.
+    Disconnected users are checked for a reconnect regularly and the
+    neutral player can try an other move regularly
+    """
+    timeout = max(0, get_turn_time_left(game_state))
+    if any(user.communicator.peer_closed for user in users):
+        timeout = min(timeout, RECONNECT_POLL_INTERVAL)
+    if type(game_state.player_chain.get_current_player()) is NeutralPlayer:
+        timeout = min(timeout, NEUTRAL_MOVE_INTERVAL)
+    return timeout
+
+
+def receive_user_packets(context, timeout):
+    """
+    Wait up to timeout seconds for packets of all users and handle them.
+    Packets of the current player are converted to events for the fsm,
+    the other users can only acknowledge or request the game state and
+    send queries
+    """
+    game_state = context.game_state
+    users = context.users
+    current_player = game_state.player_chain.get_current_player()
+    users_by_communicator = {id(user.communicator): user for user in users}
+    communicators = [user.communicator for user in users]
+    for communicator in context.selector.select(communicators, timeout):
+        user = users_by_communicator[id(communicator)]
+        try:
+            tokens = communicator.poll_packet()
+        except socket.timeout:
+            continue
+        except (SocketClosed, OSError):
+            # The reconnect attempt is handeld in the game server.
+            # The reconnected client needs a full snapshot
+            logger.info(user.name + " has disconnected")
+            game_state.gamestate_sync.reset(user)
+            continue
+        if tokens is None:
+            continue
+        if type(current_player) is not NeutralPlayer and\
+                current_player.user is user:
+            handle_user_packet(tokens, user, context.queue, game_state)
+        elif not game_state.gamestate_sync.handle_packet(tokens, user) and\
+                not handle_query_packet(tokens, user, game_state):
+            logger.info("Ignoring packet of " + user.name + " out of turn")
+
+
+def record_match_result(userdbs_communicator, users, victor_name):
+    """
+    Add a win to the userstats of the victor and reward per with ingame
+    cash, all other users get a loose. The database server records
+    everything in one transaction
+    """
+    userdbs_communicator.send_packet(['RECORD_MATCH_RESULT', 'lms',
+        victor_name, [user.name for user in users
+            if user.name != victor_name], CREDITS_PER_WIN])
+    userdbs_communicator.recv_packet()
+
+
+def handle_fsm_response(event, context):
     '''
     This function handles the events enqueued by the fsm,
     e.g. TURN_END, PLAYER_HAS_WON, MESSAGE...
     '''
-    global running
+    users = context.users
     if event == PLAYER_HAS_WON:
         # Leave the main loop
-        running = False
+        context.running = False
         victor_name = event.victor.name
+        context.victor_name = victor_name
         logger.info("Player: " + victor_name + " has won!\n")
         # If the match is not drawn add a victory or loose to the userstats
-        if victor_name is not None:
+        if victor_name is not None and\
+                context.options.get('record_results', True):
             # Go through all users and add a win or a loose
-            for user in users:
-                if user.name == victor_name:
-                    userdbs_communicator.send_packet(
-                        ['ADD_WIN', user.name, 'lms'])
-                    userdbs_communicator.recv_packet()
-                    # Also reward the victor with ingame cash
-                    userdbs_communicator.send_packet(
-                        ["REWARD_USER", user.name, CREDITS_PER_WIN])
-                    userdbs_communicator.recv_packet()
-                else:
-                    userdbs_communicator.send_packet(
-                        ['ADD_LOOSE', user.name, 'lms'])
-                    userdbs_communicator.recv_packet()
+            record_match_result(context.userdbs_communicator, users,
+                victor_name)
         # Signal the end of the match and the victor
         propagate_message(Event(MESSAGE, users=users,
             tokens=['MATCH_RESULT', victor_name]))
         propagate_message(Event(MESSAGE, users=users, tokens=['MATCH_END']))
 
     if event == MATCH_IS_DRAWN:
-        # If the match is drawn only log it and
-        # leave the main loop
-        running = False
+        # If the match is drawn log it, leave the main loop and
+        # signal the end of the match without a victor
+        context.running = False
         logger.info("Match is drawn!\n")
+        propagate_message(Event(MESSAGE, users=users,
+            tokens=['MATCH_RESULT', None]))
+        propagate_message(Event(MESSAGE, users=users, tokens=['MATCH_END']))
 
     if event == TURN_ENDS:
         # If a turn ends the game_state has to
         # be propagated to all users
         logger.info("Propagating game state\n")
-        send_gamestate_to_client(users, game_state)
+        context.game_state.gamestate_sync.send(users, context.game_state)
 
     if event == PACKET_PARSER_ERROR_EVENT:
         # Print the event msg but ignore the packet
@@ -162,11 +311,16 @@ def handle_fsm_response(event, game_state,
         propagate_message(event)
 
 
-def match_server(users, options={}):
+def match_server(users, options={}, dbs_pool=None):
     """
     The actual game runs here and is propagated to the users
     users: list of user instances
-    options: A dictionary with options, not used yet
+    options: A dictionary with options, record_results: False keeps the
+    result out of the userstats, e.g. for simulated matches
+    dbs_pool: The shared connections to the user database, if it is None
+    the match connects to the user database on its own
+    Returns the name of the victor, None if the match is drawn or -1 if
+    the match could not be started
     """
     # Set all players to be in play
     # This will deactivate the game server connection
@@ -177,31 +331,44 @@ def match_server(users, options={}):
     player_chain = PlayerChain(player1, player2)
     for i in range(2, len(users)):
         player_chain.insert_player(Player(users[i]))
-    # Create the queue
-    _queue = queue.Queue()
-
-    userdbs_connection = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    try:
-        userdbs_connection.connect(USER_DBS_ADDRESS)
-    except ConnectionRefusedError:
-        logger.info('Cant connect to akuga database server')
+    if dbs_pool is not None:
+        userdbs_communicator = dbs_pool.communicator()
+    else:
+        userdbs_connection = socket.socket(socket.AF_INET,
+            socket.SOCK_STREAM)
+        try:
+            userdbs_connection.connect(USER_DBS_ADDRESS)
+        except ConnectionRefusedError:
+            logger.info('Cant connect to akuga database server')
+            return -1
+        # Create a database communicator from the socket
+        userdbs_communicator = StreamSocketCommunicator(
+            userdbs_connection, 512)
+
+    # Everything the match needs is owned by its context
+    context = MatchContext(users, options, userdbs_communicator)
+    if not context.load_jumon_catalog():
+        for user in users:
+            user.in_play = False
         return -1
-    # Create a database communicator from the socket
-    userdbs_communicator = StreamSocketCommunicator(userdbs_connection, 512)
 
     # Get the active jumon sets as a list
     jumon_sets = []
     for user in users:
         jumon_sets.append(user.active_set)
 
-    game_state = None
     logger.info("Game Mode: LastManStanding\n")
     game_state = build_last_man_standing_game_state(player_chain, jumon_sets,
-        userdbs_communicator, _queue, options)
+        context.jumon_catalog, context.queue, options)
+    context.game_state = game_state
 
     # Set seconds per turn to be the timeout for all user connections
+    # and send all packets using an outbound queue, so a slow client
+    # cant block the match
     for user in users:
-        user.communicator.connection.settimeout(SECONDS_PER_TURN)
+        user.communicator.settimeout(SECONDS_PER_TURN)
+        user.communicator = OutboundQueue(user.communicator,
+            OUTBOUND_QUEUE_PACKETS, OUTBOUND_QUEUE_BYTES)
 
     # Signal the clients that the match starts
     propagate_message(Event(MESSAGE, users=users,
@@ -217,49 +384,61 @@ def match_server(users, options={}):
     # Initially propagate the game state
     logger.info("Start match between" + str(player_chain) + "\n")
     logger.info("Propagating game state\n")
-    send_gamestate_to_client(users, game_state)
+    game_state.gamestate_sync.send(users, game_state)
 
-    while running:
+    # Set if the fsm waits for the current player and the last run
+    # didnt change anything, so the fsm has to wait for a packet
+    idle = False
+    while context.running:
         """
-        Receive and handle packets from the current player only.
+        The state machiene only runs if there is an event to handle or
+        a state to leave. While it waits for the current player the match
+        sleeps until a packet arrives or the turn times out.
         The handle_match_connection will throw the right event which will
         be handeld by the gamestate statemachiene.
         Only some events have to be handeld here.
         """
-        if type(game_state.player_chain.get_current_player())\
-                is not NeutralPlayer and\
-                game_state.current_state is\
-                game_state.wait_for_user_state:
-            # Receive packets only from the current user
-            user = game_state.player_chain.get_current_player().user
-            try:
-                callback_recv_packet(user.communicator,
-                    handle_match_connection,
-                    [_queue, game_state.jumons_in_play])
-            except SocketClosed:
-                # If the client has disconnected just wait for a second
-                # The reconnect attempt is handeld in the game server
-                sleep(1)
         # Get an event from the queue and mimic the pygame event behaviour
         try:
-            event = _queue.get_nowait()
+            event = context.queue.get_nowait()
         except queue.Empty:
+            event = None
+        if event is None and idle:
+            receive_user_packets(context,
+                get_wait_timeout(game_state, users))
+            if context.queue.empty() and\
+                    get_turn_time_left(game_state) <= 0:
+                # The time the user had to make a decision has passed
+                context.queue.put(Event(TIMEOUT_EVENT))
+            try:
+                event = context.queue.get_nowait()
+            except queue.Empty:
+                event = None
+        if event is None:
             event = Event(NOEVENT)
 
         # Handle the events which are not handeld by the gamestate itself
-        handle_fsm_response(event, game_state,
-            users, userdbs_communicator)
+        handle_fsm_response(event, context)
         # Run the rule building state machiene
+        last_state = game_state.current_state
         game_state.run(event)
-        game_state.arena.print_out()
-    print('running is false?!')
+        idle = game_state.current_state is last_state and\
+            last_state is game_state.wait_for_user_state
+        if DEBUG:
+            game_state.arena.print_out()
+    context.selector.close()
 
     # Looks weird, but this code block is inside the MatchServer function
     # but outside the matches main loop
     # Set all players to be out of play
     # This will activate the game server communicator
+    # The last packets, e.g. MATCH_END, are sent before the game server
+    # can use the connection again
     for user in users:
+        user.communicator = user.communicator.stop(
+            OUTBOUND_QUEUE_DRAIN_TIMEOUT)
         user.in_play = False
+    return context.victor_name
 
 
 if __name__ == "__main__":
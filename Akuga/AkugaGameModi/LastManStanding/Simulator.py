@@ -0,0 +1,378 @@
+"""
+A headless batch simulator for last man standing matches, used to
+balance the jumons. The state machiene of a match is driven directly by
+policies choosing the actions of the players, there are no sockets and no
+database server involved. The matches are spread over a pool of worker
+processes. The stats of the vanilla jumons are read once from the
+database file.
+When all matches have ended the win rates per jumon and per color are
+printed, a jumon or color counts as played by a player if per picked at
+least one of them. The time spent in every state of the state machiene is
+printed as well:
+
+python -m Akuga.AkugaGameModi.LastManStanding.Simulator $matches \
+    $processes $policies $database_path
+
+policies is a comma seperated list of the policies of the players,
+e.g. random,greedy. Every player plays with a random legal set.
+"""
+import os
+import sys
+import time
+import queue
+import random
+import sqlite3
+import multiprocessing
+from collections import Counter
+from Akuga.User import User
+from Akuga.JumonSet import get_set_size
+from Akuga.AkugaGameModi.Player import Player
+from Akuga.AkugaGameModi.PlayerChain import PlayerChain
+from Akuga.AkugaGameModi.Position import Position
+from Akuga.AkugaGameModi.MeepleDict import create_jumon_catalog
+from Akuga.AkugaGameModi.NetworkProtocoll import handle_match_connection
+from Akuga.AkugaGameModi.LastManStanding.Match import (
+    build_last_man_standing_game_state)
+from Akuga.AkugaGameModi.LastManStanding.AkugaStates import get_move_targets
+from Akuga.AkugaGameModi.LastManStanding.Bots import (
+    RandomPolicy,
+    GreedyPolicy)
+from Akuga.AkugaDatabaseServer.GlobalDefinitions import DATABASE_PATH
+from Akuga.EventDefinitions import (
+    Event,
+    NOEVENT,
+    TIMEOUT_EVENT,
+    TURN_ENDS,
+    MATCH_IS_DRAWN,
+    PLAYER_HAS_WON)
+
+
+POLICIES = {'random': RandomPolicy, 'greedy': GreedyPolicy}
+# The amount of jumons in a set and the max amount of one jumon in a set
+LMS_SET_SIZE = 7
+LMS_MAX_JUMON_COPIES = 3
+# Matches lasting longer are aborted, they would never end otherwise
+# if the policies of both players keep avoiding fights
+MAX_SIMULATED_TURNS = 1000
+# The amount of matches a worker process simulates per task
+MATCHES_PER_TASK = 100
+
+# The catalog and policies of a worker process, set by initialise_worker
+worker_jumon_catalog = None
+worker_policies = None
+
+
+class DiscardingCommunicator:
+    """
+    The communicator of a simulated user, all packets are dropped
+    """
+    def send_bytes(self, data, coalesce_key=None):
+        pass
+
+
+class SimulatedMatchView:
+    """
+    The view of the policies on a simulated match, it provides the same
+    functions as a bot
+    """
+    def __init__(self, game_state):
+        self.game_state = game_state
+
+    def jumon_strength(self, _id):
+        """
+        Return the sum of attack and defense of a jumon
+        """
+        jumon = self.game_state.jumons_in_play[_id]
+        return jumon.attack + jumon.defense
+
+    def jumon_at(self, position):
+        """
+        Return the id of the jumon at a position in the format $x,$y,
+        None if the tile is free
+        """
+        x, y = (int(token) for token in position.split(','))
+        unit = self.game_state.arena.get_unit_at(Position(x, y))
+        return unit.id if unit is not None else None
+
+
+class SimulationStats:
+    """
+    The results of many simulated matches, the stats of several workers
+    are merged
+    """
+    def __init__(self):
+        self.matches = 0
+        self.drawn = 0
+        self.aborted = 0
+        self.turns = 0
+        self.seconds = 0
+        # Wins stored under the index of the player
+        self.seat_wins = Counter()
+        # How often a jumon or color was played and won by a player
+        self.jumons_played = Counter()
+        self.jumons_won = Counter()
+        self.colors_played = Counter()
+        self.colors_won = Counter()
+        # Calls and seconds of the run function stored under the state
+        self.state_calls = Counter()
+        self.state_seconds = Counter()
+
+    def add_match(self, victor, picked_jumons, turns):
+        """
+        Add the result of a match, victor is the index of the victor,
+        None if drawn and -1 if aborted. picked_jumons is a list of the
+        picked jumons of every player
+        """
+        self.matches += 1
+        self.turns += turns
+        if victor is None:
+            self.drawn += 1
+        elif victor == -1:
+            self.aborted += 1
+        else:
+            self.seat_wins[victor] += 1
+        for index, jumons in enumerate(picked_jumons):
+            names = set(jumon.name for jumon in jumons)
+            colors = set(jumon.color for jumon in jumons)
+            self.jumons_played.update(names)
+            self.colors_played.update(colors)
+            if index == victor:
+                self.jumons_won.update(names)
+                self.colors_won.update(colors)
+
+    def merge(self, other):
+        """
+        Add all results of an other SimulationStats instance
+        """
+        self.matches += other.matches
+        self.drawn += other.drawn
+        self.aborted += other.aborted
+        self.turns += other.turns
+        self.seconds += other.seconds
+        for name in ('seat_wins', 'jumons_played', 'jumons_won',
+                'colors_played', 'colors_won', 'state_calls',
+                'state_seconds'):
+            getattr(self, name).update(getattr(other, name))
+
+
+def load_vanilla_jumon_stats(database_path):
+    """
+    Read the stats of all vanilla jumons from the database file in the
+    form: name, color, attack, defense, movement
+    """
+    connection = sqlite3.connect('file:' + database_path + '?mode=ro',
+        uri=True)
+    try:
+        return connection.execute('select name, color, attack, defense,'
+            + ' movement from jumons where special=0').fetchall()
+    finally:
+        connection.close()
+
+
+def create_random_set(jumon_names):
+    """
+    Return a random set which is legal in the last man standing mode
+    """
+    jumon_set = {}
+    while get_set_size(jumon_set) < LMS_SET_SIZE:
+        name = random.choice(jumon_names)
+        if jumon_set.get(name, 0) < LMS_MAX_JUMON_COPIES:
+            jumon_set[name] = jumon_set.get(name, 0) + 1
+    return jumon_set
+
+
+def possible_actions(game_state, player, policy, view):
+    """
+    Return the actions the player can try this turn as packets the
+    client would send, ordered by the policy of the player
+    """
+    picks = []
+    summons = []
+    moves = []
+    if player.in_pick_phase():
+        picks = [['PICK_JUMON', jumon.id]
+            for jumon in game_state.jumon_pick_pool]
+    elif player.in_summon_phase():
+        summons = [['SUMMON_JUMON', jumon.id]
+            for jumon in player.jumons_to_summon]
+    elif player.in_move_phase():
+        # One search per jumon finds all its legal targets
+        for jumon in player.summoned_jumons:
+            for x, y in get_move_targets(game_state.arena, jumon):
+                moves.append(['MOVE_JUMON', jumon.id, str(x) + ',' + str(y)])
+    return policy.order_actions(view, picks, summons, moves)
+
+
+def simulate_match(jumon_catalog, jumon_sets, policies, stats):
+    """
+    Play a match between players with the jumon sets, the players act
+    according to the policies. If none of the actions of a player is
+    valid per times out, just like a client which doesnt answer.
+    Returns the index of the victor (None if drawn, -1 if aborted), the
+    picked jumons of every player and the amount of turns
+    """
+    players = []
+    for index, jumon_set in enumerate(jumon_sets):
+        user = User('player' + str(index), '', 0, [], jumon_set, {}, {},
+            DiscardingCommunicator(), None)
+        players.append(Player(user))
+    player_chain = PlayerChain(players[0], players[1])
+    for player in players[2:]:
+        player_chain.insert_player(player)
+    _queue = queue.SimpleQueue()
+    game_state = build_last_man_standing_game_state(player_chain,
+        jumon_sets, jumon_catalog, _queue)
+    view = SimulatedMatchView(game_state)
+    picked_jumons = [[] for player in players]
+    # The actions left to try this turn, None at the start of a turn
+    actions = None
+    # The index of the player and the last action tried this turn
+    last_action = None
+    turns = 0
+    idle = False
+    while turns < MAX_SIMULATED_TURNS:
+        event = _queue.get_nowait() if not _queue.empty() else None
+        if event is None and idle:
+            """
+            The fsm waits for the current player, so try the next action
+            """
+            player = player_chain.get_current_player()
+            index = players.index(player)
+            if actions is None:
+                actions = possible_actions(game_state, player,
+                    policies[index], view)
+            if actions:
+                last_action = (index, actions.pop(0))
+                handle_match_connection(last_action[1], _queue,
+                    game_state.jumons_in_play)
+            else:
+                last_action = None
+                _queue.put(Event(TIMEOUT_EVENT))
+            event = _queue.get_nowait()
+        if event is None:
+            event = Event(NOEVENT)
+
+        if event == PLAYER_HAS_WON:
+            return players.index(event.victor), picked_jumons, turns
+        if event == MATCH_IS_DRAWN:
+            return None, picked_jumons, turns
+        if event == TURN_ENDS:
+            turns += 1
+            if last_action is not None and\
+                    last_action[1][0] == 'PICK_JUMON':
+                picked_jumons[last_action[0]].append(
+                    game_state.jumons_in_play[last_action[1][1]])
+            actions = None
+            last_action = None
+
+        # Run the state machiene and time the state
+        last_state = game_state.current_state
+        start = time.perf_counter()
+        game_state.run(event)
+        stats.state_calls[last_state.name] += 1
+        stats.state_seconds[last_state.name] += time.perf_counter() - start
+        idle = game_state.current_state is last_state and\
+            last_state is game_state.wait_for_user_state
+    return -1, picked_jumons, turns
+
+
+def initialise_worker(jumon_stats, policy_names):
+    """
+    Build the jumon catalog and the policies of a worker process
+    """
+    global worker_jumon_catalog
+    global worker_policies
+    worker_jumon_catalog = create_jumon_catalog(None, jumon_stats)
+    worker_policies = [POLICIES[name]() for name in policy_names]
+    # The states print every step of the matches
+    sys.stdout = open(os.devnull, 'w')
+
+
+def simulate_matches(seeds):
+    """
+    Simulate a match for every seed and return the SimulationStats.
+    The seed makes the sets and the whole match reproducible
+    """
+    stats = SimulationStats()
+    jumon_names = sorted(worker_jumon_catalog)
+    start = time.perf_counter()
+    for seed in seeds:
+        random.seed(seed)
+        jumon_sets = [create_random_set(jumon_names)
+            for policy in worker_policies]
+        victor, picked_jumons, turns = simulate_match(worker_jumon_catalog,
+            jumon_sets, worker_policies, stats)
+        stats.add_match(victor, picked_jumons, turns)
+    stats.seconds = time.perf_counter() - start
+    return stats
+
+
+def run_simulation(matches, processes, policy_names, jumon_stats):
+    """
+    Simulate the matches in a pool of processes, or in this process if
+    processes is 0. Returns the merged SimulationStats
+    """
+    tasks = [range(start, min(start + MATCHES_PER_TASK, matches))
+        for start in range(0, matches, MATCHES_PER_TASK)]
+    stats = SimulationStats()
+    if processes == 0:
+        stdout = sys.stdout
+        initialise_worker(jumon_stats, policy_names)
+        try:
+            for seeds in tasks:
+                stats.merge(simulate_matches(seeds))
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+        return stats
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(processes, initialise_worker,
+            (jumon_stats, policy_names)) as pool:
+        for task_stats in pool.imap_unordered(simulate_matches, tasks):
+            stats.merge(task_stats)
+    return stats
+
+
+def print_win_rates(title, played, won):
+    print(title)
+    for name in sorted(played, key=lambda n: won[n] / played[n],
+            reverse=True):
+        print('  %-32s %7d played %6.1f %% won' % (name, played[name],
+            100 * won[name] / played[name]))
+
+
+def print_report(stats, policy_names, elapsed):
+    print('%d matches in %.2f s, %.0f matches per second' % (
+        stats.matches, elapsed, stats.matches / elapsed))
+    print('%d drawn, %d aborted, %.1f turns per match' % (stats.drawn,
+        stats.aborted, stats.turns / max(stats.matches, 1)))
+    for index, name in enumerate(policy_names):
+        print('player %d (%s): %.1f %% won' % (index, name,
+            100 * stats.seat_wins[index] / max(stats.matches, 1)))
+    print_win_rates('win rate per jumon', stats.jumons_played,
+        stats.jumons_won)
+    print_win_rates('win rate per color', stats.colors_played,
+        stats.colors_won)
+    total = sum(stats.state_seconds.values())
+    print('time per state (%.2f s in the state machiene, %.2f s in'
+        ' the workers)' % (total, stats.seconds))
+    for name, seconds in stats.state_seconds.most_common():
+        calls = stats.state_calls[name]
+        print('  %-40s %9d calls %8.2f us/call %5.1f %%' % (name, calls,
+            1e6 * seconds / calls, 100 * seconds / total))
+
+
+if __name__ == '__main__':
+    matches = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    processes = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+    policy_names = (sys.argv[3] if len(sys.argv) > 3 else
+        'random,greedy').split(',')
+    database_path = sys.argv[4] if len(sys.argv) > 4 else DATABASE_PATH
+    if len(policy_names) < 2 or\
+            any(name not in POLICIES for name in policy_names):
+        print('At least two policies out of: ' + ', '.join(POLICIES))
+        sys.exit(1)
+    jumon_stats = load_vanilla_jumon_stats(database_path)
+    start = time.perf_counter()
+    stats = run_simulation(matches, processes, policy_names, jumon_stats)
+    print_report(stats, policy_names, time.perf_counter() - start)
@@ -0,0 +1,160 @@
+"""
+A stress test running many headless last man standing matches
+concurrently in one process. Every match is played by two bots connected
+with socketpairs, all matches share a pool of database connections.
+When all matches have ended it is checked that every match has ended with
+the same result for both of its users and that no user received a packet
+belonging to an other match. Needs a running user database server:
+
+python -m Akuga.AkugaGameModi.LastManStanding.StressTest $matches $pool_size
+"""
+import os
+import sys
+import time
+import socket
+import traceback
+from threading import Thread
+from Akuga.Network import StreamSocketCommunicator
+from Akuga.User import User
+from Akuga.JumonSet import serialize_set_to_list
+from Akuga.GameServer.DatabasePool import DatabaseConnectionPool
+from Akuga.AkugaGameModi.GlobalDefinitions import USER_DBS_ADDRESS
+from Akuga.AkugaGameModi.LastManStanding.Match import match_server
+from Akuga.AkugaGameModi.LastManStanding.Bots import (Bot, RandomPolicy)
+
+
+# The set every bot plays with
+STRESS_TEST_SET = {'Blauta': 1, 'Plodher': 1}
+# Seconds to wait for all matches to end
+STRESS_TEST_TIMEOUT = 600
+# Packets whose second token is the name of a player
+PLAYER_NAME_PACKETS = ('PLAYER_DATA_JUMONS_TO_SUMMON',
+    'PLAYER_DATA_SUMMONED_JUMONS', 'CURRENT_PLAYER', 'PICK_ITEVENT',
+    'SUMMON_ITEVENT', 'MOVEMENT_ITEVENT', 'TIMEOUT_ITEVENT')
+
+
+class HeadlessMatch:
+    """
+    A match between two bots, the match server and the bots run in
+    threads of their own
+    """
+    def __init__(self, number, dbs_pool):
+        '''
+        number: Makes the names of the users unique
+        dbs_pool: The shared connections to the user database
+        '''
+        self.names = ['stress' + str(number) + '_' + suffix
+            for suffix in ('a', 'b')]
+        self.dbs_pool = dbs_pool
+        self.users = []
+        self.bots = []
+        for name in self.names:
+            server_side, client_side = socket.socketpair()
+            user = User(name, '', 0, [], dict(STRESS_TEST_SET), {}, {},
+                StreamSocketCommunicator(server_side, 4096), None)
+            user.active_set = user.sets[0]
+            self.users.append(user)
+            self.bots.append(Bot(name,
+                StreamSocketCommunicator(client_side, 4096),
+                RandomPolicy(), record=True))
+        self.error = None
+        self.return_value = None
+        self.duration = None
+        self.threads = [Thread(target=self.run_match)] +\
+            [Thread(target=bot.play) for bot in self.bots]
+
+    def start(self):
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def run_match(self):
+        start = time.perf_counter()
+        try:
+            self.return_value = match_server(self.users,
+                {'record_results': False}, self.dbs_pool)
+        except Exception:
+            self.error = traceback.format_exc()
+            # Let the bots notice the end of the crashed match
+            for user in self.users:
+                user.communicator.shutdown()
+        self.duration = time.perf_counter() - start
+
+    def join(self, deadline):
+        for thread in self.threads:
+            thread.join(max(0, deadline - time.time()))
+
+    def check(self):
+        """
+        Return a list of all problems found
+        """
+        if any(thread.is_alive() for thread in self.threads):
+            return ['did not end in time']
+        if self.error is not None:
+            return ['match server crashed:\n' + self.error]
+        if self.return_value == -1:
+            return ['match server could not start the match']
+        problems = []
+        results = set(bot.result for bot in self.bots)
+        if not all(bot.finished for bot in self.bots):
+            problems.append('a bot did not receive MATCH_END')
+        if len(results) != 1 or\
+                not results <= set(self.names + [None]):
+            problems.append('inconsistent results ' + str(results))
+        expected_jumons = sorted(serialize_set_to_list(STRESS_TEST_SET)
+            * len(self.users))
+        for bot in self.bots:
+            if sorted(bot.jumon_names.values()) != expected_jumons:
+                problems.append(bot.name + ' received foreign jumons')
+            for packet in self.player_packets(bot.received):
+                if packet[1] not in self.names:
+                    problems.append(bot.name + ' received ' + str(packet))
+        return problems
+
+    def player_packets(self, packets):
+        """
+        Yield all received packets naming a player, including the
+        packets inside of the game state deltas
+        """
+        for packet in packets:
+            if packet[0] == 'GAMESTATE_DELTA':
+                yield from self.player_packets(packet[3])
+            elif packet[0] in PLAYER_NAME_PACKETS:
+                yield packet
+
+
+if __name__ == '__main__':
+    amount = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    pool_size = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    dbs_pool = DatabaseConnectionPool(USER_DBS_ADDRESS, pool_size)
+    matches = [HeadlessMatch(i, dbs_pool) for i in range(amount)]
+    # The states print every step of the matches
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    start = time.perf_counter()
+    for match in matches:
+        match.start()
+    deadline = time.time() + STRESS_TEST_TIMEOUT
+    for match in matches:
+        match.join(deadline)
+    elapsed = time.perf_counter() - start
+    sys.stdout.close()
+    sys.stdout = stdout
+    dbs_pool.close()
+
+    failed = 0
+    for number, match in enumerate(matches):
+        problems = match.check()
+        if problems:
+            failed += 1
+            print('match ' + str(number) + ': ' + '\n'.join(problems))
+    durations = sorted(match.duration for match in matches
+        if match.duration is not None)
+    drawn = sum(1 for match in matches if match.bots[0].finished
+        and match.bots[0].result is None)
+    print(str(amount) + ' concurrent matches in %.2f s' % elapsed)
+    if durations:
+        print('match duration: median %.2f s, max %.2f s' % (
+            durations[len(durations) // 2], durations[-1]))
+    print(str(drawn) + ' drawn, ' + str(failed) + ' failed')
+    sys.exit(1 if failed else 0)
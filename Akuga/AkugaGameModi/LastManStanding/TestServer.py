@@ -6,11 +6,11 @@ from time import sleep
 from Akuga.AkugaGameModi.Player import (Player, NeutralPlayer)
 from Akuga.AkugaGameModi.PlayerChain import PlayerChain
 from Akuga.AkugaGameModi.LastManStanding.ArenaCreator import create_arena
-from Akuga.AkugaGameModi.MeepleDict import JUMON_NAME_CONSTRUCTOR_DICT
+import Akuga.AkugaGameModi.MeepleDict as MeepleDict
 from Akuga.AkugaGameModi import GlobalDefinitions
 import Akuga.AkugaGameModi.LastManStanding.AkugaStateMachiene as AkugaStateMachiene
+from Akuga.Network import SocketClosed
 from Akuga.AkugaGameModi.NetworkProtocoll import (
-    SocketClosed,
     callback_recv_packet,
     handle_match_connection,
     send_gamestate_to_client,
@@ -50,11 +50,10 @@ def build_last_man_standing_game_state(player_chain, jumon_sets,
         # Now generate the correct jumon instance for every name
         # in the list of jumon names representing the set of a player
         for jumon_name in jumon_set_as_name_list:
-            # The JUMON_NAME_CONSTRUCTOR_DICT is a dictionary storing
-            # the right constructor under the name of the jumon, only the
-            # id has to be passed
+            # The shared jumon catalog stores a template for every
+            # jumon, only the id has to be passed
             jumon_pick_pool.append(
-                JUMON_NAME_CONSTRUCTOR_DICT[jumon_name](jumon_id))
+                MeepleDict.JUMON_CATALOG.create_jumon(jumon_name, jumon_id))
             # Simply increment the jumon id to make sure every jumon
             # has a unique id
             jumon_id += 1
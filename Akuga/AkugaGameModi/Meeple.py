@@ -1,3 +1,96 @@
+from numbers import Integral
+from collections.abc import MutableMapping
+
+
+class Interferences(MutableMapping):
+    """
+    A dict of interferences of the form
+    interfering_jumon_name: (attack_intf, defense_int, movement_int)
+    keeping the sum of all of them in totals, updated whenever an
+    interference is added or removed. Setting an interference to the
+    value it already has changes nothing.
+    dirty: If the interferences have changed since the last copy
+    carriers: If tracked, the set the owner is added to whenever an
+    interference is added, so only the carriers have to be reset
+    """
+    def __init__(self):
+        self.interferences = {}
+        self.totals = [0, 0, 0]
+        self.dirty = False
+        self.last_copy = {}
+        self.owner = None
+        self.carriers = None
+
+    def track(self, owner, carriers):
+        """
+        Add the owner to the set of carriers whenever an interference is
+        added, starting with now if it already carries one
+        """
+        self.owner = owner
+        self.carriers = carriers
+        if self.interferences:
+            carriers.add(owner)
+
+    def add_to_totals(self, interf, sign):
+        """
+        Add the values of an interference times sign to the totals, numpy
+        integers are converted so the totals are python ints which cant
+        wrap around
+        """
+        for index, value in enumerate(interf[:3]):
+            if type(value) is not int and isinstance(value, Integral):
+                value = int(value)
+            self.totals[index] += sign * value
+
+    def __getitem__(self, name):
+        return self.interferences[name]
+
+    def __setitem__(self, name, interf):
+        old_interf = self.interferences.get(name)
+        if old_interf == interf:
+            return
+        if old_interf is not None:
+            self.add_to_totals(old_interf, -1)
+        self.add_to_totals(interf, 1)
+        self.interferences[name] = interf
+        self.dirty = True
+        if self.carriers is not None:
+            self.carriers.add(self.owner)
+
+    def __delitem__(self, name):
+        self.add_to_totals(self.interferences.pop(name), -1)
+        self.dirty = True
+
+    def __iter__(self):
+        return iter(self.interferences)
+
+    def __len__(self):
+        return len(self.interferences)
+
+    def __repr__(self):
+        return repr(self.interferences)
+
+    def clear(self):
+        """
+        Remove all interferences, does nothing if there are none
+        """
+        if self.interferences:
+            self.interferences = {}
+            self.totals = [0, 0, 0]
+            self.dirty = True
+
+    def copy(self):
+        """
+        Return a copy of the interferences as a dict. The copy is only
+        created again if the interferences have changed, so it must not
+        be modified
+        """
+        if self.dirty:
+            self.last_copy = dict(self.interferences)
+            self.dirty = False
+        return self.last_copy
+
+
 class Artefact():
     """
     The abstraction around an equipment or artifact
@@ -65,9 +158,10 @@ class Jumon():
         # state of the rule building fsm while the persisten interferences
         # have to be cleared manually
         # These interferences will be used to get the total attack, defense
-        # an movement value of the jumon
-        self.persistent_interf = {}
-        self.nonpersistent_interf = {}
+        # an movement value of the jumon, they keep the sums of their
+        # interferences so the totals are never summed up again
+        self.persistent_interf = Interferences()
+        self.nonpersistent_interf = Interferences()
 
     def set_position(self, position):
         """
@@ -126,40 +220,28 @@ class Jumon():
         the passive abilities of all jumons triggers.
         This way passive abilities can be implemented rather simple by
         adding an interference to the nonpersistent interference dictionary.
-        An interference is just a tuple with the attack and the defense
-        value
+        An interference is just a tuple with the attack, the defense and
+        the movement value
         """
-        self.nonpersistent_interf = {}
+        self.nonpersistent_interf.clear()
 
     def get_total_attack(self):
         """
         Sum up the attack and all attack interference
         """
-        total_attack = self.attack
-        for interf in self.nonpersistent_interf.values():
-            total_attack += interf[0]
-        for interf in self.persistent_interf.values():
-            total_attack += interf[0]
-        return total_attack
+        return self.attack + self.nonpersistent_interf.totals[0]\
+            + self.persistent_interf.totals[0]
 
     def get_total_defense(self):
         """
         Sum up the defense and all defense interference
         """
-        total_defense = self.defense
-        for interf in self.nonpersistent_interf.values():
-            total_defense += interf[1]
-        for interf in self.persistent_interf.values():
-            total_defense += interf[1]
-        return total_defense
+        return self.defense + self.nonpersistent_interf.totals[1]\
+            + self.persistent_interf.totals[1]
 
     def get_total_movement(self):
         """
         Sum up the movement and all movement interferences
         """
-        total_movement = self.movement
-        for interf in self.nonpersistent_interf.values():
-            total_movement += interf[2]
-        for interf in self.persistent_interf.values():
-            total_movement += interf[2]
-        return total_movement
+        return self.movement + self.nonpersistent_interf.totals[2]\
+            + self.persistent_interf.totals[2]
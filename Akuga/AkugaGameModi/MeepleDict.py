@@ -1,22 +1,94 @@
 """
-This module contain the name_constructor dict and other functions
+This module contain the jumon catalog and other functions
 to build up the pickpool and translate the active sets of all users
-to a list of jumon instances
+to a list of jumon instances.
+The catalog is loaded once per process and shared by all matches, a
+refresh replaces it with a new catalog if the jumons in the database
+have changed. Running matches keep the catalog they started with
 """
+from threading import Lock
+from types import MappingProxyType
 from Akuga.AkugaGameModi.Meeple import Jumon
 from Akuga.AkugaGameModi.GlobalDefinitions import USER_DBS_ADDRESS
 
 
-JUMON_NAME_CONSTRUCTOR_DICT = {}
+class JumonCatalog:
+    """
+    An immutable catalog of all jumons a match can create.
+    Every jumon is stored as a template in the form:
+    constructor, (color, attack, defense, movement)
+    so creating a jumon instance only needs its name and its id.
+    version: The version of the jumon catalog of the database server,
+    the catalog has to be reloaded if the version changes
+    """
+    def __init__(self, version, templates):
+        self.version = version
+        self.templates = MappingProxyType(dict(templates))
 
+    def create_jumon(self, jumon_name, _id):
+        """
+        Create an instance of the jumon with the id
+        """
+        constructor, stats = self.templates[jumon_name]
+        return constructor(jumon_name, _id, *stats)
 
-def get_vanilla_jumons_from_dbs(userdbs_communicator):
+    def __contains__(self, jumon_name):
+        return jumon_name in self.templates
+
+    def __iter__(self):
+        return iter(self.templates)
+
+    def __len__(self):
+        return len(self.templates)
+
+
+# The catalog shared by all matches of this process, None until loaded
+JUMON_CATALOG = None
+# Only one thread loads the catalog at a time
+catalog_lock = Lock()
+
+
+def create_vanilla_jumon_templates(jumon_stats):
+    '''
+    Create the templates of vanilla jumons out of a list of jumon stats
+    in the form: name, color, attack, defense, movement
     '''
-    Read all vanilla jumons from the dbs and create a constructor
-    dict out of them. This constructor dict will store preconfigured
-    constructor calls which will be used to create vanilla jumon instances
-    with different ids.
+    return {jumon[0]: (Jumon, tuple(jumon[1:5])) for jumon in jumon_stats}
+
+
+def create_jumon_catalog(version, jumon_stats):
+    '''
+    Create a catalog of all jumons out of the stats of the vanilla
+    jumons in the form: name, color, attack, defense, movement
+    '''
+    templates = create_vanilla_jumon_templates(jumon_stats)
+    # Here all the special jumons have to be added manually
+    return JumonCatalog(version, templates)
+
+
+def get_catalog_version_from_dbs(userdbs_communicator):
     '''
+    Request the version of the jumon catalog of the dbs.
+    If the dbs returns an error it is passed through
+    '''
+    userdbs_communicator.send_packet(['GET_JUMON_CATALOG_VERSION'])
+    response = userdbs_communicator.recv_packet()
+    if response[0] == 'ERROR':
+        return response
+    return response[1][0]
+
+
+def get_jumon_catalog_from_dbs(userdbs_communicator):
+    '''
+    Read the version of the catalog and all vanilla jumons from the dbs
+    and create a catalog out of them. If the dbs returns an error it
+    is passed through
+    '''
+    # Request the version first, if the jumons change meanwhile the
+    # catalog is newer than its version and is just loaded again
+    version = get_catalog_version_from_dbs(userdbs_communicator)
+    if type(version) is list:
+        return version
     # Get the stats of all vanilla jumons
     userdbs_communicator.send_packet(['GET_ALL_VANILLA_JUMON_STATS'])
     response = userdbs_communicator.recv_packet()
@@ -25,35 +97,53 @@ def get_vanilla_jumons_from_dbs(userdbs_communicator):
         return response
     # The response is a list of tuples containing all stats of a jumon in
     # the form: name, color, attack, defense, movement
-    # Now add a preconfigured constructor call under the name of the jumon
-    jumon_dictionary = {}
-    for jumon in response[1:]:
-        # Here a lambda inside a lambda has to be used as the jumon
-        # variable has to be bound, otherwise all lambdaterms would
-        # refer to the same (the last) jumon in the response list
-        jumon_dictionary[jumon[0]] =\
-            (lambda j: lambda _id: Jumon(j[0], _id, j[1], j[2],
-                j[3], j[4]))(jumon)
-    return jumon_dictionary
+    return create_jumon_catalog(version, response[1:])
 
 
-def initialise_jumon_name_constructor_dict(userdbs_communicator):
+def get_jumon_catalog(userdbs_communicator):
     '''
-    Initialise the JUMON_NAME_CONSTRUCTOR_DICT
+    Return the catalog shared by all matches, load it from the dbs if
+    it isnt loaded yet. If the dbs returns an error it is passed through
     '''
-    global JUMON_NAME_CONSTRUCTOR_DICT
-    JUMON_NAME_CONSTRUCTOR_DICT = get_vanilla_jumons_from_dbs(
-        userdbs_communicator)
-    # Here all the special jumons have to be added manually
-    pass
+    catalog = JUMON_CATALOG
+    if catalog is not None:
+        return catalog
+    return refresh_jumon_catalog(userdbs_communicator)
+
+
+def refresh_jumon_catalog(userdbs_communicator, version=None):
+    '''
+    Replace the shared catalog if the version of the catalog of the dbs
+    differs from the one of the shared catalog. If the version is known
+    already it can be passed, otherwise it is requested from the dbs.
+    Returns the shared catalog, if the dbs returns an error it is
+    passed through
+    '''
+    global JUMON_CATALOG
+    with catalog_lock:
+        if JUMON_CATALOG is not None:
+            if version is None:
+                version = get_catalog_version_from_dbs(userdbs_communicator)
+                if type(version) is list:
+                    return version
+            if version == JUMON_CATALOG.version:
+                return JUMON_CATALOG
+        catalog = get_jumon_catalog_from_dbs(userdbs_communicator)
+        if type(catalog) is not JumonCatalog:
+            return catalog
+        JUMON_CATALOG = catalog
+        return catalog
 
 
 if __name__ == '__main__':
     import socket
+    from Akuga.Network import StreamSocketCommunicator
     userdbs_connection = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     userdbs_connection.connect(USER_DBS_ADDRESS)
-    initialise_jumon_name_constructor_dict(userdbs_connection)
-    orgenthor = JUMON_NAME_CONSTRUCTOR_DICT['Orgenthor die Zwillingsbrut'](0)
+    catalog = get_jumon_catalog(
+        StreamSocketCommunicator(userdbs_connection, 512))
+    orgenthor = catalog.create_jumon('Orgenthor die Zwillingsbrut', 0)
+    print(catalog.version)
     print(orgenthor.name)
     print(orgenthor.attack)
     print(orgenthor.defense)
@@ -1,97 +1,68 @@
 import socket
-from json import (loads, dumps, JSONDecodeError)
+import selectors
+import time
+from collections import OrderedDict
+# The packet framing is shared by all servers
+from Akuga.Network import encode_packet
 from Akuga.AkugaGameModi.Position import Position
+from Akuga.AkugaGameModi.Arena import FREE_TILE
+from Akuga.AkugaGameModi.GlobalDefinitions import GAMESTATE_HISTORY
 from Akuga.EventDefinitions import (Event,
                                     SUMMON_JUMON_EVENT,
                                     SELECT_JUMON_TO_MOVE_EVENT,
                                     SELECT_JUMON_TO_SPECIAL_MOVE_EVENT,
                                     PICK_JUMON_EVENT,
                                     PACKET_PARSER_ERROR_EVENT,
-                                    TIMEOUT_EVENT,
-                                    MESSAGE)
+                                    TIMEOUT_EVENT)
 
 
-class SocketClosed(Exception):
-    '''
-    The socket module does not raise an error, if the foreign site
-    closes the socket unexpectatly, the SocketClosed error will be raised
-    to signal this situation
-    '''
-    pass
-
-
-class StreamSocketCommunicator:
-    def __init__(self, connection, nbytes):
-        '''
-        connection: The stream socket to work on
-        nbytes: Max bytes to read once at a time
-        '''
-        self.connection = connection
-        self.nbytes = nbytes
-        self.cached_string = ''
+class PacketSelector:
+    """
+    Waits until at least one of many communicators has a packet to
+    receive, so a match can wait for all of its users at once without
+    using any cpu time
+    """
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
 
-    def receive_line(self):
-        '''
-        Receives a complete line from a stream socket.
-        Therefor the stream of bytes have to be cached and scaned for
-        terminator signs. The newline character in this case
-        '''
-        index = self.cached_string.find('\n')
-        while index < 0:
-            # As long as there is no complete line cached receive bytes
-            # from the wire
-            new_data = self.connection.recv(self.nbytes).decode('utf-8')
-            if not new_data:
-                # If the connection was closed by the foreign host
-                # raise a socket error
-                raise SocketClosed()
-            self.cached_string += new_data
-            # Again look for the newline character
-            index = self.cached_string.find('\n')
-        # Now a complete line is cached so return it and remove it from
-        # the cache
-        complete_line = self.cached_string[:index]
-        self.cached_string = self.cached_string[index + 1:]
-        return complete_line
-
-    def recv_packet(self):
-        """
-        Receive a packet, aka a complete line, from the wire and use json
-        to deserialize it. Only lists are accepted as valid datatypes
+    def select(self, communicators, timeout):
         """
-        json_line = self.receive_line()
-        try:
-            packet = loads(json_line)
-        except JSONDecodeError:
-            self.send_packet(['ERROR', 'Invalid Packet'])
-            return ['ERROR', 'Invalid Packet']
-        if type(packet) is not list:
-            self.send_packet(['ERROR', 'Invalid Packet'])
-            return ['ERROR', 'Invalid Packet']
-        return packet
-
-    def send_packet(self, tokens):
+        Return the communicators which have a packet to receive
+        or an empty list if the timeout has passed.
+        Communicators whose foreign host has closed the connection are
+        left out until they are refreshed
         """
-        Send a python list by serialising it using json
-        """
-        json_dump = dumps(tokens) + '\n'
-        json_dump = json_dump.encode('utf-8')
-        self.connection.send(json_dump)
+        ready = [communicator for communicator in communicators
+            if communicator.has_buffered_packet()]
+        if ready:
+            return ready
+        # The connections of the communicators can change on reconnects
+        # so they are registered anew every time
+        for key in list(self.selector.get_map().values()):
+            self.selector.unregister(key.fileobj)
+        for communicator in communicators:
+            if communicator.peer_closed:
+                continue
+            try:
+                fileno = communicator.fileno()
+            except OSError:
+                continue
+            if fileno < 0 or fileno in self.selector.get_map():
+                continue
+            self.selector.register(fileno, selectors.EVENT_READ,
+                communicator)
+        if not self.selector.get_map():
+            # Nothing to wait for, just let the timeout pass
+            if timeout is not None and timeout > 0:
+                time.sleep(timeout)
+            return []
+        return [key.data for key, mask in self.selector.select(timeout)]
 
     def close(self):
         """
-        Closes the socket the communicator uses and cleares the chache
-        """
-        self.connection.close()
-        self.cached_string = ''
-
-    def refresh(self, new_communicator):
-        """
-        Overwrite the connection the communicator uses
-        but leaves the cache untouched. This will be
-        used if a user reconnects while playing
+        Close the underlying selector
         """
-        self.connection = new_communicator.connection
+        self.selector.close()
 
 
 def callback_recv_packet(communicator, callback, args):
@@ -109,10 +80,31 @@ def callback_recv_packet(communicator, callback, args):
     callback(packet, *args)
 
 
+def broadcast_packet(users, tokens, coalesce_key=None):
+    '''
+    Send a packet made out of tokens to all users. The packet is serialised
+    only once and the same bytes are written to every connection, so
+    adding more recipients, e.g. spectators, only adds the socket writes.
+    If the packet is not sent yet when an other packet with the same
+    coalesce key is sent to a user with an outbound queue, it is dropped.
+
+    Broken connections will be ignored as timeout and reconnects are
+    handeld elsewhere in the code
+    '''
+    data = encode_packet(tokens)
+    for user in users:
+        try:
+            user.communicator.send_bytes(data, coalesce_key)
+        except IOError:
+            # If the connection is broken just do nothing it will be
+            # handeld elsewhere in the code
+            pass
+
+
 def propagate_message(message_event):
     '''
-    Use the send_packet function to send a packet made out of tokens to all
-    users specified in the message_event.
+    Use the broadcast_packet function to send a packet made out of tokens
+    to all users specified in the message_event.
     Therefor the message_event has to provide:
     users: a list of user instances
     players: can be specified instead of the users
@@ -127,14 +119,7 @@ def propagate_message(message_event):
         # If no users are provided check if players are provided
         # and extract the list of users from the player list
         users = list(map(lambda x: x.user, message_event.players))
-    tokens = message_event.tokens
-    for user in users:
-        try:
-            user.communicator.send_packet(tokens)
-        except IOError:
-            # If the connection is broken just do nothing it will be
-            # handeld elsewhere in the code
-            pass
+    broadcast_packet(users, message_event.tokens)
 
 
 def handle_match_connection(tokens, queue, jumons_in_play):
@@ -252,12 +237,14 @@ def handle_match_connection(tokens, queue, jumons_in_play):
         return
 
 
-def send_gamestate_to_client(users, game_state):
+def gamestate_packets(game_state):
     """
-    Send all neccessary data from the server game state to build the client
-    game state. The client game state is an excerpt from the state machiene
-    as some data should be hidden or is not necessary for the match client
+    Build all packets neccessary to build the client game state from the
+    server game state. The client game state is an excerpt from the state
+    machiene as some data should be hidden or is not necessary for the
+    match client
     """
+    packets = []
     # First of all send the pick pool
     pick_pool_data_tokens = ["PICK_POOL_DATA"]
     for jumon in game_state.jumon_pick_pool:
@@ -268,8 +255,7 @@ def send_gamestate_to_client(users, game_state):
         pick_pool_data_tokens.append((jumon.id, jumon.equipment.id
             if jumon.equipment is not None
             else ""))
-    propagate_message(Event(MESSAGE, users=users,
-        tokens=pick_pool_data_tokens))
+    packets.append(pick_pool_data_tokens)
 
     # Now go through all the players and send the jummons per can summon
     # and the jumons per has already summoned.
@@ -290,11 +276,8 @@ def send_gamestate_to_client(users, game_state):
             pld_summoned_jumons.append((jumon.id, jumon.equipment.id
                 if jumon.equipment is not None
                 else ""))
-        # Send the data
-        propagate_message(Event(MESSAGE, users=users,
-            tokens=pld_jumons_to_summon_token))
-        propagate_message(Event(MESSAGE, users=users,
-            tokens=pld_summoned_jumons))
+        packets.append(pld_jumons_to_summon_token)
+        packets.append(pld_summoned_jumons)
 
     # Now go through all tiles of the arena and send the meeple occupying
     # this tile
@@ -302,13 +285,11 @@ def send_gamestate_to_client(users, game_state):
     packet_tokens = [
         "ARENA_DATA",
         (game_state.arena.board_width, game_state.arena.board_height)]
-    # Go through all tiles of the arena and append
-    # the ids of the occupying meeple
-    for y in range(game_state.arena.board_height):
-        for x in range(game_state.arena.board_width):
-            meeple = game_state.arena.get_unit_at(Position(x, y))
-            packet_tokens.append(meeple.id if meeple is not None else "")
-    propagate_message(Event(MESSAGE, users=users, tokens=packet_tokens))
+    # Append the ids of the occupying meeple row by row, they are taken
+    # from the occupancy array of the arena at once
+    packet_tokens += [_id if _id != FREE_TILE else ""
+        for _id in game_state.arena.occupancy.T.ravel().tolist()]
+    packets.append(packet_tokens)
 
     # Now go through all jumons summoned and send the interferences
     # The interferences has to be sent even if there are none to clear
@@ -316,21 +297,194 @@ def send_gamestate_to_client(users, game_state):
     for player in game_state.player_chain.get_players():
         for jumon in player.summoned_jumons:
             # Both interferences are send as a complete dict
-            # They can be parsed using the ast.literal_eval function
-            nonpersistent_interference_tokens = [
+            # They can be parsed using the ast.literal_eval function.
+            # The dicts are copied as the packets are kept to compute
+            # the deltas of later turns, an unchanged interference
+            # reuses its last copy
+            packets.append([
                 'JUMON_NONPERSISTENT_INTERFERENCE',
                 jumon.id,
-                jumon.nonpersistent_interf]
-            persistent_interference_tokens = [
+                jumon.nonpersistent_interf.copy()])
+            packets.append([
                 'JUMON_PERSISTENT_INTERFERENCE',
                 jumon.id,
-                jumon.persistent_interf]
-            # Send the packets
-            propagate_message(Event(MESSAGE, users=users,
-                tokens=nonpersistent_interference_tokens))
-            propagate_message(Event(MESSAGE, users=users,
-                tokens=persistent_interference_tokens))
+                jumon.persistent_interf.copy()])
     # Now send the name of the current player
-    propagate_message(Event(MESSAGE, users=users,
-        tokens=['CURRENT_PLAYER',
-                game_state.player_chain.get_current_player().name]))
+    packets.append(['CURRENT_PLAYER',
+        game_state.player_chain.get_current_player().name])
+    return packets
+
+
+def send_gamestate_to_client(users, game_state):
+    """
+    Send all neccessary data from the server game state to build the client
+    game state. The client game state is an excerpt from the state machiene
+    as some data should be hidden or is not necessary for the match client
+    """
+    for packet_tokens in gamestate_packets(game_state):
+        broadcast_packet(users, packet_tokens)
+
+
+def gamestate_snapshot(packets):
+    """
+    Split the game state packets into a dictionary of the form
+    key: packet, where the key identifies the part of the game state the
+    packet describes. The arena data is split into one packet per tile
+    TILE_DATA $x $y $meeple_id, so a moving jumon only changes two entries
+    """
+    snapshot = {}
+    for packet in packets:
+        if packet[0] == 'ARENA_DATA':
+            width, height = packet[1]
+            snapshot[('ARENA_SIZE',)] = ['ARENA_SIZE', width, height]
+            for y in range(height):
+                for x in range(width):
+                    snapshot[('TILE_DATA', x, y)] = ['TILE_DATA', x, y,
+                        packet[2 + y * width + x]]
+        else:
+            snapshot[gamestate_snapshot_key(packet)] = packet
+    return snapshot
+
+
+def gamestate_snapshot_key(packet):
+    """
+    Returns the key identifying the part of the game state a packet of a
+    snapshot or a delta describes
+    """
+    if packet[0] == 'TILE_DATA':
+        return (packet[0], packet[1], packet[2])
+    if packet[0] in ('ARENA_SIZE', 'PICK_POOL_DATA', 'CURRENT_PLAYER'):
+        return (packet[0],)
+    # Player data and interferences belong to a player or a jumon
+    return (packet[0], packet[1])
+
+
+def apply_gamestate_delta(snapshot, changed, removed):
+    """
+    Returns the snapshot resulting from applying the changed packets and
+    removed keys of a GAMESTATE_DELTA to a snapshot, the client side
+    counterpart of gamestate_delta
+    """
+    new_snapshot = dict(snapshot)
+    for packet in changed:
+        new_snapshot[gamestate_snapshot_key(packet)] = packet
+    for key in removed:
+        new_snapshot.pop(tuple(key), None)
+    return new_snapshot
+
+
+def gamestate_packet_key(packet):
+    """
+    Returns the key identifying the part of the game state a packet of
+    a full snapshot describes
+    """
+    if packet[0] in ('PLAYER_DATA_JUMONS_TO_SUMMON',
+            'PLAYER_DATA_SUMMONED_JUMONS',
+            'JUMON_NONPERSISTENT_INTERFERENCE',
+            'JUMON_PERSISTENT_INTERFERENCE'):
+        return (packet[0], packet[1])
+    return (packet[0],)
+
+
+def gamestate_delta(old_snapshot, new_snapshot):
+    """
+    Returns the list of packets which changed between both snapshots and
+    the list of keys which are not part of the new snapshot anymore
+    """
+    changed = [packet for key, packet in new_snapshot.items()
+        if old_snapshot.get(key) != packet]
+    removed = [list(key) for key in old_snapshot
+        if key not in new_snapshot]
+    return changed, removed
+
+
+class GameStateSync:
+    """
+    Propagates the game state to the users of a match.
+    Every propagated game state gets a sequence number. A user who
+    acknowledged a game state with GAMESTATE_ACK $seq only receives the
+    changes since that game state:
+    GAMESTATE_DELTA $seq $base_seq [changed packets] [removed keys]
+    Users who never acknowledged a game state, whose acknowledged game
+    state is too old or who requested it with REQUEST_GAMESTATE receive a
+    full snapshot, the usual game state packets followed by GAMESTATE_SEQ.
+    """
+    def __init__(self, history_size=GAMESTATE_HISTORY):
+        '''
+        history_size: The amount of game states a delta can be based on
+        '''
+        self.history_size = history_size
+        self.seq = 0
+        # The snapshots of the last game states stored under their seq
+        self.history = OrderedDict()
+        # The packets of the last game state to send full snapshots
+        self.packets = []
+        # The seq of the last game state each user acknowledged
+        self.acked = {}
+
+    def send_full_snapshot(self, users):
+        """
+        Send the last game state as a full snapshot to a list of users.
+        A newer game state will replace the packets of an unsent one
+        """
+        for packet_tokens in self.packets + [['GAMESTATE_SEQ', self.seq]]:
+            broadcast_packet(users, packet_tokens,
+                gamestate_packet_key(packet_tokens))
+
+    def send(self, users, game_state):
+        """
+        Propagate the current game state to all users
+        """
+        self.seq += 1
+        self.packets = gamestate_packets(game_state)
+        snapshot = gamestate_snapshot(self.packets)
+        self.history[self.seq] = snapshot
+        while len(self.history) > self.history_size:
+            self.history.popitem(last=False)
+        # Group the users by the game state they acknowledged, so every
+        # delta is computed and serialised only once
+        recipients = {}
+        full_snapshot_users = []
+        for user in users:
+            base_seq = self.acked.get(user.name)
+            if base_seq not in self.history:
+                full_snapshot_users.append(user)
+            else:
+                recipients.setdefault(base_seq, []).append(user)
+        if full_snapshot_users:
+            self.send_full_snapshot(full_snapshot_users)
+        for base_seq, base_users in recipients.items():
+            changed, removed = gamestate_delta(
+                self.history[base_seq], snapshot)
+            # An unsent delta is replaced by a newer one as the newer one
+            # contains all changes since the acknowledged game state
+            broadcast_packet(base_users, ['GAMESTATE_DELTA', self.seq,
+                base_seq, changed, removed], ('GAMESTATE_DELTA',))
+
+    def reset(self, user):
+        """
+        Forget the acknowledged game state of a user, e.g. if the user
+        disconnected, so per will receive a full snapshot next time
+        """
+        self.acked.pop(user.name, None)
+
+    def handle_packet(self, tokens, user):
+        """
+        Handle the game state related packets of a user.
+        Returns True if the packet was handeld
+        """
+        if tokens[0] == 'GAMESTATE_ACK' and len(tokens) >= 2:
+            """
+            The user has applied the game state with the given seq
+            """
+            if tokens[1] in self.history:
+                self.acked[user.name] = tokens[1]
+            return True
+        if tokens[0] == 'REQUEST_GAMESTATE':
+            """
+            The user lost track of the game state, e.g. after a reconnect
+            """
+            self.reset(user)
+            self.send_full_snapshot([user])
+            return True
+        return False
@@ -1,101 +1,155 @@
+"""
+Finds the shortest path of a jumon over the arena. A path leads over free
+tiles only, the start and the target position may be occupied.
+The arena is flattened into an occupancy grid first, the tile at x, y is
+stored at the index x * height + y, the same order the tiles of the
+arena are stored in. The grid is searched breadth first using a deque,
+every tile is visited at most once and the search ends as soon as the
+target is reached. The same search bounded by the movement of a jumon
+finds all tiles the jumon can reach at once
+"""
+from collections import deque
+from functools import lru_cache
 from Akuga.AkugaGameModi.Position import Position
+from Akuga.AkugaGameModi.Arena import FREE_TILE
 
 
-def pos_in(position, nodes):
+def create_occupancy_grid(arena):
     """
-    Checks if position exists within node_list
+    Create the occupancy grid of an arena, a bytearray storing 1 for
+    every free tile and 0 for every occupied one
     """
-    return next(filter(lambda x: x.position == position, nodes), None)\
-        is not None
+    return bytearray((arena.occupancy == FREE_TILE).tobytes())
 
 
-class PathNode:
+@lru_cache(maxsize=16)
+def get_neighbour_table(width, height):
     """
-    A representation of a node within the path
-    It is defacto a node of a single linked list in which every
-    node know the previous node
-    A <- B
+    Return the indexes of the direct neighbours of every tile of a grid,
+    the table is shared by all searches on grids of the same size
     """
-    def __init__(self, position, predecessor):
-        # The path position stored in the node
-        self.position = position
-        # The previous node
-        self.predecessor = predecessor
-
-    def expand_node(self, tiles, end_pos, frontier, visited, width, height):
-        """
-        Checks all four direct neighbour tiles and add them to the
-        expand list if their are free and not yet in the frontier list
-        """
-        expand_list = []
-        if self.position.x > 0:
-            new_pos = self.position - Position(1, 0)
-            if (not pos_in(new_pos, frontier) and tiles[new_pos.x][new_pos.y])\
-                    or new_pos == end_pos:
-                """
-                If the node is not in the frontier list and free or
-                the target position add it to the expand list which might
-                will be part of the found path
-                """
-                expand_list.append(PathNode(new_pos, self))
-
-        if self.position.x < width - 1:
-            new_pos = self.position + Position(1, 0)
-            if (not pos_in(new_pos, frontier) and tiles[new_pos.x][new_pos.y])\
-                    or new_pos == end_pos:
-                """
-                If the node is not in the frontier list and free or
-                the target position add it to the expand list which might
-                will be part of the found path
-                """
-                expand_list.append(PathNode(new_pos, self))
-
-        if self.position.y > 0:
-            new_pos = self.position - Position(0, 1)
-            if (not pos_in(new_pos, frontier) and tiles[new_pos.x][new_pos.y])\
-                    or new_pos == end_pos:
-                """
-                If the node is not in the frontier list and free or
-                the target position add it to the expand list which might
-                will be part of the found path
-                """
-                expand_list.append(PathNode(new_pos, self))
-
-        if self.position.y < height - 1:
-            new_pos = self.position + Position(0, 1)
-            if (not pos_in(new_pos, frontier) and tiles[new_pos.x][new_pos.y])\
-                    or new_pos == end_pos:
-                """
-                If the node is not in the frontier list and free or
-                the target position add it to the expand list which might
-                will be part of the found path
-                """
-                expand_list.append(PathNode(new_pos, self))
-        return expand_list
-
-
-def backtrace_path(end_node):
+    table = []
+    for x in range(width):
+        for y in range(height):
+            index = x * height + y
+            neighbours = []
+            if x > 0:
+                neighbours.append(index - height)
+            if x < width - 1:
+                neighbours.append(index + height)
+            if y > 0:
+                neighbours.append(index - 1)
+            if y < height - 1:
+                neighbours.append(index + 1)
+            table.append(tuple(neighbours))
+    return tuple(table)
+
+
+def backtrace_path(predecessors, end_index, height):
     """
-    Walkes through the predecessors until it is None, thats the start node
+    Walkes through the predecessors of the end index until it is -1,
+    thats the start index. Returns the path from the start to the end
+    as a list of (x, y) tuples
     """
     path = []
-    current_node = end_node
-    while True:
-        path.append(current_node)
-        current_node = current_node.predecessor
-        if current_node is None:
-            break
+    index = end_index
+    while index != -1:
+        path.append(divmod(index, height))
+        index = predecessors[index]
+    path.reverse()
     return path
 
 
-def find_path(start_position, end_position, arena):
+def find_path_in_grid(grid, width, height, start, end, max_length=None):
+    """
+    Find the shortest path from start to end in an occupancy grid, both
+    are (x, y) tuples. The path is a list of (x, y) tuples including the
+    start and the end, None if there is no path or if it would be longer
+    than max_length steps
+    """
+    start_index = start[0] * height + start[1]
+    end_index = end[0] * height + end[1]
+    if start_index == end_index:
+        return [start]
+    # The visited bitmap, a tile is visited when it is put into the
+    # frontier, so no tile is put there twice
+    visited = bytearray(width * height)
+    visited[start_index] = 1
+    predecessors = [-1] * (width * height)
+    frontier = deque([start_index])
+    neighbour_table = get_neighbour_table(width, height)
+    # Every pass of the outer loop expands all tiles one step further
+    # away from the start
+    length = 0
+    while frontier and (max_length is None or length < max_length):
+        length += 1
+        for i in range(len(frontier)):
+            index = frontier.popleft()
+            for neighbour in neighbour_table[index]:
+                if visited[neighbour]:
+                    continue
+                if neighbour == end_index:
+                    predecessors[neighbour] = index
+                    return backtrace_path(predecessors, end_index, height)
+                visited[neighbour] = 1
+                if grid[neighbour]:
+                    predecessors[neighbour] = index
+                    frontier.append(neighbour)
+    return None
+
+
+def find_reachable_in_grid(grid, width, height, start, max_length):
+    """
+    Find every tile reachable from start with at most max_length steps
+    in an occupancy grid, start is an (x, y) tuple. Occupied tiles can be
+    reached but not crossed. Returns a dict storing the distance of every
+    reachable tile under its (x, y) tuple, the start is not part of it
+    """
+    start_index = start[0] * height + start[1]
+    visited = bytearray(width * height)
+    visited[start_index] = 1
+    reachable = {}
+    frontier = deque([start_index])
+    neighbour_table = get_neighbour_table(width, height)
+    length = 0
+    while frontier and length < max_length:
+        length += 1
+        for i in range(len(frontier)):
+            for neighbour in neighbour_table[frontier.popleft()]:
+                if visited[neighbour]:
+                    continue
+                visited[neighbour] = 1
+                reachable[divmod(neighbour, height)] = length
+                if grid[neighbour]:
+                    frontier.append(neighbour)
+    return reachable
+
+
+def find_reachable_tiles(start_position, arena, max_length):
+    """
+    Find every tile of the arena reachable from the start position with
+    at most max_length steps. Returns a dict storing the distance of
+    every reachable tile under its (x, y) tuple, it is empty if the start
+    position is outside the arena
+    """
+    width = arena.board_width
+    height = arena.board_height
+    if start_position.x < 0 or start_position.x > width - 1 or\
+            start_position.y < 0 or start_position.y > height - 1:
+        return {}
+    return find_reachable_in_grid(create_occupancy_grid(arena), width, height,
+        (start_position.x, start_position.y), max_length)
+
+
+def find_path(start_position, end_position, arena, max_length=None):
+    """
+    Find the shortest path from the start to the end position over the
+    arena. The path is a list of positions including the start and the
+    end position, None if there is no path, if it would be longer than
+    max_length steps or if a position is outside the arena
+    """
     width = arena.board_width
     height = arena.board_height
-    tiles = []
-    # The frontier list will hold the nodes to expand
-    frontier_nodes = [PathNode(start_position, None)]
-    # The visited nodes list will hold the nodes which has been expanded
-    visited_nodes = []
     # If the start or end position is illegal return None
     if start_position.x < 0 or start_position.x > width - 1 or\
             start_position.y < 0 or start_position.y > height - 1:
@@ -103,53 +157,30 @@ def find_path(start_position, end_position, arena):
     if end_position.x < 0 or end_position.x > width - 1 or\
             end_position.y < 0 or end_position.y > height - 1:
         return None
-
-    # Create a boolean map from the arena. True means the tile is free
-    for x in range(0, width):
-        row = []
-        for y in range(0, height):
-            row.append(arena.get_tile_at(Position(x, y)).occupied_by() is None)
-        tiles.append(row)
-
-    while len(frontier_nodes) > 0:
-        """
-        As long as there are nodes within the frontier list there is hope
-        to find a path
-        """
-        # Expand the first node in the frontier list to find new node
-        # which will be added to the frontier list
-        expand_list = frontier_nodes[0].expand_node(tiles, end_position,
-            frontier_nodes, visited_nodes, width, height)
-        # The node has been expanded so add it to the visited list
-        visited_nodes.append(frontier_nodes[0])
-        # Remove the node from the frontier list to avoid looping
-        frontier_nodes.remove(frontier_nodes[0])
-        # Check if one of the visited nodes is the target node
-        potentiel_end_node = next(filter(lambda x: x.position == end_position,
-            visited_nodes), None)
-        # If the target node was found return the backtrace of the path
-        if potentiel_end_node:
-            return backtrace_path(potentiel_end_node)
-        # If the target node was not found yet expand the frontier list
-        frontier_nodes = frontier_nodes + expand_list
-    return None
+    path = find_path_in_grid(create_occupancy_grid(arena), width, height,
+        (start_position.x, start_position.y),
+        (end_position.x, end_position.y), max_length)
+    if path is None:
+        return None
+    return [Position(x, y) for x, y in path]
 
 
 if __name__ == "__main__":
+    from Akuga.AkugaGameModi.Meeple import Jumon
     from Akuga.AkugaGameModi.LastManStanding.ArenaCreator import create_arena
     width = 5
     height = 5
     arena = create_arena(width, height, 0, 0)
     # block a tile
-    arena.place_unit_at("A", Position(0, 0))
-    arena.place_unit_at("A", Position(1, 0))
-    arena.place_unit_at("A", Position(0, 2))
+    arena.place_unit_at(Jumon("A", 0, "red", 0, 0, 0), Position(0, 0))
+    arena.place_unit_at(Jumon("A", 1, "red", 0, 0, 0), Position(1, 0))
+    arena.place_unit_at(Jumon("A", 2, "red", 0, 0, 0), Position(0, 2))
 
-    arena.place_unit_at("A", Position(2, 2))
+    arena.place_unit_at(Jumon("A", 3, "red", 0, 0, 0), Position(2, 2))
 
     path = find_path(Position(4, 4), Position(2, 2), arena)
     if path is None:
         exit(-1)
     print(len(path))
     for p in path:
-        print(str(p.position))
+        print(str(p))
@@ -0,0 +1,72 @@
+"""
+Measures the path finder on boards of 3x3, 16x16 and 64x64 tiles with
+randomly placed obstacles. The paths are searched between random free
+tiles, once including the creation of the occupancy grid of the arena,
+like every move does, and once on a prepared grid:
+
+python -m Akuga.AkugaGameModi.PathFinderBenchmark $obstacle_ratio $queries
+"""
+import sys
+import time
+import random
+from Akuga.AkugaGameModi.Meeple import Jumon
+from Akuga.AkugaGameModi.Position import Position
+from Akuga.AkugaGameModi.LastManStanding.ArenaCreator import create_arena
+from Akuga.AkugaGameModi.PathFinder import (
+    create_occupancy_grid,
+    find_path_in_grid,
+    find_path)
+
+
+BOARD_SIZES = [3, 16, 64]
+
+
+def create_obstacle_arena(size, obstacle_ratio):
+    """
+    Create an arena with a jumon on every tile with the probability of
+    obstacle_ratio. Returns the arena and the list of free positions
+    """
+    arena = create_arena(size, size, 0, 0)
+    free_positions = []
+    for x in range(size):
+        for y in range(size):
+            if random.random() < obstacle_ratio:
+                arena.place_unit_at(Jumon('Obstacle', x * size + y, 'red',
+                    0, 0, 0), Position(x, y))
+            else:
+                free_positions.append(Position(x, y))
+    return arena, free_positions
+
+
+def measure(queries, search):
+    """
+    Run the search for every query and return the mean seconds per
+    search and the amount of paths found
+    """
+    found = 0
+    start = time.perf_counter()
+    for start_position, end_position in queries:
+        if search(start_position, end_position) is not None:
+            found += 1
+    return (time.perf_counter() - start) / len(queries), found
+
+
+if __name__ == '__main__':
+    obstacle_ratio = float(sys.argv[1]) if len(sys.argv) > 1 else 0.2
+    amount = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    random.seed(0)
+    print('%-7s %8s %8s %16s %16s' % ('board', 'queries', 'paths',
+        'find_path us', 'grid only us'))
+    for size in BOARD_SIZES:
+        arena, free_positions = create_obstacle_arena(size, obstacle_ratio)
+        if len(free_positions) < 2:
+            continue
+        queries = [random.sample(free_positions, 2) for i in range(amount)]
+        grid = create_occupancy_grid(arena)
+        with_grid, found = measure(queries,
+            lambda start, end: find_path(start, end, arena))
+        grid_only, found = measure(queries,
+            lambda start, end: find_path_in_grid(grid, size, size,
+                (start.x, start.y), (end.x, end.y)))
+        print('%-7s %8d %8d %16.1f %16.1f' % ('%dx%d' % (size, size),
+            amount, found, 1e6 * with_grid, 1e6 * grid_only))
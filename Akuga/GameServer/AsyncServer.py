@@ -0,0 +1,330 @@
+"""
+An asyncio front end for the game server. All lobby connections are served
+by a single event loop, so idle connections only cost a socket and a
+coroutine instead of a thread and a database connection.
+The lobby commands themselves are executed by a small pool of threads using
+the same handlers as the threaded server.
+"""
+import queue
+import socket
+import asyncio
+import logging
+import threading
+from json import (loads, JSONDecodeError)
+from concurrent.futures import ThreadPoolExecutor
+from Akuga.Network import (SocketClosed, encode_packet)
+from Akuga.GameServer.GlobalDefinitions import (
+    SERVER_ADDRESS,
+    USER_DBS_ADDRESS,
+    USER_DBS_POOL_SIZE,
+    USER_DBS_TIMEOUT,
+    MAX_ACTIVE_CONNECTIONS,
+    ASYNC_EXECUTOR_THREADS,
+    MAX_PACKET_SIZE)
+from Akuga.GameServer.DatabasePool import DatabaseConnectionPool
+from Akuga.GameServer.LobbyCommands import (
+    handle_logged_out_packet,
+    handle_logged_in_packet)
+from Akuga.GameServer.main import (
+    handle_lms_queue,
+    load_jumon_catalog)
+
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncClientCommunicator:
+    """
+    The communicator of a client served by the event loop.
+    Packets are written through the event loop, so send_packet can be
+    used by the command handlers and the match threads alike.
+    While the user is in play the client session forwards every received
+    packet to the communicator, recv_packet mimics a blocking socket with
+    a timeout this way. A match waiting for packets of many users with a
+    selector gets a file descriptor which is readable as long as
+    forwarded packets are available.
+    """
+    def __init__(self, writer, loop):
+        '''
+        writer: The asyncio stream writer of the client connection
+        loop: The event loop serving the client connection
+        '''
+        self.writer = writer
+        self.loop = loop
+        self.timeout = None
+        self.packets = queue.Queue()
+        # A socketpair signaling forwarded packets to a selector,
+        # only created if a match asks for a file descriptor
+        self.wakeup_sockets = None
+        # Set if the client has disconnected, until the connection is
+        # refreshed
+        self.peer_closed = False
+
+    def recv_packet(self):
+        """
+        Receive a packet forwarded by the client session.
+        Raises socket.timeout if no packet arrives in time and
+        SocketClosed if the client has disconnected
+        """
+        try:
+            packet = self.packets.get(timeout=self.timeout)
+        except queue.Empty:
+            raise socket.timeout()
+        return self.check_packet(packet)
+
+    def poll_packet(self):
+        """
+        Return a forwarded packet or None if there is none
+        """
+        wakeup_sockets = self.wakeup_sockets
+        if wakeup_sockets is not None:
+            # Consume the wakeup signals, has_buffered_packet tells if
+            # there are more packets left
+            try:
+                wakeup_sockets[0].recv(4096)
+            except OSError:
+                # No signal left or the socketpair was closed meanwhile
+                pass
+        try:
+            packet = self.packets.get_nowait()
+        except queue.Empty:
+            return None
+        return self.check_packet(packet)
+
+    def check_packet(self, packet):
+        """
+        Raise SocketClosed if the forwarded packet signals a disconnect
+        """
+        if packet is None:
+            self.peer_closed = True
+            # The match doesnt wait for the communicator until it is
+            # refreshed, fileno creates a new socketpair then
+            self.close_wakeup_sockets()
+            raise SocketClosed()
+        return packet
+
+    def has_buffered_packet(self):
+        """
+        Return True if a forwarded packet is available
+        """
+        return not self.packets.empty()
+
+    def fileno(self):
+        """
+        Return a file descriptor which is readable as soon as a packet
+        is forwarded
+        """
+        if self.wakeup_sockets is None:
+            self.wakeup_sockets = socket.socketpair()
+            for wakeup_socket in self.wakeup_sockets:
+                wakeup_socket.setblocking(False)
+        return self.wakeup_sockets[0].fileno()
+
+    def close_wakeup_sockets(self):
+        """
+        Close the socketpair signaling forwarded packets if there is one
+        """
+        wakeup_sockets = self.wakeup_sockets
+        self.wakeup_sockets = None
+        if wakeup_sockets is not None:
+            for wakeup_socket in wakeup_sockets:
+                wakeup_socket.close()
+
+    def forward_packet(self, packet):
+        """
+        Forward a packet received by the client session to recv_packet.
+        None signals that the client has disconnected
+        """
+        self.packets.put(packet)
+        wakeup_sockets = self.wakeup_sockets
+        if wakeup_sockets is not None:
+            try:
+                wakeup_sockets[1].send(b'\0')
+            except OSError:
+                # If the buffer is full the selector is woken up anyway
+                pass
+
+    def send_packet(self, tokens):
+        """
+        Send a python list by serialising it using json
+        """
+        self.send_bytes(encode_packet(tokens))
+
+    def send_bytes(self, data, coalesce_key=None):
+        """
+        Send a packet already encoded by encode_packet.
+        The coalesce key is only used by an OutboundQueue
+        """
+        self.loop.call_soon_threadsafe(self._write, data)
+
+    def _write(self, data):
+        """
+        Write data to the current connection, invoked by the event loop
+        """
+        if not self.writer.is_closing():
+            self.writer.write(data)
+
+    def settimeout(self, timeout):
+        """
+        Set the timeout of recv_packet in seconds
+        """
+        self.timeout = timeout
+
+    def close(self):
+        """
+        Closes the connection the communicator uses and the socketpair
+        signaling forwarded packets
+        """
+        self.loop.call_soon_threadsafe(self.writer.close)
+        self.close_wakeup_sockets()
+
+    def shutdown(self):
+        """
+        Close the connection, the client session will signal the
+        disconnect to recv_packet
+        """
+        self.close()
+
+    def refresh(self, new_communicator):
+        """
+        Overwrite the connection the communicator uses
+        but leaves the forwarded packets untouched. This will be
+        used if a user reconnects while playing
+        """
+        self.writer = new_communicator.writer
+        self.peer_closed = False
+
+
+def call_with_dbs_communicator(handler, dbs_pool, *args):
+    """
+    Invoke a lobby command handler with a communicator using the
+    shared connections to the user database
+    """
+    try:
+        return handler(*args, dbs_communicator=dbs_pool.communicator())
+    except (socket.error, SocketClosed):
+        logger.info("Database connection error")
+        return None
+
+
+async def receive_packet(reader, communicator):
+    """
+    Receive a packet, aka a complete line, from the client and use json
+    to deserialize it. Only lists are accepted as valid datatypes.
+    Returns None if the client has disconnected
+    """
+    try:
+        json_line = await reader.readline()
+    except (ConnectionError, asyncio.LimitOverrunError, ValueError):
+        return None
+    if not json_line:
+        return None
+    try:
+        packet = loads(json_line.decode('utf-8'))
+    except (JSONDecodeError, UnicodeDecodeError):
+        packet = None
+    if type(packet) is not list or len(packet) == 0:
+        communicator.send_packet(['ERROR', 'Invalid Packet'])
+        return ['ERROR', 'Invalid Packet']
+    return packet
+
+
+async def handle_client(reader, writer, executor, lms_queue, active_users,
+        dbs_pool):
+    """
+    Handles the connection of a user. Packets are dispatched to the lobby
+    command handlers as long as the user is not in play and forwarded to
+    the match server otherwise
+    """
+    loop = asyncio.get_running_loop()
+    client_address = writer.get_extra_info('peername')
+    communicator = AsyncClientCommunicator(writer, loop)
+    # The instance of the user: None until a succsefully log in
+    user = None
+    while True:
+        tokens = await receive_packet(reader, communicator)
+        if tokens is None:
+            # This triggers when the user disconects
+            logger.info("Connection closed: " + str(client_address))
+            break
+        if user is None:
+            """
+            If the user is not logged in only logging in and register
+            commands are allowed
+            """
+            user = await loop.run_in_executor(executor,
+                call_with_dbs_communicator, handle_logged_out_packet,
+                dbs_pool, tokens, communicator, client_address,
+                active_users)
+        elif user.in_play is True:
+            """
+            If the user is playing a match the packet belongs to the
+            match server
+            """
+            user.communicator.forward_packet(tokens)
+        else:
+            await loop.run_in_executor(executor,
+                call_with_dbs_communicator, handle_logged_in_packet,
+                dbs_pool, tokens, user, communicator, client_address,
+                lms_queue)
+    if user is not None and user.in_play is True:
+        # The reconnect attempt is handeld in the lobby, just signal
+        # the match server that the client has disconnected
+        if user.communicator.writer is writer:
+            user.communicator.forward_packet(None)
+        # Wait until the match has ended or the user has reconnected
+        while user.in_play is True and user.communicator.writer is writer:
+            await asyncio.sleep(1)
+    if user is None or user.communicator.writer is writer:
+        if user in active_users:
+            # Remove the user from the active users so per can log in again
+            active_users.remove(user)
+        communicator.close_wakeup_sockets()
+        if user is not None:
+            user.communicator.close_wakeup_sockets()
+    writer.close()
+
+
+async def serve(server_address):
+    """
+    Serve the lobby on server_address until the server is cancelled
+    """
+    # The game mode queues
+    lms_queue = queue.Queue()
+    # A list of all users currently logged in
+    active_users = []
+    executor = ThreadPoolExecutor(ASYNC_EXECUTOR_THREADS)
+    # The connections to the user database shared by all sessions
+    dbs_pool = DatabaseConnectionPool(USER_DBS_ADDRESS,
+        USER_DBS_POOL_SIZE, USER_DBS_TIMEOUT)
+    load_jumon_catalog(dbs_pool)
+
+    # Create and start the handle game mode queue threads for each game mode
+    logger.info("Start handle_gamemode_queue threads as daemons")
+    handle_lms_queue_thread = threading.Thread(target=handle_lms_queue,
+        args=(lms_queue, dbs_pool))
+    handle_lms_queue_thread.daemon = True
+    handle_lms_queue_thread.start()
+
+    server = await asyncio.start_server(
+        lambda reader, writer: handle_client(reader, writer,
+            executor, lms_queue, active_users, dbs_pool),
+        server_address[0], server_address[1],
+        backlog=MAX_ACTIVE_CONNECTIONS, limit=MAX_PACKET_SIZE)
+    logger.info("Serving on " + str(server_address))
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        dbs_pool.close()
+
+
+if __name__ == '__main__':
+    # Create a logger
+    logging.basicConfig(filename='Akuga.log', level=logging.INFO)
+    logger.info("Start the asyncio game server")
+    try:
+        asyncio.run(serve(SERVER_ADDRESS))
+    except KeyboardInterrupt:
+        pass
+    logger.info("Terminate programm")
@@ -0,0 +1,218 @@
+"""
+This module contains a pool of persistent, multiplexed connections to the
+user database server. All lobby sessions and matches share the pooled
+connections instead of connecting to the database server on their own.
+Every request is tagged with a request id, so the responses of many
+sessions can be received out of order on the same connection.
+"""
+import socket
+import logging
+import itertools
+from functools import partial
+from threading import (Lock, Thread)
+from collections import deque
+from concurrent.futures import (Future, TimeoutError)
+from Akuga.GameServer.Network import (
+    StreamSocketCommunicator,
+    SocketClosed)
+
+
+# Get the logger
+logger = logging.getLogger('GameServer.DatabasePool')
+
+
+class PooledConnection:
+    """
+    One persistent connection to the database server.
+    A reader thread receives the tagged responses and resolves the future
+    waiting for the request with the same id.
+    """
+    def __init__(self, address):
+        connection = socket.create_connection(address)
+        self.communicator = StreamSocketCommunicator(connection, 4096)
+        self.lock = Lock()
+        self.send_lock = Lock()
+        # The futures of all requests waiting for a response
+        # stored under the request id
+        self.pending = {}
+        self.alive = True
+        reader_thread = Thread(target=self.read_responses)
+        reader_thread.daemon = True
+        reader_thread.start()
+
+    def submit(self, request_id, tokens, future):
+        """
+        Send a request tagged with request_id, its response will be set
+        as the result of future.
+        Returns False if the connection is broken
+        """
+        with self.lock:
+            if not self.alive:
+                return False
+            self.pending[request_id] = future
+        future.add_done_callback(partial(self.forget, request_id))
+        try:
+            with self.send_lock:
+                self.communicator.send_packet(
+                    ['REQUEST', request_id] + list(tokens))
+        except socket.error:
+            self.fail()
+        return True
+
+    def read_responses(self):
+        """
+        Receive responses until the connection breaks
+        """
+        while True:
+            try:
+                packet = self.communicator.recv_packet()
+            except (socket.error, SocketClosed):
+                break
+            if packet[0] != 'RESPONSE' or len(packet) < 3:
+                # Untagged packets dont belong to any request
+                continue
+            with self.lock:
+                future = self.pending.pop(packet[1], None)
+            # A cancelled request has timed out, its response is dropped
+            if future is not None and future.set_running_or_notify_cancel():
+                future.set_result(packet[2:])
+        self.fail()
+
+    def forget(self, request_id, future):
+        """
+        Remove a request from the pending ones if it has been cancelled,
+        the database server may never answer it
+        """
+        if future.cancelled():
+            with self.lock:
+                self.pending.pop(request_id, None)
+
+    def fail(self):
+        """
+        Mark the connection as broken and fail all pending requests
+        """
+        with self.lock:
+            if not self.alive:
+                return
+            self.alive = False
+            pending = self.pending
+            self.pending = {}
+        logger.info("Lost connection to the database server")
+        for future in pending.values():
+            if future.set_running_or_notify_cancel():
+                future.set_exception(
+                    ConnectionResetError('Database connection closed'))
+        self.communicator.close()
+
+
+class DatabaseConnectionPool:
+    """
+    A fixed number of persistent connections to the database server
+    shared by all threads. Requests are distributed round robin, a broken
+    connection is replaced on its next use.
+    """
+    def __init__(self, address, size, timeout=None):
+        '''
+        address: The address of the database server
+        size: The number of persistent connections
+        timeout: Seconds to wait for a response, None waits forever
+        '''
+        self.address = address
+        self.size = size
+        self.timeout = timeout
+        self.lock = Lock()
+        self.connections = [None] * size
+        self.slots = itertools.cycle(range(size))
+        self.request_ids = itertools.count()
+
+    def get_connection(self):
+        """
+        Get the next connection, replace it if it is broken
+        """
+        with self.lock:
+            slot = next(self.slots)
+            connection = self.connections[slot]
+            if connection is None or not connection.alive:
+                connection = PooledConnection(self.address)
+                self.connections[slot] = connection
+            return connection
+
+    def submit(self, tokens):
+        """
+        Send a packet to the database server and return a future which
+        will hold the response packet
+        """
+        future = Future()
+        request_id = next(self.request_ids)
+        while not self.get_connection().submit(request_id, tokens, future):
+            # The connection broke in the meantime, take the next one
+            pass
+        return future
+
+    def request(self, tokens):
+        """
+        Send a packet to the database server and wait for the response
+        """
+        future = self.submit(tokens)
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            # Stop waiting for the response
+            future.cancel()
+            raise socket.timeout('Database request timed out')
+
+    def communicator(self):
+        """
+        Return a communicator using this pool
+        """
+        return PooledDatabaseCommunicator(self)
+
+    def close(self):
+        """
+        Close all connections of the pool
+        """
+        with self.lock:
+            connections = self.connections
+            self.connections = [None] * self.size
+        for connection in connections:
+            if connection is not None:
+                connection.fail()
+
+
+class PooledDatabaseCommunicator:
+    """
+    Provides the interface of a StreamSocketCommunicator on top of a
+    connection pool, so it can be used wherever a database communicator
+    is used. Every packet send is answered by a later recv_packet call in
+    the same order.
+    """
+    def __init__(self, pool):
+        self.pool = pool
+        self.responses = deque()
+
+    def send_packet(self, tokens):
+        """
+        Send a packet using the pool
+        """
+        self.responses.append(self.pool.submit(tokens))
+
+    def recv_packet(self):
+        """
+        Receive the response to the oldest packet send
+        """
+        future = self.responses.popleft()
+        try:
+            return future.result(self.pool.timeout)
+        except TimeoutError:
+            # Stop waiting for the response
+            future.cancel()
+            raise socket.timeout('Database request timed out')
+
+    def close(self):
+        """
+        Forget about unanswered requests, the pooled connections
+        stay open
+        """
+        for future in self.responses:
+            future.cancel()
+        self.responses.clear()
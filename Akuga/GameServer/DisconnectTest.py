@@ -0,0 +1,135 @@
+"""
+Tests that a user who disconnects during a match can log in again once
+the match is over. Two new users enter a lms match, the first one
+disconnects as soon as the match has started while a bot plays for the
+second one. Run it once against the threaded and once against the asyncio
+server:
+
+python -m Akuga.GameServer.DisconnectTest
+
+Both the game server and the database server have to be running and no
+other user may wait for a lms match. The disconnected user is killed
+after timing out MAX_TIMEOUTS times, so the match can take several turns
+of SECONDS_PER_TURN seconds.
+"""
+import os
+import sys
+import time
+import socket
+from Akuga.GameServer.GlobalDefinitions import (
+    SERVER_ADDRESS,
+    USER_DBS_ADDRESS,
+    USER_DBS_TIMEOUT)
+from Akuga.GameServer.Network import StreamSocketCommunicator
+from Akuga.GameServer.DatabasePool import DatabaseConnectionPool
+import Akuga.AkugaGameModi.MeepleDict as MeepleDict
+from Akuga.AkugaGameModi.LastManStanding.Bots import (
+    Bot,
+    RandomPolicy)
+
+# Seconds the disconnected user tries to log in again after the match
+LOG_IN_TIMEOUT = 10
+
+
+def connect():
+    """
+    Return a communicator connected to the game server
+    """
+    connection = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    connection.settimeout(30)
+    connection.connect(SERVER_ADDRESS)
+    return StreamSocketCommunicator(connection, 4096)
+
+
+def request(communicator, tokens):
+    """
+    Send a packet and return the response
+    """
+    communicator.send_packet(tokens)
+    return communicator.recv_packet()
+
+
+def prepare_user(communicator, username, jumon_names):
+    """
+    Register and log in a new user, buy seven of the jumons and use them
+    as the first jumon set. Returns True on success
+    """
+    request(communicator, ['REGISTER_USER', username, 'disconnecttest'])
+    response = request(communicator,
+        ['LOG_IN', username, 'disconnecttest'])
+    if response[0] != 'SUCCESS':
+        print(username + ' cant log in: ' + str(response))
+        return False
+    jumon_set = {}
+    for jumon_name in jumon_names:
+        # Every jumon is allowed three times in a lms set
+        while sum(jumon_set.values()) < 7 and\
+                jumon_set.get(jumon_name, 0) < 3:
+            if request(communicator, ['BUY_JUMON', jumon_name])[0] !=\
+                    'SUCCESS':
+                break
+            jumon_set[jumon_name] = jumon_set.get(jumon_name, 0) + 1
+    response = request(communicator, ['SET_JUMON_SET', 0, jumon_set])
+    if response[0] != 'SUCCESS':
+        print(username + ' cant set the jumon set: ' + str(response))
+        return False
+    return True
+
+
+def log_in_again(username):
+    """
+    Try to log in until LOG_IN_TIMEOUT seconds have passed, the game
+    server releases the user shortly after the match has ended.
+    Returns the last response
+    """
+    deadline = time.time() + LOG_IN_TIMEOUT
+    while True:
+        communicator = connect()
+        # The log in of a user who is logged in already isnt answered
+        communicator.settimeout(1)
+        try:
+            response = request(communicator,
+                ['LOG_IN', username, 'disconnecttest'])
+        except socket.timeout:
+            response = ['ERROR', 'No response']
+        finally:
+            communicator.close()
+        if response[0] == 'SUCCESS' or time.time() > deadline:
+            return response
+        time.sleep(1)
+
+
+if __name__ == '__main__':
+    # Only jumons of the catalog can be created by a match
+    dbs_pool = DatabaseConnectionPool(USER_DBS_ADDRESS, 1, USER_DBS_TIMEOUT)
+    catalog = MeepleDict.get_jumon_catalog(dbs_pool.communicator())
+    dbs_pool.close()
+    if type(catalog) is not MeepleDict.JumonCatalog:
+        print('Cant load the jumon catalog: ' + str(catalog))
+        sys.exit(1)
+
+    usernames = ['disconnecttest_' + str(os.getpid()) + '_' + str(i)
+        for i in range(2)]
+    communicators = [connect() for username in usernames]
+    for communicator, username in zip(communicators, usernames):
+        if not prepare_user(communicator, username, catalog):
+            sys.exit(1)
+        response = request(communicator, ['ENQUEUE_FOR_MATCH', 'lms', 0])
+        if response[0] != 'SUCCESS':
+            print(username + ' cant enqueue: ' + str(response))
+            sys.exit(1)
+
+    # Disconnect as soon as the first packet of the match arrives
+    communicators[0].recv_packet()
+    communicators[0].close()
+    print(usernames[0] + ' disconnected')
+
+    start = time.time()
+    victor = Bot(usernames[1], communicators[1], RandomPolicy()).play()
+    communicators[1].close()
+    print('Match ended after ' + '%.2f' % (time.time() - start)
+        + 's, victor: ' + str(victor))
+
+    response = log_in_again(usernames[0])
+    print(usernames[0] + ' logs in again: ' + str(response))
+    sys.exit(0 if response[0] == 'SUCCESS' else 1)
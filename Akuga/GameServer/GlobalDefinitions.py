@@ -1,7 +1,22 @@
 # Network related definitions
 SERVER_ADDRESS = ('127.0.0.1', 10315)
 USER_DBS_ADDRESS = ('127.0.0.1', 10098)
+# Persistent connections to the user database shared by all sessions
+USER_DBS_POOL_SIZE = 4
+# Seconds to wait for a response of the user database
+USER_DBS_TIMEOUT = 30
 MAX_ACTIVE_CONNECTIONS = 1024
+# Threads of the asyncio server executing lobby commands
+ASYNC_EXECUTOR_THREADS = 16
+# Max length of a packet received by the asyncio server
+MAX_PACKET_SIZE = 1048576
+# Worker processes running the matches of the threaded server,
+# 0 runs every match in a thread of the game server itself
+MATCH_WORKER_PROCESSES = 0
+# Persistent connections of a worker process to the user database
+MATCH_WORKER_DBS_POOL_SIZE = 1
+# Max size of a message on the control channel to a worker process
+MATCH_CONTROL_MESSAGE_SIZE = 65536
 EMAIL_SERVER = 'mail.gmx.net'
 EMAIL_PORT = 587
 EMAIL_ADDRESS = "Akuga@gmx.de"
@@ -0,0 +1,121 @@
+"""
+A small load test for the game server. It opens a lot of idle lobby
+connections and measures the latency of the lobby commands of a few active
+clients meanwhile. Run it once against the threaded and once against the
+asyncio server to compare them:
+
+python -m Akuga.GameServer.LoadTest $idle_connections $active_clients $rounds
+
+Both the game server and the database server have to be running.
+Every active client registers a new user in the database.
+"""
+import os
+import sys
+import time
+import socket
+import resource
+from threading import Thread
+from Akuga.GameServer.GlobalDefinitions import SERVER_ADDRESS
+from Akuga.GameServer.Network import StreamSocketCommunicator
+
+
+def open_idle_connections(amount):
+    """
+    Open up to amount connections to the game server which never send
+    anything. Returns the list of the connected sockets
+    """
+    connections = []
+    for i in range(amount):
+        connection = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        connection.settimeout(5)
+        try:
+            connection.connect(SERVER_ADDRESS)
+        except OSError:
+            connection.close()
+            break
+        connections.append(connection)
+    return connections
+
+
+def timed_request(communicator, tokens, latencies):
+    """
+    Send a packet and wait for the response, the latency is appended to
+    the list of latencies stored under the command token
+    """
+    start = time.perf_counter()
+    communicator.send_packet(tokens)
+    response = communicator.recv_packet()
+    latencies.setdefault(tokens[0], []).append(time.perf_counter() - start)
+    return response
+
+
+def active_client(index, rounds, latencies, errors):
+    """
+    Register and log in a new user and query the lobby commands
+    rounds times
+    """
+    username = 'loadtest_' + str(os.getpid()) + '_' + str(index)
+    connection = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    connection.settimeout(30)
+    try:
+        connection.connect(SERVER_ADDRESS)
+        communicator = StreamSocketCommunicator(connection, 4096)
+        timed_request(communicator,
+            ['REGISTER_USER', username, 'loadtest'], latencies)
+        response = timed_request(communicator,
+            ['LOG_IN', username, 'loadtest'], latencies)
+        if response[0] != 'SUCCESS':
+            errors.append(response)
+            return
+        for i in range(rounds):
+            timed_request(communicator, ['GET_JUMON_NAMES'], latencies)
+            timed_request(communicator, ['GET_JUMON_COLLECTION'], latencies)
+            timed_request(communicator, ['GET_JUMON_SET', 0], latencies)
+    except Exception as e:
+        errors.append(str(e))
+    finally:
+        connection.close()
+
+
+def percentile(values, fraction):
+    """
+    Return the value at fraction of the sorted values
+    """
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+if __name__ == '__main__':
+    idle_amount = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    active_amount = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    rounds = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+
+    # Every connection needs a file descriptor
+    soft_limit, hard_limit = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard_limit, hard_limit))
+
+    start = time.perf_counter()
+    idle_connections = open_idle_connections(idle_amount)
+    print('Idle connections: ' + str(len(idle_connections)) + ' of '
+        + str(idle_amount) + ' in '
+        + '%.2f' % (time.perf_counter() - start) + 's')
+
+    latencies = {}
+    errors = []
+    threads = [Thread(target=active_client,
+        args=(i, rounds, latencies, errors)) for i in range(active_amount)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    print('%-22s %8s %10s %10s %10s' % (
+        'command', 'count', 'mean ms', 'p50 ms', 'p99 ms'))
+    for command, values in sorted(latencies.items()):
+        print('%-22s %8d %10.3f %10.3f %10.3f' % (command, len(values),
+            1000 * sum(values) / len(values),
+            1000 * percentile(values, 0.5),
+            1000 * percentile(values, 0.99)))
+    print('Errors: ' + str(len(errors)))
+    for connection in idle_connections:
+        connection.close()
@@ -0,0 +1,292 @@
+"""
+This module contains the handlers for all lobby commands a client can send
+to the game server. They are shared by the threaded and the asyncio server
+"""
+import logging
+from Akuga.AkugaGameModi.LastManStanding.Match import check_set_for_lms
+from Akuga.User import user_from_database_response
+import Akuga.AkugaGameModi.MeepleDict as MeepleDict
+from Akuga.GameServer.GlobalDefinitions import START_CREDITS
+from Akuga.JumonSet import (
+    is_subset,
+    jumon_set_from_list)
+
+
+# Get the logger
+logger = logging.getLogger('GameServer.LobbyCommands')
+
+
+def handle_logged_out_packet(tokens, communicator, client_address,
+        active_users, dbs_communicator):
+    """
+    Handles a packet of a user who is not logged in.
+    If the user is not logged in only logging in and register
+    commands are allowed.
+    Returns the user instance if the user has logged in or reconnected,
+    None otherwise
+    """
+    if tokens[0] == "REGISTER_USER" and len(tokens) >= 3:
+        """
+        Register the user with pers username and pass hash
+        """
+        username = tokens[1]
+        pass_hash = tokens[2]
+        # Check if the username is free
+        dbs_communicator.send_packet(["CHECK_USERNAME", username])
+        response = dbs_communicator.recv_packet()
+        if response[0] == 'ERROR':
+            # If an error occured propagate it to the client
+            logger.info("Database error: " + response[1])
+            communicator.send_packet(["ERROR", response[1]])
+        elif len(response) > 1:
+            # If data except the status code is send the user
+            # already exists
+            logger.info("User: " + username + " already exists")
+            communicator.send_packet(["ERROR",
+                "User: " + username + " already exists"])
+        else:
+            # If the username is free the user can be registered
+            # Therefor the names of all basic jumons have to be
+            # requested as the user will start with all basic jumons
+            # in pers collection
+            dbs_communicator.send_packet(["GET_BASIC_JUMON_NAMES"])
+            response = dbs_communicator.recv_packet()
+            jumon_collection = jumon_set_from_list(response[1])
+            dbs_communicator.send_packet(["REGISTER_USER",
+                username, pass_hash, START_CREDITS, jumon_collection])
+            response = dbs_communicator.recv_packet()
+            if response[0] == 'ERROR':
+                """
+                If the response is None an error occured, send the
+                error msg to the client
+                """
+                logger.info("Database error: " + response[1])
+                communicator.send_packet(["ERROR", response[1]])
+            else:
+                """
+                If no error occured send success
+                """
+                logger.info("Register user: " + username)
+                communicator.send_packet(["SUCCESS", "registered"])
+    if tokens[0] == "LOG_IN" and len(tokens) >= 3:
+        """
+        Check the credentials of the user
+        """
+        username = tokens[1]
+        pass_hash = tokens[2]
+        dbs_communicator.send_packet(
+            ["CHECK_CREDENTIALS", username, pass_hash])
+        response = dbs_communicator.recv_packet()
+        if response[0] == 'ERROR':
+            # An error occured, pass the error to the client
+            logger.info("Database error: " + response[1])
+            communicator.send_packet(["ERROR", response[1]])
+        if len(response) > 1 and username not in\
+                list(map(lambda x: x.name, active_users)):
+            # If there is a result send except the status code
+            # the credentials are correct.
+            # Also the username doesnt have to occure in the list
+            # of usernames already logged in so users cant log in
+            # multiple times
+            #
+            # Request the whole user structure
+            dbs_communicator.send_packet(
+                ['GET_USER_BY_NAME', username])
+            response = dbs_communicator.recv_packet()
+            if response[0] == 'ERROR':
+                logger.info("Unexpected error occured: " + response[1])
+                communicator.send_packet(["ERROR", response[1]])
+                return None
+            if len(response) < 2:
+                # The user was deleted since the credentials were checked
+                communicator.send_packet(["ERROR", "Unknown user"])
+                return None
+            # Create a user instance from the rows of the response
+            user = user_from_database_response(response[1:],
+                communicator, client_address)
+
+            # Add the user to the active users so per cant
+            # log in a second time
+            active_users.append(user)
+            logger.info("Logging in: " + username)
+            communicator.send_packet(["SUCCESS", "logged_in"])
+            return user
+        elif len(response) > 1:
+            # If there is a result send except the status code
+            # but the user is already logged in this is a reconnect
+            # attempt so just refresh the communicator and the
+            # client address of the reconnected user
+            """
+            If the user is in the active user list check if per is in
+            play. If the user is in play per disconnected and this
+            is pers reconnection attempt, so just set the user
+            instance to the already stored user instance
+            """
+            # Get the user instance of the given name
+            user_index = list(map(lambda x: x.name, active_users)).\
+                index(username)
+            tmp_user = active_users[user_index]
+            if tmp_user.in_play is True:
+                # This is a reconnect atttempt so refresh the
+                # communicator and the client address of the user
+                # instance
+                tmp_user.communicator.close()
+                tmp_user.communicator.refresh(communicator)
+                tmp_user.client_address = client_address
+                logger.info("Logging in: " + username)
+                communicator.send_packet(["SUCCESS", "logged_in"])
+                return tmp_user
+    return None
+
+
+def handle_logged_in_packet(tokens, user, communicator, client_address,
+        lms_queue, dbs_communicator):
+    """
+    Handles a packet of a user who is logged in an not playing a match
+    """
+    if tokens[0] == 'ENQUEUE_FOR_MATCH' and len(tokens) >= 3:
+        """
+        Enqueue the user in the queue for the specified game mode
+        """
+        try:
+            active_set_index = int(tokens[2])
+            if active_set_index < 0 or active_set_index > 2:
+                raise ValueError
+        except ValueError:
+            communicator.send_packet(
+                ['ERROR', 'One of the parameters where malformed'])
+            logger.info('One of the parameters where malformed')
+            logger.info('Received from: ' + str(client_address))
+            return
+        # At this point int the code it is proofen that the
+        # active set index is valid so set the users active set
+        user.active_set = user.sets[active_set_index]
+        if tokens[1] == 'lms':
+            logger.info("Enqueue " + user.name + "for lms")
+            if not check_set_for_lms(user.active_set):
+                communicator.send_packet(['ERROR', 'Illegal set'])
+                return
+            # At this point in the code the set is proofed to be valid
+            lms_queue.put(user)
+            communicator.send_packet(["SUCCESS", "enqueued", "lms"])
+        else:
+            logger.info("Invalid game mode: " + tokens[1])
+            communicator.send_packet(["ERROR", "Invalid game mode: "
+                + tokens[1]])
+    if tokens[0] == "GET_JUMON_NAMES" and len(tokens) >= 1:
+        """
+        Query the database for all jumons and forward the result
+        """
+        dbs_communicator.send_packet(["GET_JUMON_NAMES"])
+        response = dbs_communicator.recv_packet()
+        if response[0] == 'ERROR':
+            communicator.send_packet(['ERROR', response[1]])
+            logger.info("An unexpected error occured: " + response[1])
+            return
+        communicator.send_packet(['SUCCESS', response[1]])
+    if tokens[0] == "GET_JUMON_COLLECTION" and len(tokens) >= 1:
+        """
+        Convert the collection of the user into a ',' seperated
+        string and send it to the client
+        """
+        communicator.send_packet(['SUCCESS', user.collection])
+    if tokens[0] == "GET_JUMON_SET" and len(tokens) >= 1:
+        """
+        Convert the requestes jumon set of the user into a ','
+        seperated string and send it to the client
+        """
+        try:
+            index = int(tokens[1])
+            if index < 0 or index > 2:
+                raise ValueError
+        except (ValueError, IndexError):
+            logger.info("One of the parameter where malformed")
+            logger.info("Received from: " + str(client_address))
+            communicator.send_packet(
+                ['ERROR', 'One of the paramter where malformed'])
+            return
+        communicator.send_packet(['SUCCESS', user.sets[index]])
+    if tokens[0] == "SET_JUMON_SET" and len(tokens) >= 2:
+        """
+        Receive a jumon set and its index. Update the specified set
+        if all jumons in the set are part of the users collection
+        """
+        try:
+            index = int(tokens[1])
+            if index < 0 or index > 2:
+                raise ValueError
+            # Convert the string into a list of jumon names
+            jumon_set = tokens[2]
+        except (ValueError, IndexError):
+            logger.info("One of the parameter where malformed")
+            logger.info("Received from: " + str(client_address))
+            communicator.send_packet(
+                ['ERROR', 'One of the parameters where malformed'])
+            return
+        # Check if all jumons in the set are part of the collection
+        if is_subset(jumon_set, user.collection) is False:
+            logger.info('Invalid Set')
+            logger.info('Received from: ' + str(client_address))
+            communicator.send_packet(['ERROR', 'Invalid Set'])
+            return
+        # Set the jumon set
+        user.sets[index] = jumon_set
+        # And update only this set in the database, so credits or a
+        # collection changed by an other game server are not overwritten
+        dbs_communicator.send_packet(['SET_JUMON_SET', user.name, index,
+            jumon_set])
+        response = dbs_communicator.recv_packet()
+        if response[0] == 'ERROR':
+            logger.info('Unexpected error: ' + response[1])
+            communicator.send_packet(['ERROR', response[1]])
+            return
+        communicator.send_packet(['SUCCESS', 'Set Jumonset'])
+    if tokens[0] == 'REFRESH_JUMON_CATALOG' and len(tokens) >= 1:
+        """
+        Reload the jumon catalog shared by all matches if the jumons
+        in the database have changed. Matches already running keep
+        their catalog
+        """
+        catalog = MeepleDict.refresh_jumon_catalog(dbs_communicator)
+        if type(catalog) is not MeepleDict.JumonCatalog:
+            logger.info('Cant refresh the jumon catalog: ' + str(catalog))
+            communicator.send_packet(['ERROR', 'Cant refresh the catalog'])
+            return
+        communicator.send_packet(['SUCCESS', 'Refreshed jumon catalog',
+            catalog.version])
+    if tokens[0] == 'BUY_JUMON' and len(tokens) >= 2:
+        """
+        If the jumon exists and the user has enough money decrement the
+        credits of the user by the jumons price and add the jumon to the
+        collection of the user. The database server does both in one
+        transaction and returns the new credits and the amount of the
+        jumon the user owns
+        """
+        dbs_communicator.send_packet(['PURCHASE_JUMON', user.name,
+            tokens[1]])
+        response = dbs_communicator.recv_packet()
+        if response[0] == 'ERROR':
+            logger.info("An error occured buying the jumon: " + response[1])
+            logger.info("Received from: " + str(client_address))
+            communicator.send_packet(['ERROR', response[1]])
+            return
+        if len(response) < 2:
+            # The user doesnt exist in the database
+            communicator.send_packet(['ERROR', 'Unknown user'])
+            return
+        credits, jumon_price, bought, amount = response[1]
+        if jumon_price is None:
+            # No jumon was found, state this clearly in the error message
+            communicator.send_packet(['ERROR', 'Invalid jumonname'])
+            return
+        if not bought:
+            """
+            The user cant affort to buy the jumon
+            """
+            communicator.send_packet(['ERROR', 'To expansive'])
+            return
+        # Take over the credits and the amount of the jumon of the
+        # database, an other game server could have changed them meanwhile
+        user.credits = credits
+        user.collection[tokens[1]] = amount
+        communicator.send_packet(['SUCCESS', 'Bought jumon'])
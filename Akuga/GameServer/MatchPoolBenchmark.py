@@ -0,0 +1,177 @@
+"""
+Measures the latency of a lobby command while many bot matches are
+running, once with the matches running in threads of the game server and
+once in the worker processes of a MatchProcessPool. The lobby client and
+the bots run in processes of their own, so only the game server process
+differs between both runs. Needs a running user database server:
+
+python -m Akuga.GameServer.MatchPoolBenchmark $matches $workers
+"""
+import os
+import sys
+import time
+import socket
+import resource
+import multiprocessing
+from threading import Thread
+from Akuga.User import User
+from Akuga.GameServer.Network import (StreamSocketCommunicator, SocketClosed)
+from Akuga.GameServer.DatabasePool import DatabaseConnectionPool
+from Akuga.GameServer.MatchProcessPool import MatchProcessPool
+from Akuga.GameServer.LobbyCommands import handle_logged_in_packet
+from Akuga.GameServer.GlobalDefinitions import USER_DBS_ADDRESS
+from Akuga.AkugaGameModi.LastManStanding.Match import match_server
+from Akuga.AkugaGameModi.LastManStanding.Bots import (Bot, RandomPolicy)
+
+
+# The set every bot plays with
+BENCHMARK_SET = {'Blauta': 1, 'Plodher': 1}
+# Seconds the lobby latency is measured without any match
+IDLE_SECONDS = 2
+
+
+def serve_lobby(communicator, user):
+    """
+    Answer the lobby commands of the lobby client like the game server
+    does for a logged in user
+    """
+    while True:
+        try:
+            tokens = communicator.recv_packet()
+        except (OSError, SocketClosed):
+            return
+        handle_logged_in_packet(tokens, user, communicator, None, None,
+            None)
+
+
+def probe_lobby(connection, stop_event, results):
+    """
+    Query the collection of the user until the stop event is set and
+    send the latencies back
+    """
+    communicator = StreamSocketCommunicator(connection, 4096)
+    latencies = []
+    while not stop_event.is_set():
+        start = time.perf_counter()
+        communicator.send_packet(['GET_JUMON_COLLECTION'])
+        communicator.recv_packet()
+        latencies.append(time.perf_counter() - start)
+        time.sleep(0.001)
+    results.put(latencies)
+
+
+def play_bots(players):
+    """
+    Let a bot play for every player, players is a list of name,
+    connection tuples
+    """
+    bots = [Bot(name, StreamSocketCommunicator(connection, 4096),
+        RandomPolicy()) for name, connection in players]
+    threads = [Thread(target=bot.play) for bot in bots]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def create_matches(amount):
+    """
+    Create the users of amount matches connected to the bots with
+    socketpairs. Returns the list of user lists and the bot ends
+    """
+    matches = []
+    players = []
+    for i in range(amount):
+        users = []
+        for suffix in ('a', 'b'):
+            name = 'benchmark' + str(i) + '_' + suffix
+            server_side, client_side = socket.socketpair()
+            user = User(name, '', 0, [], dict(BENCHMARK_SET), {}, {},
+                StreamSocketCommunicator(server_side, 1024), None)
+            user.active_set = user.sets[0]
+            user.in_play = True
+            users.append(user)
+            players.append((name, client_side))
+        matches.append(users)
+    return matches, players
+
+
+def run(mode, amount, context, lobby_connection, dbs_pool, match_pool):
+    """
+    Run amount matches in the given mode while the lobby latency is
+    measured. Returns the elapsed seconds and the latencies
+    """
+    stop_event = context.Event()
+    results = context.Queue()
+    prober = context.Process(target=probe_lobby,
+        args=(lobby_connection, stop_event, results))
+    prober.start()
+    start = time.perf_counter()
+    if mode == 'idle':
+        time.sleep(IDLE_SECONDS)
+    else:
+        matches, players = create_matches(amount)
+        bots = context.Process(target=play_bots, args=(players,))
+        bots.start()
+        for name, connection in players:
+            connection.close()
+        for users in matches:
+            if mode == 'threads':
+                Thread(target=match_server, args=(users,
+                    {'record_results': False}, dbs_pool)).start()
+            else:
+                match_pool.start_match(users, {'record_results': False})
+        bots.join()
+        # Wait until all users are released again
+        while any(user.in_play for users in matches for user in users):
+            time.sleep(0.01)
+        for users in matches:
+            for user in users:
+                user.communicator.close()
+    elapsed = time.perf_counter() - start
+    stop_event.set()
+    latencies = sorted(results.get())
+    prober.join()
+    return elapsed, latencies
+
+
+if __name__ == '__main__':
+    amount = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else\
+        max(1, os.cpu_count() - 1)
+    # Every match needs four sockets
+    soft_limit, hard_limit = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard_limit, hard_limit))
+    # The states print every step of the matches, also in the workers
+    stdout_fd = os.dup(1)
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+
+    context = multiprocessing.get_context('spawn')
+    dbs_pool = DatabaseConnectionPool(USER_DBS_ADDRESS, 4)
+    match_pool = MatchProcessPool(workers, dbs_pool, USER_DBS_ADDRESS)
+    lobby_user = User('lobby', '', 0, ['Jumon' + str(i) for i in range(100)],
+        {}, {}, {}, None, None)
+    rows = []
+    for mode in ['idle', 'threads', 'processes']:
+        server_side, client_side = socket.socketpair()
+        lobby_thread = Thread(target=serve_lobby,
+            args=(StreamSocketCommunicator(server_side, 1024), lobby_user))
+        lobby_thread.daemon = True
+        lobby_thread.start()
+        elapsed, latencies = run(mode, amount, context, client_side,
+            dbs_pool, match_pool)
+        client_side.close()
+        rows.append((mode, elapsed, latencies))
+    match_pool.close()
+    dbs_pool.close()
+
+    os.dup2(stdout_fd, 1)
+    print('%d matches, %d worker processes' % (amount, workers))
+    print('%-10s %10s %10s %10s %10s' % ('matches', 'seconds', 'requests',
+        'p50 ms', 'p99 ms'))
+    for mode, elapsed, latencies in rows:
+        print('%-10s %10.2f %10d %10.3f %10.3f' % (mode, elapsed,
+            len(latencies), 1000 * latencies[len(latencies) // 2],
+            1000 * latencies[min(len(latencies) - 1,
+                int(len(latencies) * 0.99))]))
@@ -0,0 +1,362 @@
+"""
+This module runs the matches in a pool of worker processes, so the game
+logic of the matches doesnt compete with the lobby for one GIL.
+The sockets of the players are handed over to a worker process using
+SCM_RIGHTS over a unix socket, the control channel of the worker, together
+with the bytes the lobby has received from them already.
+A worker runs every match in a thread of its own and sends the result
+back over the control channel. The game server records the result in the
+user database and releases the players.
+Only users of the threaded game server have a socket which can be handed
+over, the asyncio server runs its matches in threads.
+"""
+import socket
+import logging
+import itertools
+import multiprocessing
+from json import (loads, dumps)
+from base64 import (b64encode, b64decode)
+from threading import (Lock, Thread)
+from Akuga.User import User
+import Akuga.AkugaGameModi.MeepleDict as MeepleDict
+from Akuga.GameServer.Network import StreamSocketCommunicator
+from Akuga.GameServer.DatabasePool import DatabaseConnectionPool
+from Akuga.GameServer.GlobalDefinitions import (
+    USER_DBS_TIMEOUT,
+    MATCH_WORKER_DBS_POOL_SIZE,
+    MATCH_CONTROL_MESSAGE_SIZE)
+from Akuga.AkugaGameModi.LastManStanding.Match import (
+    match_server,
+    record_match_result)
+
+
+# Get the logger
+logger = logging.getLogger('GameServer.MatchProcessPool')
+# The max amount of sockets handed over with one message
+MAX_HANDED_OVER_SOCKETS = 16
+
+
+def send_message(control, tokens, connections=[]):
+    """
+    Send a json serialised message over a control channel, the file
+    descriptors of the connections are handed over with it.
+    Raises a ValueError if the message is too long to be received
+    """
+    data = dumps(tokens).encode('utf-8')
+    if len(data) > MATCH_CONTROL_MESSAGE_SIZE:
+        raise ValueError('Control message too long')
+    socket.send_fds(control, [data],
+        [connection.fileno() for connection in connections])
+
+
+def receive_message(control):
+    """
+    Receive a message and the sockets handed over with it.
+    Returns None, [] if the control channel is closed
+    """
+    data, fds, _, _ = socket.recv_fds(control, MATCH_CONTROL_MESSAGE_SIZE,
+        MAX_HANDED_OVER_SOCKETS)
+    connections = [socket.socket(fileno=fd) for fd in fds]
+    if not data:
+        return None, connections
+    return loads(data.decode('utf-8')), connections
+
+
+class HandedOffCommunicator:
+    """
+    The communicator of a user while the socket is handed over to a
+    worker process. The game server doesnt use it during the match, but a
+    reconnect has to be forwarded to the worker.
+    All other attributes are the ones of the wrapped communicator.
+    """
+    def __init__(self, communicator, worker, match_id, user_name):
+        '''
+        communicator: The communicator of the game server
+        worker: The worker running the match
+        match_id: The id of the match
+        user_name: The name of the user the communicator belongs to
+        '''
+        self.communicator = communicator
+        self.worker = worker
+        self.match_id = match_id
+        self.user_name = user_name
+
+    def __getattr__(self, name):
+        return getattr(self.communicator, name)
+
+    def refresh(self, new_communicator):
+        """
+        Overwrite the connection of the game server and hand the new
+        connection over to the worker as well
+        """
+        self.communicator.refresh(new_communicator)
+        self.worker.send(['RECONNECT', self.match_id, self.user_name],
+            [new_communicator.connection])
+
+
+class MatchWorker:
+    """
+    The game server side of a worker process
+    """
+    def __init__(self, pool, context, dbs_address):
+        '''
+        pool: The pool the worker belongs to
+        context: The multiprocessing context to start the process with
+        dbs_address: The address of the user database server
+        '''
+        self.pool = pool
+        self.control, worker_control = socket.socketpair(
+            socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        self.process = context.Process(target=run_match_worker,
+            args=(worker_control, dbs_address))
+        self.process.daemon = True
+        self.process.start()
+        worker_control.close()
+        self.send_lock = Lock()
+        # The users of all running matches stored under the match id
+        self.matches = {}
+        self.reader_thread = Thread(target=self.read_messages)
+        self.reader_thread.daemon = True
+        self.reader_thread.start()
+
+    def send(self, tokens, connections=[]):
+        """
+        Send a message to the worker process
+        """
+        with self.send_lock:
+            send_message(self.control, tokens, connections)
+
+    def read_messages(self):
+        """
+        Receive the results of the matches until the worker exits
+        """
+        while True:
+            try:
+                message, _ = receive_message(self.control)
+            except (OSError, ValueError):
+                break
+            if message is None:
+                break
+            if message[0] == 'MATCH_END' and len(message) >= 4:
+                self.pool.finish_match(self, message[1], message[2],
+                    [b64decode(data) for data in message[3]])
+        self.pool.handle_worker_exit(self)
+
+
+class MatchProcessPool:
+    """
+    A fixed number of worker processes running the matches.
+    A new match is started by the worker running the fewest matches,
+    a crashed worker is replaced.
+    """
+    def __init__(self, size, dbs_pool, dbs_address):
+        '''
+        size: The number of worker processes
+        dbs_pool: The connections of the game server to the user database,
+        used to record the results
+        dbs_address: The address of the user database server the workers
+        connect to
+        '''
+        self.dbs_pool = dbs_pool
+        self.dbs_address = dbs_address
+        # Spawn the workers, forking a process with many threads
+        # could copy locks held by other threads
+        self.context = multiprocessing.get_context('spawn')
+        self.lock = Lock()
+        self.match_ids = itertools.count()
+        # The options of all running matches stored under the match id
+        self.options = {}
+        self.workers = [MatchWorker(self, self.context, dbs_address)
+            for i in range(size)]
+
+    def start_match(self, users, options={}):
+        """
+        Hand the sockets of the users over to a worker process which runs
+        the match. The users have to be in play already
+        """
+        # The bytes the lobby received but didnt process are passed on
+        # to the worker. Wait for the lobby to finish a receive, it wont
+        # start another one as the users are in play
+        buffered = []
+        for user in users:
+            with user.communicator.receive_lock:
+                buffered.append(user.communicator.take_buffered_bytes())
+        with self.lock:
+            match_id = next(self.match_ids)
+            worker = min(self.workers, key=lambda w: len(w.matches))
+            worker.matches[match_id] = users
+            self.options[match_id] = options
+            connections = [user.communicator.connection for user in users]
+            for user in users:
+                user.communicator = HandedOffCommunicator(user.communicator,
+                    worker, match_id, user.name)
+        logger.info('Start match ' + str(match_id) + ' in worker '
+            + str(worker.process.pid))
+        # The worker reloads its jumon catalog if the one of the game
+        # server has another version
+        catalog = MeepleDict.JUMON_CATALOG
+        catalog_version = catalog.version if catalog is not None else None
+        try:
+            worker.send(['START_MATCH', match_id,
+                [[user.name, user.active_set, b64encode(data).decode('ascii')]
+                    for user, data in zip(users, buffered)],
+                options, catalog_version], connections)
+        except (OSError, ValueError):
+            logger.info('Cant hand the match over to the worker')
+            # The lobby processes the buffered bytes again
+            for user, data in zip(users, buffered):
+                user.communicator.feed_bytes(data)
+            self.finish_match(worker, match_id, -1)
+
+    def finish_match(self, worker, match_id, victor_name, buffered=None):
+        """
+        Record the result of a match and release the users.
+        buffered are the bytes the worker has received from the users
+        but not processed, the lobby processes them
+        """
+        with self.lock:
+            users = worker.matches.pop(match_id, None)
+            options = self.options.pop(match_id, {})
+        if users is None:
+            return
+        if victor_name is not None and victor_name != -1 and\
+                options.get('record_results', True):
+            try:
+                record_match_result(self.dbs_pool.communicator(), users,
+                    victor_name)
+            except (socket.error, TimeoutError):
+                logger.info('Cant record the result of match '
+                    + str(match_id))
+        for index, user in enumerate(users):
+            user.communicator = user.communicator.communicator
+            if buffered is not None and index < len(buffered):
+                user.communicator.feed_bytes(buffered[index])
+            # The worker made the shared socket non blocking, the
+            # game server receives in blocking mode
+            try:
+                user.communicator.settimeout(None)
+            except OSError:
+                pass
+            user.in_play = False
+
+    def handle_worker_exit(self, worker):
+        """
+        Release the users of all matches of a crashed worker and replace it
+        """
+        for match_id in list(worker.matches):
+            self.finish_match(worker, match_id, -1)
+        with self.lock:
+            if worker not in self.workers:
+                return
+            logger.info('Worker ' + str(worker.process.pid) + ' exited')
+            self.workers[self.workers.index(worker)] = MatchWorker(self,
+                self.context, self.dbs_address)
+
+    def close(self):
+        """
+        Stop all worker processes, running matches are aborted
+        """
+        with self.lock:
+            workers = self.workers
+            self.workers = []
+        for worker in workers:
+            # Shut the control channel down first, the blocked reader
+            # thread would keep it open otherwise
+            try:
+                worker.control.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            worker.control.close()
+            worker.process.join()
+
+
+def run_worker_match(control, send_lock, matches, match_id, users, options,
+        catalog_version, dbs_pool):
+    """
+    Run a match in the worker process and report the result
+    """
+    try:
+        if catalog_version is not None:
+            MeepleDict.refresh_jumon_catalog(dbs_pool.communicator(),
+                catalog_version)
+        victor_name = match_server(users, dict(options, record_results=False),
+            dbs_pool)
+    except Exception:
+        logger.exception('Match ' + str(match_id) + ' crashed')
+        victor_name = -1
+    # The game server records the result and releases the users, the
+    # bytes received after the match are processed by the lobby
+    buffered = [b64encode(user.communicator.take_buffered_bytes()).decode(
+        'ascii') for user in users]
+    if len(dumps(buffered)) > MATCH_CONTROL_MESSAGE_SIZE // 2:
+        buffered = []
+    with send_lock:
+        matches.pop(match_id, None)
+        try:
+            send_message(control, ['MATCH_END', match_id, victor_name,
+                buffered])
+        except OSError:
+            pass
+    for user in users:
+        user.communicator.close()
+
+
+def run_match_worker(control, dbs_address):
+    """
+    The main function of a worker process, start the matches handed over
+    by the game server until the control channel is closed
+    """
+    dbs_pool = DatabaseConnectionPool(dbs_address,
+        MATCH_WORKER_DBS_POOL_SIZE, USER_DBS_TIMEOUT)
+    send_lock = Lock()
+    # The users of all running matches stored under the match id
+    matches = {}
+    while True:
+        try:
+            message, connections = receive_message(control)
+        except OSError:
+            break
+        if message is None:
+            break
+        if message[0] == 'START_MATCH':
+            """
+            Start a match with the handed over sockets
+            START_MATCH $match_id [[$name, $active_set, $buffered], ...]
+                $options $catalog_version
+            The buffered bytes the lobby has received already are base64
+            encoded
+            """
+            _, match_id, players, options, catalog_version = message
+            users = []
+            for (name, active_set, buffered), connection in zip(players,
+                    connections):
+                communicator = StreamSocketCommunicator(connection, 1024)
+                communicator.feed_bytes(b64decode(buffered))
+                user = User(name, '', 0, [], active_set, {}, {},
+                    communicator, None)
+                user.active_set = active_set
+                users.append(user)
+            with send_lock:
+                matches[match_id] = users
+            match_thread = Thread(target=run_worker_match,
+                args=(control, send_lock, matches, match_id, users,
+                    options, catalog_version, dbs_pool))
+            match_thread.daemon = True
+            match_thread.start()
+        elif message[0] == 'RECONNECT':
+            """
+            A user has reconnected, replace the handed over socket
+            RECONNECT $match_id $name
+            """
+            with send_lock:
+                users = matches.get(message[1], [])
+            users = [user for user in users if user.name == message[2]]
+            if not users or not connections:
+                for connection in connections:
+                    connection.close()
+                continue
+            old_connection = users[0].communicator.connection
+            users[0].communicator.refresh(
+                StreamSocketCommunicator(connections[0], 1024))
+            old_connection.close()
+    dbs_pool.close()
@@ -0,0 +1,387 @@
+"""
+This module contains the line based packet framing shared by the game
+server, the database server and the game modi.
+Every packet is a json serialised list terminated by a newline character.
+"""
+import socket
+import logging
+from threading import (Lock, Condition, Thread)
+from collections import deque
+from json import (loads, dumps, JSONDecodeError)
+
+
+# Get the logger
+logger = logging.getLogger('Akuga.Network')
+
+
+class SocketClosed(Exception):
+    '''
+    The socket module does not raise an error, if the foreign site
+    closes the socket unexpectatly, the SocketClosed error will be raised
+    to signal this situation
+    '''
+    pass
+
+
+def encode_packet(tokens):
+    """
+    Serialise a python list using json into the bytes send on the wire.
+    A packet broadcasted to many users only has to be encoded once
+    """
+    return (dumps(tokens) + '\n').encode('utf-8')
+
+
+class StreamSocketCommunicator:
+    def __init__(self, connection, nbytes):
+        '''
+        connection: The stream socket to work on
+        nbytes: Max bytes to read once at a time
+        '''
+        self.connection = connection
+        self.nbytes = nbytes
+        # All complete lines received but not yet returned, decoded
+        # unless they arent valid utf-8
+        self.lines = deque()
+        # The bytes of the incomplete line following the complete ones,
+        # it never contains a newline character
+        self.cache = bytearray()
+        # Different threads can send on the same connection
+        self.send_lock = Lock()
+        # Held by the lobby while it receives, so the connection cant be
+        # handed over to a match in the middle of a receive
+        self.receive_lock = Lock()
+        # Set if the foreign host has closed the connection, until the
+        # connection is refreshed
+        self.peer_closed = False
+
+    def split_lines(self, data):
+        """
+        Frame all lines completed by data, so all packets received with
+        one system call are framed and decoded at once. Only the
+        incomplete line at the end of data is cached
+        """
+        index = data.rfind(b'\n')
+        if index < 0:
+            # Only a part of a line, every byte is scanned and copied once
+            # even if a large packet arrives in many chunks
+            self.cache += data
+            return
+        if self.cache:
+            # The first line is the end of the cached one
+            self.cache += data[:index]
+            complete = self.cache
+            self.cache = bytearray(data[index + 1:])
+        else:
+            complete = data[:index]
+            self.cache += data[index + 1:]
+        try:
+            self.lines.extend(complete.decode('utf-8').split('\n'))
+        except UnicodeDecodeError:
+            # Only the invalid lines are kept as bytes
+            for line in bytes(complete).split(b'\n'):
+                try:
+                    self.lines.append(line.decode('utf-8'))
+                except UnicodeDecodeError:
+                    self.lines.append(line)
+
+    def receive_line(self):
+        '''
+        Receives a complete line from a stream socket.
+        Therefor the stream of bytes have to be cached and scaned for
+        terminator signs. The newline character in this case
+        '''
+        while not self.lines:
+            # As long as there is no complete line cached receive bytes
+            # from the wire
+            self.receive_chunk()
+        line = self.lines.popleft()
+        return line if type(line) is str else line.decode('utf-8')
+
+    def receive_chunk(self):
+        '''
+        Receive the available bytes with a single system call and frame
+        all lines completed by them
+        '''
+        try:
+            data = self.connection.recv(self.nbytes)
+        except ConnectionError:
+            # The connection was reset by the foreign host
+            self.peer_closed = True
+            raise
+        if not data:
+            # If the connection was closed by the foreign host
+            # raise a socket error
+            self.peer_closed = True
+            raise SocketClosed()
+        self.split_lines(data)
+
+    def has_buffered_packet(self):
+        """
+        Return True if a complete packet is cached, so recv_packet will
+        return without touching the socket
+        """
+        return len(self.lines) > 0
+
+    def take_buffered_bytes(self):
+        """
+        Remove and return all bytes received but not yet returned as a
+        packet, the complete lines as well as the incomplete one
+        """
+        data = b''.join((line.encode('utf-8') if type(line) is str else
+            line) + b'\n' for line in self.lines) + self.cache
+        self.lines.clear()
+        self.cache.clear()
+        return bytes(data)
+
+    def feed_bytes(self, data):
+        """
+        Frame bytes as if they were received from the wire, used to pass
+        the bytes taken from another communicator on
+        """
+        self.split_lines(data)
+
+    def recv_packet(self):
+        """
+        Receive a packet, aka a complete line, from the wire and use json
+        to deserialize it. Only lists are accepted as valid datatypes
+        """
+        while not self.lines:
+            self.receive_chunk()
+        return self.parse_line(self.lines.popleft())
+
+    def poll_packet(self):
+        """
+        Return a cached packet or receive the available bytes once,
+        which wont block if the connection is ready to read.
+        Returns None if no complete packet has been received yet
+        """
+        if not self.lines:
+            self.receive_chunk()
+            if not self.lines:
+                return None
+        return self.parse_line(self.lines.popleft())
+
+    def parse_line(self, line):
+        """
+        Deserialize a received line using json.
+        Only lists are accepted as valid datatypes
+        """
+        if type(line) is not str:
+            # The line isnt valid utf-8
+            self.send_packet(['ERROR', 'Invalid Packet'])
+            return ['ERROR', 'Invalid Packet']
+        try:
+            packet = loads(line)
+        except JSONDecodeError:
+            self.send_packet(['ERROR', 'Invalid Packet'])
+            return ['ERROR', 'Invalid Packet']
+        if type(packet) is not list:
+            self.send_packet(['ERROR', 'Invalid Packet'])
+            return ['ERROR', 'Invalid Packet']
+        return packet
+
+    def send_packet(self, tokens):
+        """
+        Send a python list by serialising it using json
+        """
+        self.send_bytes(encode_packet(tokens))
+
+    def send_bytes(self, data, coalesce_key=None):
+        """
+        Send a packet already encoded by encode_packet.
+        The coalesce key is only used by an OutboundQueue
+        """
+        with self.send_lock:
+            self.connection.sendall(data)
+
+    def settimeout(self, timeout):
+        """
+        Set the timeout of blocking receive operations in seconds
+        """
+        self.connection.settimeout(timeout)
+
+    def fileno(self):
+        """
+        Return the file descriptor to wait for received packets with
+        """
+        return self.connection.fileno()
+
+    def close(self):
+        """
+        Closes the socket the communicator uses and cleares the chache
+        """
+        self.connection.close()
+        self.lines.clear()
+        self.cache.clear()
+
+    def refresh(self, new_communicator):
+        """
+        Overwrite the connection the communicator uses
+        but leaves the cache untouched. This will be
+        used if a user reconnects while playing
+        """
+        self.connection = new_communicator.connection
+        self.peer_closed = False
+
+    def shutdown(self):
+        """
+        Shut the connection down without closing it, blocked send and
+        receive calls return and the next receive raises SocketClosed
+        """
+        self.connection.shutdown(socket.SHUT_RDWR)
+
+
+class OutboundQueue:
+    """
+    Decouples sending from the thread producing the packets.
+    Packets are appended to a bounded queue which is drained by a writer
+    thread, so a client with a full receive window cant block the sender.
+    A packet send with a coalesce key replaces an unsent packet with the
+    same key, e.g. an outdated part of the game state.
+    If a client falls behind by more than max_packets or max_bytes the
+    connection is shut down, the client has to reconnect.
+    All other attributes are the ones of the wrapped communicator.
+    """
+    def __init__(self, communicator, max_packets, max_bytes):
+        '''
+        communicator: The communicator to send the packets with
+        max_packets: The max amount of unsent packets
+        max_bytes: The max amount of unsent bytes
+        '''
+        self.communicator = communicator
+        self.max_packets = max_packets
+        self.max_bytes = max_bytes
+        self.condition = Condition()
+        # Entries of the form [coalesce_key, data], coalesced entries
+        # are set to None and skipped by the writer
+        self.entries = deque()
+        # The unsent entries stored under their coalesce key
+        self.keyed_entries = {}
+        self.packets = 0
+        self.nbytes = 0
+        self.disconnected = False
+        self.running = True
+        self.writer_thread = Thread(target=self.write_entries)
+        self.writer_thread.daemon = True
+        self.writer_thread.start()
+
+    def __getattr__(self, name):
+        return getattr(self.communicator, name)
+
+    def send_packet(self, tokens):
+        """
+        Enqueue a python list by serialising it using json
+        """
+        self.send_bytes(encode_packet(tokens))
+
+    def send_bytes(self, data, coalesce_key=None):
+        """
+        Enqueue a packet already encoded by encode_packet.
+        Never blocks, packets are dropped while the client is
+        disconnected
+        """
+        with self.condition:
+            if self.disconnected or not self.running:
+                return
+            if coalesce_key is not None:
+                old_entry = self.keyed_entries.pop(coalesce_key, None)
+                if old_entry is not None:
+                    self.remove_entry(old_entry)
+            if self.packets + 1 > self.max_packets or\
+                    self.nbytes + len(data) > self.max_bytes:
+                self.disconnect()
+                return
+            entry = [coalesce_key, data]
+            self.entries.append(entry)
+            if coalesce_key is not None:
+                self.keyed_entries[coalesce_key] = entry
+            self.packets += 1
+            self.nbytes += len(data)
+            self.condition.notify()
+
+    def remove_entry(self, entry):
+        """
+        Mark an unsent entry as removed, the lock has to be held
+        """
+        self.packets -= 1
+        self.nbytes -= len(entry[1])
+        entry[1] = None
+
+    def disconnect(self):
+        """
+        Drop all unsent packets and shut the connection down, the lock
+        has to be held
+        """
+        logger.info('Disconnecting slow client with ' + str(self.packets)
+            + ' unsent packets')
+        self.disconnected = True
+        self.clear()
+        try:
+            self.communicator.shutdown()
+        except OSError:
+            pass
+
+    def clear(self):
+        """
+        Drop all unsent packets, the lock has to be held
+        """
+        self.entries.clear()
+        self.keyed_entries.clear()
+        self.packets = 0
+        self.nbytes = 0
+
+    def write_entries(self):
+        """
+        Send the enqueued packets until the queue is stopped and drained
+        """
+        while True:
+            with self.condition:
+                while not self.entries and self.running:
+                    self.condition.wait()
+                if not self.entries:
+                    return
+                coalesce_key, data = self.entries.popleft()
+                if data is None:
+                    continue
+                if coalesce_key is not None:
+                    del self.keyed_entries[coalesce_key]
+                self.packets -= 1
+                self.nbytes -= len(data)
+            try:
+                self.communicator.send_bytes(data)
+            except IOError:
+                # If the connection is broken just do nothing, the
+                # receiving side will notice it
+                pass
+
+    def stop(self, timeout=0):
+        """
+        Stop accepting packets, the writer thread exits as soon as all
+        enqueued packets are sent. Waits up to timeout seconds for the
+        writer thread, None waits until all packets are sent.
+        Returns the wrapped communicator
+        """
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if timeout is None or timeout > 0:
+            self.writer_thread.join(timeout)
+        return self.communicator
+
+    def close(self):
+        """
+        Drop all unsent packets and close the wrapped communicator
+        """
+        with self.condition:
+            self.clear()
+        self.communicator.close()
+
+    def refresh(self, new_communicator):
+        """
+        Overwrite the connection the wrapped communicator uses, the
+        reconnected client can receive packets again
+        """
+        with self.condition:
+            self.clear()
+            self.communicator.refresh(new_communicator)
+            self.disconnected = False
@@ -0,0 +1,109 @@
+"""
+A microbenchmark of the packet framing. It compares the throughput of the
+shared StreamSocketCommunicator with the string based framing it replaced
+for many small packets per receive call, for packets of the size of the
+game state packets, a few of them per receive call, and for large packets
+arriving in many chunks. The throughput is measured once for the framing
+alone and once including the json deserialisation:
+
+python -m Akuga.NetworkBenchmark $nbytes
+"""
+import sys
+import time
+import socket
+from json import (loads, dumps)
+from threading import Thread
+from Akuga.Network import (SocketClosed, StreamSocketCommunicator)
+
+
+class StringSocketCommunicator:
+    """
+    The string based framing used before, only kept as the baseline of
+    the benchmark
+    """
+    def __init__(self, connection, nbytes):
+        self.connection = connection
+        self.nbytes = nbytes
+        self.cached_string = ''
+
+    def receive_line(self):
+        index = self.cached_string.find('\n')
+        while index < 0:
+            new_data = self.connection.recv(self.nbytes).decode('utf-8')
+            if not new_data:
+                raise SocketClosed()
+            self.cached_string += new_data
+            index = self.cached_string.find('\n')
+        complete_line = self.cached_string[:index]
+        self.cached_string = self.cached_string[index + 1:]
+        return complete_line
+
+    def recv_packet(self):
+        return loads(self.receive_line())
+
+
+def send_all(connection, data):
+    """
+    Send data and close the connection afterwards
+    """
+    connection.sendall(data)
+    connection.close()
+
+
+def measure(communicator_class, data, nbytes, decode):
+    """
+    Receive all packets in data using the communicator class, if decode
+    is False only the lines are framed without deserialising them.
+    Returns the number of packets and the elapsed seconds
+    """
+    receiver, sender = socket.socketpair()
+    # Large socket buffers so the sender is never the bottleneck
+    receiver.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 22)
+    sender_thread = Thread(target=send_all, args=(sender, data))
+    communicator = communicator_class(receiver, nbytes)
+    receive = communicator.recv_packet if decode else\
+        communicator.receive_line
+    packets = 0
+    start = time.perf_counter()
+    sender_thread.start()
+    try:
+        while True:
+            receive()
+            packets += 1
+    except SocketClosed:
+        pass
+    elapsed = time.perf_counter() - start
+    sender_thread.join()
+    receiver.close()
+    return packets, elapsed
+
+
+def workload(packet, amount):
+    """
+    Return the bytes of amount serialised copies of packet
+    """
+    return ((dumps(packet) + '\n') * amount).encode('utf-8')
+
+
+if __name__ == '__main__':
+    nbytes = int(sys.argv[1]) if len(sys.argv) > 1 else 1024
+    collection = ['Jumon' + str(i) for i in range(100000)]
+    workloads = [
+        ('small packets', workload(['MOVE_JUMON', 3, '2,4'], 200000)),
+        ('gamestate packets', workload(['JUMON_POSITION', 'Jumon', 3,
+            [1, 2], 'red', 'Player1'] * 4, 50000)),
+        ('large packets', workload(['SUCCESS', collection], 10)),
+    ]
+    print('recv buffer: ' + str(nbytes) + ' bytes')
+    print('%-18s %-8s %-8s %9s %10s %12s' % (
+        'workload', 'framing', 'json', 'packets', 'MB/s', 'packets/s'))
+    for name, data in workloads:
+        for decode in [False, True]:
+            for label, communicator_class in [
+                    ('string', StringSocketCommunicator),
+                    ('buffer', StreamSocketCommunicator)]:
+                packets, elapsed = measure(communicator_class, data,
+                    nbytes, decode)
+                print('%-18s %-8s %-8s %9d %10.1f %12.0f' % (name, label,
+                    'yes' if decode else 'no', packets,
+                    len(data) / elapsed / 1e6, packets / elapsed))
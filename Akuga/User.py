@@ -1,20 +1,24 @@
 import threading
-from json import loads
 from Akuga.JumonSet import serialize_set
 
 
-def user_from_database_response(response, communicator, client_address):
+def user_from_database_response(rows, communicator, client_address):
     """
-    Create and return a user instance created from
-    a databse response
+    Create and return a user instance created from the rows of a
+    GET_USER_BY_NAME response, the account row and one row per jumon
+    in the collection and in the sets of the user
     """
-    # Convert the coma delimited strings into jumon sets
-    collection = loads(response[3])
-    set1 = loads(response[4])
-    set2 = loads(response[5])
-    set3 = loads(response[6])
-    return User(response[0], response[1], response[2], collection,
-        set1, set2, set3, communicator, client_address)
+    collection = {}
+    sets = [{}, {}, {}]
+    for kind, set_index, *values in rows:
+        if kind == 'account':
+            name, pass_hash, credits = values
+        elif kind == 'collection':
+            collection[values[0]] = values[1]
+        elif kind == 'set':
+            sets[set_index][values[0]] = values[1]
+    return User(name, pass_hash, credits, collection, *sets, communicator,
+        client_address)
 
 
 class User:
@@ -1 +1 @@
-__all__ = ['EventDefinitions', 'GlobalDefinitions', 'NetworkProtocoll']
+__all__ = ['EventDefinitions', 'GlobalDefinitions', 'Network', 'NetworkProtocoll']